@@ -0,0 +1,151 @@
+"""Load generator for the local scoring service (scoring_service.py).
+
+`concurrency` client threads each keep one HTTP/1.1 connection open and send scoring requests back to back
+until `requests` have been sent (or `duration` seconds have passed), optionally paced to a total `rate` of
+requests per second. The records are drawn from the model's example records (GET /models/<name>) unless a CSV
+file is given. It reports client side throughput and latency percentiles next to the server's own /stats.
+
+    python -m churn_prediction_exercise.load_generator churn-logreg --requests 5000 --concurrency 32
+"""
+import json
+import time
+import logging
+import threading
+import http.client
+
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+import numpy as np
+
+logger = logging.getLogger()
+
+DEFAULT_URL = "http://127.0.0.1:8080"
+
+
+def _connection(url: str) -> http.client.HTTPConnection:
+    parts = urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+
+def _get(url: str, path: str) -> dict:
+    conn = _connection(url)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"GET {path} returned {response.status}: {body[:200]!r}")
+        return json.loads(body)
+    finally:
+        conn.close()
+
+
+def run_load(model: str, url: str = DEFAULT_URL, requests: int = 1000, concurrency: int = 8,
+             records_per_request: int = 1, rate: Optional[float] = None, duration: Optional[float] = None,
+             records: Optional[list] = None, seed: int = 0) -> dict:
+    """Sends the requests and returns the request count, errors, throughput and latency percentiles."""
+    if records is None:
+        records = _get(url, f"/models/{model}")["example_records"]
+    bodies = []
+    rng = np.random.default_rng(seed)
+    # a pool of prepared request bodies, so encoding JSON does not slow the clients down
+    for _ in range(min(requests, 1000)):
+        picked = [records[i] for i in rng.integers(0, len(records), records_per_request)]
+        bodies.append(json.dumps({"records": picked}).encode())
+
+    path = f"/models/{model}/predict"
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    sent = [0]
+    started = time.monotonic()
+    deadline = started + duration if duration else None
+
+    def next_request() -> Optional[int]:
+        with lock:
+            if sent[0] >= requests or (deadline and time.monotonic() >= deadline):
+                return None
+            sent[0] += 1
+            return sent[0] - 1
+
+    def client():
+        conn = _connection(url)
+        own = []
+        while True:
+            i = next_request()
+            if i is None:
+                break
+            if rate:
+                # request i is due at i / rate seconds after the start
+                wait = started + i / rate - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            begun = time.monotonic()
+            try:
+                conn.request("POST", path, body=bodies[i % len(bodies)],
+                             headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                body = response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"{response.status}: {body[:200]!r}")
+                own.append(time.monotonic() - begun)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                conn.close()
+                conn = _connection(url)
+        conn.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client, name=f"client-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    done = np.array(latencies)
+    result = {"model": model, "requests": len(done), "errors": len(errors), "concurrency": concurrency,
+              "records_per_request": records_per_request, "seconds": round(elapsed, 3),
+              "requests_per_second": round(len(done) / elapsed, 2),
+              "rows_per_second": round(len(done) * records_per_request / elapsed, 2)}
+    for q in (50, 90, 99):
+        result[f"p{q}_ms"] = round(float(np.percentile(done, q)) * 1000, 3) if len(done) else None
+    result["max_ms"] = round(float(done.max()) * 1000, 3) if len(done) else None
+    if errors:
+        logger.warning("%d requests failed, first: %s", len(errors), errors[0])
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Benchmark the churn scoring service on localhost")
+    parser.add_argument("model", help="Served model name")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Base URL of the scoring service")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8, help="Client threads, one connection each")
+    parser.add_argument("--records-per-request", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=None, help="Total requests per second (default: flat out)")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser.add_argument("--records", type=Path, default=None,
+                        help="CSV of customer records to send instead of the model's example records")
+    parser.add_argument("--output", type=Path, default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    sample = None
+    if args.records is not None:
+        import pandas as pd
+
+        sample = json.loads(pd.read_csv(args.records).to_json(orient="records"))
+    results = run_load(args.model, args.url, args.requests, args.concurrency, args.records_per_request,
+                       args.rate, args.duration, sample)
+    results["server"] = _get(args.url, "/stats").get(args.model)
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
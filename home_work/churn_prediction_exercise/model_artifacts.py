@@ -0,0 +1,205 @@
+"""Versioned artifacts of the fitted churn pipelines, for scoring outside the notebook.
+
+`export_pipeline` saves a fitted pipeline (preprocessor and classifier together) as the next version of a named
+model:
+
+    local_data/models/<name>/<version>/
+        pipeline.joblib   the fitted pipeline
+        meta.json         format, versions of python / scikit-learn, input columns and dtypes, sha256 of
+                          pipeline.joblib, optional metrics and a few example records; written last, its presence
+                          marks a complete artifact
+
+A version directory is assembled under a temporary name and renamed into place, so a reader never sees a
+partial artifact and two concurrent exports never get the same version. `load_artifact` verifies the checksum
+before unpickling, and refuses artifacts of an unknown format.
+
+    export_pipeline(models["Logistic Regression"], "churn-logreg", X_train, metrics={"roc_auc": 0.84})
+    artifact = load_artifact("churn-logreg")          # latest version, or load_artifact("churn-logreg", 3)
+    artifact.score(records)
+"""
+import sys
+import json
+import uuid
+import hashlib
+import logging
+import platform
+
+from pathlib import Path
+from typing import Optional
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from sklearn.utils.validation import check_is_fitted
+
+logger = logging.getLogger()
+
+# Bump whenever the layout of an artifact changes
+ARTIFACT_FORMAT = 1
+DEFAULT_MODELS_DIR = Path(__file__).parent / "local_data" / "models"
+PIPELINE_FILE = "pipeline.joblib"
+META_FILE = "meta.json"
+EXAMPLE_RECORDS = 100
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _plain(value):
+    """A numpy scalar as the python value, for JSON."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _records(frame: pd.DataFrame) -> list:
+    """The rows of `frame` as JSON-ready dicts, missing values as None."""
+    return json.loads(frame.to_json(orient="records"))
+
+
+class ModelArtifact:
+    """A loaded version of a model: the fitted pipeline and its metadata."""
+
+    def __init__(self, name: str, version: int, path: Path, pipeline, meta: dict):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.pipeline = pipeline
+        self.meta = meta
+
+    @property
+    def columns(self) -> list:
+        return self.meta["columns"]
+
+    def frame(self, records: list) -> pd.DataFrame:
+        """The records (dicts of column values) as a frame with the training columns and dtypes.
+
+        Missing columns become missing values, for the pipeline's imputers, and unknown keys are dropped."""
+        frame = pd.DataFrame.from_records(records, columns=self.columns)
+        for column in self.meta["numeric_columns"]:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+        return frame
+
+    def score(self, records: list) -> list:
+        """Predicted label and, for classifiers, the probability of the positive class for every record."""
+        frame = self.frame(records)
+        if not hasattr(self.pipeline, "predict_proba"):
+            return [{"label": _plain(label)} for label in self.pipeline.predict(frame)]
+        # one pass through the preprocessor: the labels follow from the probabilities as in predict()
+        probabilities = self.pipeline.predict_proba(frame)
+        labels = self.pipeline.classes_[probabilities.argmax(axis=1)]
+        return [{"label": _plain(label), "probability": float(p)}
+                for label, p in zip(labels, probabilities[:, -1])]
+
+
+def versions(name: str, models_dir: Optional[Path] = None) -> list:
+    """The complete versions of model `name`, oldest first."""
+    if models_dir is None:
+        models_dir = DEFAULT_MODELS_DIR
+    model_dir = models_dir / name
+    if not model_dir.exists():
+        return []
+    return sorted(int(p.name) for p in model_dir.iterdir() if p.name.isdigit() and (p / META_FILE).exists())
+
+
+def export_pipeline(pipeline, name: str, X: pd.DataFrame, models_dir: Optional[Path] = None,
+                    metrics: Optional[dict] = None) -> Path:
+    """Saves the fitted `pipeline`, trained on frames like X, as the next version of model `name`."""
+    check_is_fitted(pipeline)
+    if models_dir is None:
+        models_dir = DEFAULT_MODELS_DIR
+    model_dir = models_dir / name
+    model_dir.mkdir(parents=True, exist_ok=True)
+
+    tmp = model_dir / f".tmp-{uuid.uuid4().hex}"
+    tmp.mkdir()
+    joblib.dump(pipeline, tmp / PIPELINE_FILE)
+    meta = {
+        "format": ARTIFACT_FORMAT, "name": name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(), "sklearn": sklearn.__version__,
+        "estimator": type(pipeline).__name__,
+        "steps": [step for step, _ in getattr(pipeline, "steps", [])],
+        "columns": list(X.columns), "dtypes": {column: str(dtype) for column, dtype in X.dtypes.items()},
+        "numeric_columns": X.select_dtypes(include=["number", "bool"]).columns.tolist(),
+        "sha256": _sha256(tmp / PIPELINE_FILE),
+        "metrics": metrics or {},
+        "example_records": _records(X.head(EXAMPLE_RECORDS)),
+    }
+
+    while True:
+        version = (versions(name, models_dir) or [0])[-1] + 1
+        meta["version"] = version
+        (tmp / META_FILE).write_text(json.dumps(meta, indent=2))
+        try:
+            # rename fails when another export took this version meanwhile
+            tmp.rename(model_dir / str(version))
+            break
+        except OSError:
+            if not (model_dir / str(version)).exists():
+                raise
+    path = model_dir / str(version)
+    logger.info("exported %s version %d to %s", name, version, path)
+    return path
+
+
+def load_artifact(name: str, version: Optional[int] = None, models_dir: Optional[Path] = None) -> ModelArtifact:
+    """Loads version `version` (default: the latest) of model `name` after checking its integrity."""
+    if models_dir is None:
+        models_dir = DEFAULT_MODELS_DIR
+    if version is None:
+        available = versions(name, models_dir)
+        if not available:
+            raise ArtifactError(f"no exported versions of model {name!r} in {models_dir}")
+        version = available[-1]
+    path = models_dir / name / str(version)
+    try:
+        meta = json.loads((path / META_FILE).read_text())
+    except FileNotFoundError:
+        raise ArtifactError(f"model {name!r} has no version {version} in {models_dir}")
+    if meta.get("format") != ARTIFACT_FORMAT:
+        raise ArtifactError(f"{path} has artifact format {meta.get('format')}, expected {ARTIFACT_FORMAT}")
+    if _sha256(path / PIPELINE_FILE) != meta["sha256"]:
+        raise ArtifactError(f"{path / PIPELINE_FILE} does not match its checksum")
+    if meta["sklearn"] != sklearn.__version__:
+        logger.warning("%s was exported with scikit-learn %s, loading it with %s", path, meta["sklearn"],
+                       sklearn.__version__)
+    pipeline = joblib.load(path / PIPELINE_FILE)
+    logger.info("loaded %s version %d from %s", name, version, path)
+    return ModelArtifact(name, version, path, pipeline, meta)
+
+
+def parse_model_spec(spec: str) -> tuple:
+    """'name' or 'name:version' as (name, version or None)."""
+    name, _, version = spec.partition(":")
+    return name, int(version) if version else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="List or verify the exported churn model artifacts")
+    parser.add_argument("models", nargs="*", help="Models to verify, as name or name:version")
+    parser.add_argument("--models-dir", type=Path, default=DEFAULT_MODELS_DIR)
+    args = parser.parse_args()
+
+    if not args.models:
+        for model_dir in sorted(p for p in args.models_dir.glob("*") if p.is_dir()):
+            print(f"{model_dir.name:32} versions {versions(model_dir.name, args.models_dir)}")
+        sys.exit(0)
+    for spec in args.models:
+        artifact = load_artifact(*parse_model_spec(spec), models_dir=args.models_dir)
+        print(f"{artifact.name}:{artifact.version} ok, {len(artifact.columns)} columns, "
+              f"metrics {artifact.meta['metrics']}")
@@ -0,0 +1,326 @@
+"""Local HTTP scoring service for the exported churn pipelines.
+
+Every model (see model_artifacts.py) is loaded once at start-up. Requests are not scored one by one: each
+model has a micro-batcher thread that takes the first waiting request, keeps collecting requests until
+`max_batch_rows` records are gathered or `max_latency` seconds have passed since the first one arrived, and
+scores them all with a single vectorised `predict_proba` call. The deadline bounds the latency the batching
+adds to a request, and under concurrent load the per-call overhead of the pipeline is shared by the whole batch.
+When a batch fails, its requests are scored again one by one, so only the request that caused the error fails.
+
+Endpoints (JSON unless noted):
+    POST /models/<name>/predict   {"records": [{column: value, ...}, ...]} or {"record": {...}}
+    GET  /models, /models/<name>  loaded models and their metadata (including example records)
+    GET  /stats                   request / row counts, throughput, p50 / p90 / p99 latency, batch sizes
+    GET  /metrics                 the same in the Prometheus text format
+    GET  /health
+
+    python -m churn_prediction_exercise.scoring_service churn-logreg churn-forest:2 --port 8080
+"""
+import json
+import time
+import queue
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from churn_prediction_exercise.model_artifacts import (DEFAULT_MODELS_DIR, ArtifactError, ModelArtifact,
+                                                       load_artifact, parse_model_spec)
+
+logger = logging.getLogger()
+
+DEFAULT_PORT = 8080
+MAX_BATCH_ROWS = 256
+MAX_LATENCY = 0.005
+REQUEST_TIMEOUT = 30.0
+# latencies kept for the percentiles
+LATENCY_WINDOW = 10_000
+PROMETHEUS_PREFIX = "churn_scoring"
+
+
+class ScoringStats:
+    """Thread-safe request, row and batch counters and a sliding window of request latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_rows = 0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe_request(self, rows: int, seconds: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.rows += rows
+            self.errors += error
+            self.latencies.append(seconds)
+
+    def observe_batch(self, rows: int):
+        with self._lock:
+            self.batches += 1
+            self.batch_rows += rows
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = np.array(self.latencies)
+            elapsed = time.monotonic() - self.started
+            stats = {"requests": self.requests, "rows": self.rows, "errors": self.errors,
+                     "batches": self.batches, "uptime_seconds": round(elapsed, 3),
+                     "requests_per_second": round(self.requests / elapsed, 2) if elapsed > 0 else 0.0,
+                     "rows_per_second": round(self.rows / elapsed, 2) if elapsed > 0 else 0.0,
+                     "mean_batch_rows": round(self.batch_rows / self.batches, 2) if self.batches else 0.0}
+        for q in (50, 90, 99):
+            stats[f"p{q}_ms"] = round(float(np.percentile(latencies, q)) * 1000, 3) if len(latencies) else None
+        return stats
+
+
+class _Pending:
+    def __init__(self, records: list):
+        self.records = records
+        self.enqueued = time.monotonic()
+        self.future = Future()
+
+
+class MicroBatcher:
+    """Groups the concurrent requests of one model into batches scored with a single call."""
+
+    def __init__(self, artifact: ModelArtifact, max_batch_rows: int = MAX_BATCH_ROWS,
+                 max_latency: float = MAX_LATENCY):
+        self.artifact = artifact
+        self.max_batch_rows = max_batch_rows
+        self.max_latency = max_latency
+        self.stats = ScoringStats()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{artifact.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, records: list) -> Future:
+        pending = _Pending(records)
+        self._queue.put(pending)
+        return pending.future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first: _Pending) -> tuple:
+        """The batch started by `first`, and whether the batcher was closed while collecting it."""
+        batch, rows = [first], len(first.records)
+        deadline = first.enqueued + self.max_latency
+        while rows < self.max_batch_rows:
+            # past the deadline (e.g. the first request waited for the previous batch) only what is queued
+            # already joins the batch
+            timeout = deadline - time.monotonic()
+            try:
+                pending = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                return batch, True
+            batch.append(pending)
+            rows += len(pending.records)
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, closed = self._collect(first)
+            records = [record for pending in batch for record in pending.records]
+            try:
+                scores = self.artifact.score(records)
+            except Exception as e:
+                if len(batch) == 1:
+                    first.future.set_exception(e)
+                    continue
+                # one bad request must not fail the others batched with it: score them one by one, so the
+                # error stays with the request that caused it
+                logger.debug("batch of %d requests failed (%s), scoring them separately", len(batch), e)
+                for pending in batch:
+                    self._score_alone(pending)
+                continue
+            self.stats.observe_batch(len(records))
+            offset = 0
+            for pending in batch:
+                pending.future.set_result(scores[offset:offset + len(pending.records)])
+                offset += len(pending.records)
+
+    def _score_alone(self, pending: _Pending):
+        try:
+            scores = self.artifact.score(pending.records)
+        except Exception as e:
+            pending.future.set_exception(e)
+            return
+        self.stats.observe_batch(len(pending.records))
+        pending.future.set_result(scores)
+
+
+class ScoringService:
+    """The loaded models and their batchers."""
+
+    def __init__(self, artifacts: list, max_batch_rows: int = MAX_BATCH_ROWS, max_latency: float = MAX_LATENCY):
+        self.batchers = {artifact.name: MicroBatcher(artifact, max_batch_rows, max_latency)
+                         for artifact in artifacts}
+
+    def predict(self, name: str, records: list) -> dict:
+        batcher = self.batchers[name]
+        started = time.monotonic()
+        try:
+            scores = batcher.submit(records).result(timeout=REQUEST_TIMEOUT)
+        except Exception:
+            batcher.stats.observe_request(len(records), time.monotonic() - started, error=True)
+            raise
+        batcher.stats.observe_request(len(records), time.monotonic() - started)
+        return {"model": name, "version": batcher.artifact.version, "predictions": scores}
+
+    def stats(self) -> dict:
+        return {name: dict(batcher.stats.snapshot(), version=batcher.artifact.version)
+                for name, batcher in self.batchers.items()}
+
+    def prometheus(self) -> str:
+        metrics = {
+            "requests_total": ("counter", "Scoring requests", "requests"),
+            "rows_total": ("counter", "Scored records", "rows"),
+            "errors_total": ("counter", "Failed scoring requests", "errors"),
+            "batches_total": ("counter", "Vectorised scoring calls", "batches"),
+            "requests_per_second": ("gauge", "Requests per second since start", "requests_per_second"),
+            "rows_per_second": ("gauge", "Records per second since start", "rows_per_second"),
+            "mean_batch_rows": ("gauge", "Mean records per scoring call", "mean_batch_rows"),
+        }
+        stats = self.stats()
+        lines = []
+        for metric, (kind, help_text, field) in metrics.items():
+            name = f"{PROMETHEUS_PREFIX}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for model, values in sorted(stats.items()):
+                lines.append(f'{name}{{model="{model}",version="{values["version"]}"}} {values[field]:.6g}')
+        name = f"{PROMETHEUS_PREFIX}_latency_seconds"
+        lines += [f"# HELP {name} Request latency over the last {LATENCY_WINDOW} requests",
+                  f"# TYPE {name} summary"]
+        for model, values in sorted(stats.items()):
+            for q in (50, 90, 99):
+                if values[f"p{q}_ms"] is not None:
+                    lines.append(f'{name}{{model="{model}",quantile="0.{q}"}} {values[f"p{q}_ms"] / 1000:.6g}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        for batcher in self.batchers.values():
+            batcher.close()
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, so clients can reuse their connection
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self) -> ScoringService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "models": list(self.service.batchers)})
+        elif self.path == "/stats":
+            self._send(200, self.service.stats())
+        elif self.path == "/metrics":
+            self._send(200, self.service.prometheus(), "text/plain; version=0.0.4")
+        elif self.path == "/models":
+            self._send(200, {name: b.artifact.version for name, b in self.service.batchers.items()})
+        elif len(parts) == 2 and parts[0] == "models" and parts[1] in self.service.batchers:
+            self._send(200, self.service.batchers[parts[1]].artifact.meta)
+        else:
+            self._send(404, {"error": f"not found: {self.path}"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if len(parts) != 3 or parts[0] != "models" or parts[2] != "predict":
+            self._send(404, {"error": f"not found: {self.path}"})
+            return
+        if parts[1] not in self.service.batchers:
+            self._send(404, {"error": f"unknown model {parts[1]!r}"})
+            return
+        try:
+            payload = json.loads(body)
+            records = payload["records"] if "records" in payload else [payload["record"]]
+            if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+                raise ValueError("records must be a non-empty list of objects")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": f"bad request: {e}"})
+            return
+        try:
+            self._send(200, self.service.predict(parts[1], records))
+        except Exception as e:
+            logger.exception("scoring %d records with %s failed", len(records), parts[1])
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+
+class ScoringHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 resets connections when many clients connect at once
+    request_queue_size = 128
+
+
+def serve(models: list, host: str = "127.0.0.1", port: int = DEFAULT_PORT, models_dir: Optional[Path] = None,
+          max_batch_rows: int = MAX_BATCH_ROWS, max_latency: float = MAX_LATENCY) -> ScoringHTTPServer:
+    """Loads the models ('name' or 'name:version') and returns the server, call serve_forever() on it."""
+    artifacts = [load_artifact(*parse_model_spec(spec), models_dir=models_dir) for spec in models]
+    server = ScoringHTTPServer((host, port), ScoringRequestHandler)
+    server.service = ScoringService(artifacts, max_batch_rows, max_latency)
+    logger.info("scoring %s on http://%s:%d (batches of up to %d rows, %.1f ms deadline)",
+                ", ".join(f"{a.name}:{a.version}" for a in artifacts), host, server.server_address[1],
+                max_batch_rows, max_latency * 1000)
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Serve exported churn pipelines over HTTP with micro-batching")
+    parser.add_argument("models", nargs="+", help="Models to serve, as name or name:version")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--models-dir", type=Path, default=DEFAULT_MODELS_DIR)
+    parser.add_argument("--max-batch-rows", type=int, default=MAX_BATCH_ROWS,
+                        help="Score a batch as soon as it has this many records")
+    parser.add_argument("--max-latency-ms", type=float, default=MAX_LATENCY * 1000,
+                        help="Longest a request waits for its batch to fill up")
+    args = parser.parse_args()
+
+    try:
+        httpd = serve(args.models, args.host, args.port, args.models_dir, args.max_batch_rows,
+                      args.max_latency_ms / 1000)
+    except ArtifactError as e:
+        parser.exit(1, f"{e}\n")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        httpd.service.close()
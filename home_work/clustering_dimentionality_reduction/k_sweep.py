@@ -0,0 +1,244 @@
+"""Fast KMeans k selection for the clustering / dimensionality reduction workflow.
+
+`k_sweep` standardises the data once and fits every k of the sweep in a process pool that memory-maps the
+scaled matrix (in process when there is a single worker). All k start warm from prefixes of one shared
+k-means++ seeding computed for the largest k (the first k centres of a k-means++ seeding are a k-means++
+seeding for k), so each fit needs a single init instead of `n_init` restarts. With `mini_batch=True`
+MiniBatchKMeans is used for large frames.
+
+Per k the metrics come from one pass over the point to centre distances:
+- inertia, the sum of squared distances to the closest centre
+- davies_bouldin, from the mean distance of every cluster to its centre and the centre separations
+- simplified_silhouette, (b - a) / max(a, b) with a / b the distance to the own / nearest other centre, over
+  all rows in O(n k)
+- silhouette, the exact silhouette on a fixed random sample of `silhouette_sample` rows (the same rows for
+  every k), instead of the O(n^2) silhouette of the full frame
+
+`pca_projection` caches the 2D PCA projection used for the cluster plots under `local_data/k_sweep/`, keyed by
+a fingerprint of the data, so replotting another k does not refit it.
+
+    sweep = k_sweep(df[num_cols], ks=range(2, 10))
+    sweep.metrics                      # one row per k
+    projection, pca = pca_projection(sweep.X)
+    pca.transform(sweep.centers[5])    # centres of k=5 in the plot plane
+"""
+import os
+import time
+import logging
+import tempfile
+
+from pathlib import Path
+from typing import Iterable, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from sklearn.cluster import KMeans, MiniBatchKMeans, kmeans_plusplus
+from sklearn.decomposition import PCA
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+
+logger = logging.getLogger()
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / "local_data" / "k_sweep"
+DEFAULT_KS = range(2, 10)
+SILHOUETTE_SAMPLE = 5_000
+BATCH_SIZE = 4096
+# rows per block of the distance pass, bounds its memory to BLOCK_ROWS x k
+BLOCK_ROWS = 65_536
+
+
+class KSweep:
+    """The metrics, centres and labels of every k of a sweep over `X` (the scaled data when scaled)."""
+
+    def __init__(self, X: np.ndarray, scaler: Optional[StandardScaler], metrics: pd.DataFrame, centers: dict,
+                 labels: dict):
+        self.X = X
+        self.scaler = scaler
+        self.metrics = metrics
+        self.centers = centers
+        self.labels = labels
+
+    def best_k(self, by: str = "silhouette") -> int:
+        """The k with the best `by` metric (lowest for inertia and davies_bouldin, highest otherwise).
+
+        The sampled silhouette is missing when the sweep ran without a sample (silhouette_sample None or 0), the
+        simplified silhouette is used instead then."""
+        values = self.metrics[by]
+        if by == "silhouette" and values.isna().all():
+            logger.info("no sampled silhouette in this sweep, choosing k by the simplified silhouette")
+            values = self.metrics["simplified_silhouette"]
+        if values.isna().all():
+            raise ValueError(f"no k of the sweep has a {values.name} value")
+        return int(values.idxmin() if by in ("inertia", "davies_bouldin") else values.idxmax())
+
+
+def cluster_metrics(X: np.ndarray, centers: np.ndarray, sample: Optional[np.ndarray] = None) -> tuple:
+    """Labels, inertia, Davies-Bouldin, simplified silhouette and (sampled) silhouette of `centers` on X."""
+    k = len(centers)
+    labels = np.empty(len(X), dtype=np.int32)
+    own = np.empty(len(X))
+    other = np.empty(len(X))
+    for start in range(0, len(X), BLOCK_ROWS):
+        block = np.asarray(X[start:start + BLOCK_ROWS], dtype=np.float64)
+        distances = ((block ** 2).sum(axis=1)[:, None] - 2 * block @ centers.T + (centers ** 2).sum(axis=1))
+        np.maximum(distances, 0, out=distances)
+        closest = np.argpartition(distances, 1, axis=1)[:, :2] if k > 1 else np.zeros((len(block), 2), int)
+        first = np.take_along_axis(distances, closest, axis=1)
+        swap = first[:, 0] > first[:, 1]
+        first[swap] = first[swap][:, ::-1]
+        closest[swap] = closest[swap][:, ::-1]
+        labels[start:start + len(block)] = closest[:, 0]
+        own[start:start + len(block)] = first[:, 0]
+        other[start:start + len(block)] = first[:, 1]
+
+    inertia = float(own.sum())
+    own, other = np.sqrt(own), np.sqrt(other)
+    sizes = np.bincount(labels, minlength=k)
+    scatter = np.bincount(labels, weights=own, minlength=k) / np.maximum(sizes, 1)
+    separation = np.sqrt(((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+    # coinciding centres (and every centre with itself) contribute a ratio of 0, as in scikit-learn
+    separation[separation == 0] = np.inf
+    ratios = (scatter[:, None] + scatter[None, :]) / separation
+    davies_bouldin = float(ratios.max(axis=1).mean()) if k > 1 else np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        simplified = np.nan_to_num((other - own) / np.maximum(own, other))
+    silhouette = np.nan
+    if sample is not None and len(np.unique(labels[sample])) > 1:
+        silhouette = float(silhouette_score(np.asarray(X[sample]), labels[sample]))
+    return labels, inertia, davies_bouldin, float(simplified.mean()) if k > 1 else np.nan, silhouette
+
+
+_X = None
+_sample = None
+
+
+def _init_worker(x_path: str, sample: Optional[np.ndarray], threads: int):
+    global _X, _sample
+    _X = np.load(x_path, mmap_mode='r')
+    _sample = sample
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+
+
+def _fit_k(X: np.ndarray, sample: Optional[np.ndarray], init: np.ndarray, mini_batch: bool, batch_size: int,
+           max_iter: int, random_state: int) -> dict:
+    """Fits KMeans from the warm start `init` on X and computes the metrics of the result."""
+    k = len(init)
+    started = time.perf_counter()
+    if mini_batch:
+        model = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, batch_size=batch_size, max_iter=max_iter,
+                                random_state=random_state, compute_labels=False)
+    else:
+        model = KMeans(n_clusters=k, init=init, n_init=1, max_iter=max_iter, random_state=random_state)
+    model.fit(X)
+    fit_seconds = time.perf_counter() - started
+    centers = model.cluster_centers_
+    labels, inertia, davies_bouldin, simplified, silhouette = cluster_metrics(X, centers, sample)
+    return {"k": k, "inertia": inertia, "silhouette": silhouette, "simplified_silhouette": simplified,
+            "davies_bouldin": davies_bouldin, "n_iter": int(model.n_iter_), "fit_seconds": round(fit_seconds, 4),
+            "metrics_seconds": round(time.perf_counter() - started - fit_seconds, 4),
+            "centers": centers, "labels": labels}
+
+
+def _fit_k_in_worker(init: np.ndarray, mini_batch: bool, batch_size: int, max_iter: int, random_state: int) -> dict:
+    return _fit_k(_X, _sample, init, mini_batch, batch_size, max_iter, random_state)
+
+
+def k_sweep(data, ks: Iterable[int] = DEFAULT_KS, scale: bool = True, mini_batch: bool = False,
+            batch_size: int = BATCH_SIZE, max_iter: int = 300, silhouette_sample: Optional[int] = SILHOUETTE_SAMPLE,
+            workers: Optional[int] = None, random_state: int = 42) -> KSweep:
+    """Fits KMeans for every k in `ks` on `data` (scaled once unless scale=False) and collects the metrics."""
+    ks = sorted(set(ks))
+    X = np.ascontiguousarray(data, dtype=np.float64)
+    scaler = None
+    if scale:
+        scaler = StandardScaler()
+        X = scaler.fit_transform(X)
+    if workers is None:
+        workers = min(len(ks), os.cpu_count() or 1)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    rng = np.random.default_rng(random_state)
+    sample = None
+    if silhouette_sample:
+        sample = np.sort(rng.choice(len(X), size=min(silhouette_sample, len(X)), replace=False))
+    seeds, _ = kmeans_plusplus(X, n_clusters=max(ks), random_state=random_state)
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = [_fit_k(X, sample, seeds[:k], mini_batch, batch_size, max_iter, random_state) for k in ks]
+    else:
+        with tempfile.TemporaryDirectory(prefix="k_sweep-") as tmp:
+            x_path = Path(tmp) / "X.npy"
+            np.save(x_path, X)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(str(x_path), sample, threads)) as executor:
+                # the largest k takes longest, start it first
+                futures = [executor.submit(_fit_k_in_worker, seeds[:k], mini_batch, batch_size, max_iter,
+                                           random_state) for k in reversed(ks)]
+                results = [future.result() for future in futures]
+
+    results.sort(key=lambda r: r["k"])
+    centers = {r["k"]: r.pop("centers") for r in results}
+    labels = {r["k"]: r.pop("labels") for r in results}
+    metrics = pd.DataFrame(results).set_index("k")
+    logger.info("k sweep over %s on %d x %d rows done in %.2fs", ks, X.shape[0], X.shape[1],
+                time.perf_counter() - started)
+    return KSweep(X, scaler, metrics, centers, labels)
+
+
+def pca_projection(X: np.ndarray, n_components: int = 2, cache_dir: Optional[Path] = None,
+                   random_state: int = 42) -> tuple:
+    """The PCA projection of X and the fitted PCA, cached by a fingerprint of X."""
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    path = cache_dir / f"pca-{n_components}-{joblib.hash((np.asarray(X), random_state))}.joblib"
+    if path.exists():
+        cached = joblib.load(path)
+        logger.debug("reusing PCA projection from %s", path)
+        return cached["projection"], cached["pca"]
+    pca = PCA(n_components=n_components, random_state=random_state)
+    projection = pca.fit_transform(X)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    joblib.dump({"projection": projection, "pca": pca}, tmp)
+    tmp.replace(path)
+    return projection, pca
+
+
+def read_numeric(path: Path) -> pd.DataFrame:
+    """The numeric columns of a CSV (or of the first CSV of a zip), coerced and with missing values as 0."""
+    df = pd.read_csv(path, low_memory=False)
+    numeric = df.select_dtypes(include=[np.number]).columns.tolist()
+    return df[numeric].apply(pd.to_numeric, errors='coerce').fillna(0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="KMeans k sweep with inertia, silhouette and Davies-Bouldin")
+    parser.add_argument("data", type=Path, help="CSV file, or zip with one CSV (e.g. 'ASA All NBA Raw Data.zip')")
+    parser.add_argument("--k-min", type=int, default=2)
+    parser.add_argument("--k-max", type=int, default=9)
+    parser.add_argument("--no-scale", action="store_true", help="Cluster the raw instead of the scaled columns")
+    parser.add_argument("--mini-batch", action="store_true", help="Use MiniBatchKMeans")
+    parser.add_argument("--silhouette-sample", type=int, default=SILHOUETTE_SAMPLE,
+                        help="Rows of the sampled silhouette")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    frame = read_numeric(args.data)
+    sweep = k_sweep(frame, ks=range(args.k_min, args.k_max + 1), scale=not args.no_scale,
+                    mini_batch=args.mini_batch, silhouette_sample=args.silhouette_sample, workers=args.workers)
+    print(sweep.metrics.to_string())
+    by = "silhouette" if args.silhouette_sample else "simplified_silhouette"
+    print(f"best k by {by}: {sweep.best_k(by)}, by Davies-Bouldin: {sweep.best_k('davies_bouldin')}")
@@ -0,0 +1,388 @@
+"""Fold-cached, parallel hyperparameter search shared by the modelling notebooks.
+
+GridSearchCV over `Pipeline([('pre', preprocessor), ('model', estimator)])` refits the same preprocessor for
+every candidate of every fold. Here the preprocessor is fitted once per fold instead: the transformed train and
+validation matrices of each fold are saved under `local_data/search/folds/<key>/` (`key` fingerprints X, y,
+the preprocessor and the splitter, so they are reused across searches and sessions) and memory-mapped by the
+workers. Only the model step is fitted per candidate.
+
+Candidates x folds run in a process pool. Every worker limits the BLAS/OpenMP pools to `threads_per_worker`
+threads and the same value is passed to estimators that thread by themselves (`n_jobs`, `thread_count`,
+`nthread`), so `workers x threads_per_worker` stays at the number of CPUs instead of oversubscribing them.
+
+With `halving=True` each estimator's grid is searched by successive halving: all candidates are evaluated with
+a small budget (training rows, or an estimator parameter such as `n_estimators`), the best 1/`factor` of them
+go on to `factor` times the budget, and so on until the full budget.
+
+Every finished (candidate, fold, budget) evaluation is appended to `results.jsonl` of the search directory as
+soon as it completes, so an interrupted search resumes where it stopped when it is run again.
+
+    search = HyperparameterSearch(preprocessor, estimators, param_grids, scoring='roc_auc', cv=5)
+    result = search.fit(X_train, y_train)
+    print(result.summary())
+    model = result.best_pipeline().fit(X_train, y_train)
+"""
+import os
+import json
+import math
+import time
+import logging
+
+from pathlib import Path
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, check_cv
+from sklearn.pipeline import Pipeline
+
+logger = logging.getLogger()
+
+# Bump whenever the fold files or the result records change, so cached ones are not reused
+SEARCH_VERSION = 1
+DEFAULT_CACHE_DIR = Path(__file__).parent / "local_data" / "search"
+N_SAMPLES = "n_samples"
+MODEL_STEP = "model"
+THREAD_PARAMS = ("n_jobs", "thread_count", "nthread")
+THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def _estimator_params(grid: dict) -> dict:
+    """The grid with the `model__` prefix of the notebooks' pipeline grids removed."""
+    prefix = f"{MODEL_STEP}__"
+    return {key[len(prefix):] if key.startswith(prefix) else key: values for key, values in grid.items()}
+
+
+def _take(X, rows: np.ndarray):
+    return X.iloc[rows] if hasattr(X, "iloc") else X[rows]
+
+
+class FoldCache:
+    """The preprocessed train / validation matrices of every cross-validation fold, fitted once."""
+
+    def __init__(self, preprocessor, cv, cache_dir: Path):
+        self.preprocessor = preprocessor
+        self.cv = cv
+        self.cache_dir = cache_dir
+
+    def prepare(self, X, y) -> list:
+        """Fits and saves the preprocessed folds unless they are cached. Returns the fold file paths."""
+        key = joblib.hash((SEARCH_VERSION, X, y, self.preprocessor, self.cv))
+        folds_dir = self.cache_dir / "folds" / key
+        meta_path = folds_dir / "meta.json"
+        if meta_path.exists():
+            paths = [folds_dir / name for name in json.loads(meta_path.read_text())["folds"]]
+            logger.info("reusing %d preprocessed folds from %s", len(paths), folds_dir)
+            return paths
+
+        folds_dir.mkdir(parents=True, exist_ok=True)
+        y = np.asarray(y)
+        paths = []
+        for i, (train, val) in enumerate(self.cv.split(X, y)):
+            started = time.perf_counter()
+            X_train, X_val = _take(X, train), _take(X, val)
+            if self.preprocessor is not None:
+                preprocessor = clone(self.preprocessor)
+                X_train = preprocessor.fit_transform(X_train, y[train])
+                X_val = preprocessor.transform(X_val)
+            # a fixed random order of the training rows, its prefixes are the n_samples budgets
+            order = np.random.default_rng([SEARCH_VERSION, i]).permutation(len(train))
+            path = folds_dir / f"fold-{i}.joblib"
+            tmp = path.with_name(path.name + ".tmp")
+            joblib.dump({"X_train": X_train, "y_train": y[train], "X_val": X_val, "y_val": y[val],
+                         "order": order}, tmp)
+            tmp.replace(path)
+            paths.append(path)
+            logger.debug("preprocessed fold %d (%d train / %d validation rows) in %.2fs", i, len(train),
+                         len(val), time.perf_counter() - started)
+        # meta.json goes last: its presence marks a complete set of folds
+        meta_path.write_text(json.dumps({"version": SEARCH_VERSION, "folds": [p.name for p in paths]}, indent=2))
+        logger.info("preprocessed %d folds into %s", len(paths), folds_dir)
+        return paths
+
+
+_folds = {}
+_threads = None
+
+
+def _init_worker(threads: int):
+    """Limits the native thread pools of a worker process to `threads`."""
+    global _threads
+    _threads = threads
+    for name in THREAD_ENV:
+        os.environ[name] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+
+
+def _load_fold(path: str) -> dict:
+    """The fold at `path`, memory-mapped and kept for the following tasks of this worker."""
+    if path not in _folds:
+        _folds[path] = joblib.load(path, mmap_mode='r')
+    return _folds[path]
+
+
+def _limit_threads(estimator, threads: Optional[int]):
+    """Caps the estimator's own threads at `threads` (xgboost and catboost default to all cores)."""
+    if threads is None:
+        return estimator
+    # scikit-learn runs n_jobs=None as a single job
+    default_single = type(estimator).__module__.startswith("sklearn.")
+    limits = {}
+    for name, value in estimator.get_params(deep=False).items():
+        if name not in THREAD_PARAMS or (value is None and default_single):
+            continue
+        if value is None or value < 0 or value > threads:
+            limits[name] = threads
+    return estimator.set_params(**limits)
+
+
+def _evaluate(fold_path: str, estimator, params: dict, resource: str, budget: int, scoring) -> dict:
+    """Fits `estimator` with `params` on one fold's training rows (within `budget`) and scores it."""
+    fold = _load_fold(fold_path)
+    X_train, y_train = fold["X_train"], fold["y_train"]
+    params = dict(params)
+    if resource == N_SAMPLES:
+        if budget < len(y_train):
+            rows = np.sort(fold["order"][:budget])
+            X_train, y_train = _take(X_train, rows), y_train[rows]
+    else:
+        params[resource] = budget
+    record = {"score": None, "fit_seconds": None, "score_seconds": None, "error": None}
+    try:
+        model = _limit_threads(clone(estimator).set_params(**params), _threads)
+        started = time.perf_counter()
+        model.fit(X_train, y_train)
+        record["fit_seconds"] = round(time.perf_counter() - started, 4)
+        started = time.perf_counter()
+        record["score"] = float(check_scoring(model, scoring)(model, fold["X_val"], fold["y_val"]))
+        record["score_seconds"] = round(time.perf_counter() - started, 4)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+class SearchResult:
+    """The evaluations of a search, one row per (estimator, candidate, budget, fold)."""
+
+    def __init__(self, records: pd.DataFrame, preprocessor, estimators: dict, candidates: dict, resources: dict):
+        self.records = records
+        self.preprocessor = preprocessor
+        self.estimators = estimators
+        self.candidates = candidates
+        self.resources = resources
+
+    def params(self, estimator: str, candidate: str, budget: int) -> dict:
+        """The estimator parameters of an evaluation: the candidate's, plus the budget when it is a parameter."""
+        params = dict(self.candidates[(estimator, candidate)])
+        if self.resources[estimator] != N_SAMPLES:
+            params[self.resources[estimator]] = int(budget)
+        return params
+
+    @property
+    def cv_results(self) -> pd.DataFrame:
+        """Mean / std score and fit time per estimator, candidate and budget, best first.
+
+        `params` are the parameters the evaluations were fitted with, including a budget parameter."""
+        grouped = self.records.groupby(["estimator", "candidate", "budget"])
+        table = grouped.agg(mean_score=("score", "mean"), std_score=("score", "std"),
+                            folds=("fold", "count"), errors=("error", "count"),
+                            mean_fit_seconds=("fit_seconds", "mean")).reset_index()
+        table["params"] = [self.params(e, c, b)
+                           for e, c, b in zip(table["estimator"], table["candidate"], table["budget"])]
+        return table.sort_values(["estimator", "budget", "mean_score"], ascending=[True, False, False],
+                                 ignore_index=True)
+
+    def _final(self) -> pd.DataFrame:
+        """The candidates evaluated with the largest budget of their estimator, without failed ones."""
+        table = self.cv_results.dropna(subset=["mean_score"])
+        return table[table["budget"] == table.groupby("estimator")["budget"].transform("max")]
+
+    def summary(self) -> pd.DataFrame:
+        """The best candidate of every estimator, best estimator first."""
+        final = self._final()
+        best = final.loc[final.groupby("estimator")["mean_score"].idxmax()]
+        return best.sort_values("mean_score", ascending=False, ignore_index=True)[
+            ["estimator", "params", "mean_score", "std_score", "budget", "mean_fit_seconds"]]
+
+    def best_params(self, estimator: Optional[str] = None) -> tuple:
+        """(estimator name, parameters) of the best candidate, overall or of one estimator.
+
+        When the halving resource is an estimator parameter, the parameters include its final budget."""
+        final = self._final()
+        if estimator is not None:
+            final = final[final["estimator"] == estimator]
+        if final.empty:
+            raise ValueError(f"no successful evaluation for {estimator or 'any estimator'}")
+        best = final.loc[final["mean_score"].idxmax()]
+        return best["estimator"], dict(best["params"])
+
+    def best_pipeline(self, estimator: Optional[str] = None) -> Pipeline:
+        """An unfitted `Pipeline([('pre', preprocessor), ('model', best estimator)])`."""
+        name, params = self.best_params(estimator)
+        model = clone(self.estimators[name]).set_params(**params)
+        if self.preprocessor is None:
+            return Pipeline([(MODEL_STEP, model)])
+        return Pipeline([("pre", clone(self.preprocessor)), (MODEL_STEP, model)])
+
+
+class HyperparameterSearch:
+    """Grid search (optionally successive halving) over several estimators behind one shared preprocessor.
+
+    `estimators` maps names to unfitted estimators and `param_grids` the same names to grids of their
+    parameters (plain or with the `model__` prefix). `resource` is the budget of the halving: "n_samples"
+    (training rows) or the name of an integer estimator parameter such as "n_estimators"; `max_resources`
+    defaults to all training rows for "n_samples" and is required otherwise; the budget is then set on every
+    candidate, so the parameter must not also be in the grid. Estimators without that parameter are searched
+    without halving.
+    """
+
+    def __init__(self, preprocessor, estimators: dict, param_grids: dict, scoring=None, cv=5,
+                 halving: bool = False, factor: int = 3, resource: str = N_SAMPLES,
+                 min_resources: Optional[int] = None, max_resources: Optional[int] = None,
+                 workers: Optional[int] = None, threads_per_worker: Optional[int] = None,
+                 cache_dir: Optional[Path] = None):
+        self.preprocessor = preprocessor
+        self.estimators = estimators
+        self.param_grids = param_grids
+        self.scoring = scoring
+        self.cv = cv
+        self.halving = halving
+        self.factor = factor
+        self.resource = resource
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+        self.workers = workers or os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.cache_dir = cache_dir if cache_dir is not None else DEFAULT_CACHE_DIR
+
+    def _resource(self, estimator) -> str:
+        """The halving resource of `estimator`: `resource`, or all training rows if it has no such parameter."""
+        if self.resource == N_SAMPLES or self.resource in estimator.get_params():
+            return self.resource
+        return N_SAMPLES
+
+    def _budgets(self, resource: str, n_candidates: int, n_train: int) -> list:
+        """The budget of every rung for `n_candidates` candidates, increasing by `factor` up to the maximum."""
+        if resource != self.resource:
+            return [n_train]
+        max_resources = self.max_resources
+        if max_resources is None:
+            if resource != N_SAMPLES:
+                raise ValueError(f"max_resources is required when halving over {resource!r}")
+            max_resources = n_train
+        if not self.halving or n_candidates == 1:
+            return [max_resources]
+        # enough rungs to narrow the candidates down to one
+        rungs = math.ceil(math.log(n_candidates, self.factor)) + 1
+        min_resources = self.min_resources or max(1, max_resources // self.factor ** (rungs - 1))
+        budgets = []
+        budget = min_resources
+        while budget < max_resources and len(budgets) < rungs - 1:
+            budgets.append(int(budget))
+            budget *= self.factor
+        return budgets + [max_resources]
+
+    def _search_dir(self, fold_paths: list) -> Path:
+        key = joblib.hash((SEARCH_VERSION, fold_paths[0].parent.name, self.estimators,
+                           self.param_grids, self.scoring, self.halving, self.factor, self.resource,
+                           self.min_resources, self.max_resources))
+        return self.cache_dir / "runs" / key
+
+    def fit(self, X, y) -> SearchResult:
+        """Runs (or resumes) the search on X, y and returns its evaluations."""
+        first = next(iter(self.estimators.values()))
+        cv = check_cv(self.cv, y, classifier=is_classifier(first))
+        fold_paths = FoldCache(self.preprocessor, cv, self.cache_dir).prepare(X, y)
+        n_train = min(len(joblib.load(p, mmap_mode='r')["y_train"]) for p in fold_paths)
+
+        candidates = {}
+        survivors = {}
+        resources = {}
+        budgets = {}
+        for name in self.estimators:
+            grid_params = _estimator_params(self.param_grids.get(name, {}))
+            resources[name] = self._resource(self.estimators[name])
+            if resources[name] in grid_params:
+                raise ValueError(f"{resources[name]!r} is both the search resource and in the grid of {name}, "
+                                 f"the budget would override the grid values")
+            grid = list(ParameterGrid(grid_params))
+            for params in grid:
+                candidates[(name, joblib.hash(params))] = params
+            survivors[name] = [joblib.hash(params) for params in grid]
+            budgets[name] = self._budgets(resources[name], len(grid), n_train)
+
+        search_dir = self._search_dir(fold_paths)
+        search_dir.mkdir(parents=True, exist_ok=True)
+        results_path = search_dir / "results.jsonl"
+        done = {}
+        if results_path.exists():
+            with open(results_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of an interrupted search may be cut off
+                        continue
+                    done[(entry["estimator"], entry["candidate"], entry["budget"], entry["fold"])] = entry
+            logger.info("resuming search in %s: %d evaluations already done", search_dir, len(done))
+
+        logger.info("searching %d candidates of %d estimators x %d folds with %d workers x %d threads",
+                    len(candidates), len(self.estimators), len(fold_paths), self.workers, self.threads_per_worker)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.threads_per_worker,)) as executor, \
+                open(results_path, "a") as results_file:
+            rung = 0
+            while any(rung < len(budgets[name]) for name in self.estimators):
+                active = [name for name in self.estimators if rung < len(budgets[name]) and survivors[name]]
+                futures = {}
+                for name in active:
+                    budget = budgets[name][rung]
+                    logger.info("%s rung %d: %d candidates with %s=%d", name, rung, len(survivors[name]),
+                                resources[name], budget)
+                    for candidate in survivors[name]:
+                        for fold, path in enumerate(fold_paths):
+                            if (name, candidate, budget, fold) in done:
+                                continue
+                            future = executor.submit(_evaluate, str(path), self.estimators[name],
+                                                     candidates[(name, candidate)], resources[name], budget,
+                                                     self.scoring)
+                            futures[future] = (name, candidate, budget, fold)
+                for future in as_completed(futures):
+                    name, candidate, budget, fold = futures[future]
+                    entry = dict(future.result(), estimator=name, candidate=candidate, budget=budget, fold=fold,
+                                 params=candidates[(name, candidate)])
+                    results_file.write(json.dumps(entry, default=repr) + "\n")
+                    results_file.flush()
+                    done[futures[future]] = entry
+                    if entry["error"] is not None:
+                        logger.warning("%s %s fold %d failed: %s", name, entry["params"], fold, entry["error"])
+
+                for name in active:
+                    if rung + 1 < len(budgets[name]):
+                        survivors[name] = self._promote(name, survivors[name], budgets[name][rung],
+                                                        len(fold_paths), done)
+                rung += 1
+
+        records = pd.DataFrame([entry for entry in done.values() if (entry["estimator"], entry["candidate"])
+                                in candidates])
+        return SearchResult(records, self.preprocessor, self.estimators, candidates, resources)
+
+    def _promote(self, name: str, candidates: list, budget: int, n_folds: int, done: dict) -> list:
+        """The best 1/factor of `candidates` by mean score at `budget`; failed ones never advance."""
+        scores = []
+        for candidate in candidates:
+            folds = [done[(name, candidate, budget, fold)]["score"] for fold in range(n_folds)]
+            if all(score is not None for score in folds):
+                scores.append((float(np.mean(folds)), candidate))
+        keep = max(1, math.ceil(len(candidates) / self.factor))
+        # ties are broken by candidate key, so a resumed search promotes the same candidates
+        return [candidate for _, candidate in sorted(scores, key=lambda s: (-s[0], s[1]))[:keep]]
@@ -0,0 +1,5 @@
+import sys
+
+from movielens_eda_exercise.cli import main
+
+sys.exit(main())
@@ -0,0 +1,174 @@
+"""Dialect-native bulk loading of MovieLens DataFrames into the ORM-defined tables.
+
+The loader is picked from `BULK_LOADERS` by `conn.dialect.name`:
+- mysql: `LOAD DATA LOCAL INFILE` from a temporary CSV file (needs `local_infile` on client and server)
+- sqlite: batched `executemany` inside the caller's transaction, on a WAL journal
+- postgresql: `COPY ... FROM STDIN` through the raw DBAPI cursor
+Any other dialect falls back to a SQLAlchemy multi-row insert.
+
+All loaders run on the connection they are given, so the caller owns the transaction.
+"""
+import os
+import logging
+import tempfile
+
+from io import StringIO
+
+import pandas as pd
+
+from sqlalchemy import Integer, Table, event
+from sqlalchemy.engine import Connection
+
+from movielens_eda_exercise.models.support import to_snake_case
+
+logger = logging.getLogger()
+
+SQLITE_BATCH_SIZE = 50_000
+
+BULK_LOADERS = {}
+
+
+def register_bulk_loader(dialect_name: str):
+    """Registers the decorated function as the bulk loader for `dialect_name`."""
+    def decorator(func):
+        BULK_LOADERS[dialect_name] = func
+        return func
+    return decorator
+
+
+def frame_for_table(table: Table, df: pd.DataFrame) -> pd.DataFrame:
+    """Renames CSV columns to their snake_case ORM names and keeps only the columns the table defines."""
+    renamed = df.rename(columns=to_snake_case)
+    columns = [c.name for c in table.columns if c.name in renamed.columns]
+    frame = renamed[columns]
+    # integer columns with missing values are parsed as float, write them back as (nullable) integers
+    float_ints = [c for c in columns
+                  if isinstance(table.c[c].type, Integer) and pd.api.types.is_float_dtype(frame[c])]
+    if float_ints:
+        frame = frame.astype({c: 'Int64' for c in float_ints})
+    return frame
+
+
+def _records(df: pd.DataFrame) -> list:
+    """Returns the rows of `df` as tuples of Python scalars, with missing values as None."""
+    if df.isna().to_numpy().any():
+        df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def _csv_buffer(df: pd.DataFrame, na_rep: str) -> StringIO:
+    buffer = StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep=na_rep, lineterminator='\n')
+    buffer.seek(0)
+    return buffer
+
+
+def _sql_path(path: str) -> str:
+    """Formats a local file path as the body of a MySQL string literal."""
+    return path.replace('\\', '/').replace("'", "''")
+
+
+def truncate_table(conn: Connection, table: Table):
+    """Empties `table` while keeping its definition (and indexes) intact."""
+    if conn.dialect.name in ('mysql', 'postgresql'):
+        conn.exec_driver_sql(f"TRUNCATE TABLE {conn.dialect.identifier_preparer.format_table(table)}")
+    else:
+        conn.execute(table.delete())
+
+
+def write_load_data_csv(df: pd.DataFrame, f):
+    """Writes `df` to the text file `f` in the format the LOAD DATA statement of `load_mysql` reads."""
+    # backslash is the LOAD DATA escape character, so escape it in the text columns (genres and tags are
+    # categoricals)
+    df = df.copy()
+    for col in df.select_dtypes(include=['object', 'string', 'category']).columns:
+        escaped = df[col].astype(str).str.replace('\\', '\\\\', regex=False)
+        df[col] = escaped.where(df[col].notna(), None)
+    df.to_csv(f, index=False, header=False, na_rep='\\N', lineterminator='\n')
+
+
+@register_bulk_loader('mysql')
+def load_mysql(conn: Connection, table: Table, df: pd.DataFrame):
+    """Loads `df` with LOAD DATA LOCAL INFILE through the pymysql connection."""
+    preparer = conn.dialect.identifier_preparer
+    fd, tmp_name = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            write_load_data_csv(df, f)
+        columns = ", ".join(preparer.quote(c) for c in df.columns)
+        conn.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE '{_sql_path(tmp_name)}' INTO TABLE {preparer.format_table(table)} "
+            f"CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\\\\' "
+            f"LINES TERMINATED BY '\\n' ({columns})"
+        )
+    finally:
+        os.remove(tmp_name)
+
+
+@register_bulk_loader('sqlite')
+def load_sqlite(conn: Connection, table: Table, df: pd.DataFrame):
+    """Loads `df` with executemany in batches of SQLITE_BATCH_SIZE rows inside the caller's transaction."""
+    preparer = conn.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(c) for c in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    sql = f"INSERT INTO {preparer.format_table(table)} ({columns}) VALUES ({placeholders})"
+    for start in range(0, len(df), SQLITE_BATCH_SIZE):
+        conn.exec_driver_sql(sql, _records(df.iloc[start:start + SQLITE_BATCH_SIZE]))
+
+
+@register_bulk_loader('postgresql')
+def load_postgresql(conn: Connection, table: Table, df: pd.DataFrame):
+    """Loads `df` with COPY FROM STDIN (psycopg2 `copy_expert` or psycopg 3 `copy`)."""
+    preparer = conn.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(c) for c in df.columns)
+    sql = f"COPY {preparer.format_table(table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '')"
+    buffer = _csv_buffer(df, na_rep='')
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            cursor.copy_expert(sql, buffer)
+        else:
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def load_generic(conn: Connection, table: Table, df: pd.DataFrame):
+    """Fallback for dialects without a native loader: SQLAlchemy executemany on the table's insert()."""
+    rows = _records(df)
+    conn.execute(table.insert(), [dict(zip(df.columns, row)) for row in rows])
+
+
+def _tune_sqlite_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def tune_for_bulk_load(engine):
+    """Applies dialect-specific settings that speed up bulk loading.
+
+    On SQLite the database is switched to the WAL journal and every new connection relaxes `synchronous`,
+    which is safe with WAL and avoids an fsync per transaction."""
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        if not event.contains(engine, 'connect', _tune_sqlite_connection):
+            event.listen(engine, 'connect', _tune_sqlite_connection)
+        # pooled connections were opened before the listener existed
+        engine.dispose()
+
+
+def bulk_load(conn: Connection, table: Table, df: pd.DataFrame) -> int:
+    """Loads `df` (CSV column names) into `table` with the native loader of the connection's dialect.
+
+    Returns the number of rows sent to the database."""
+    if df.empty:
+        return 0
+    df = frame_for_table(table, df)
+    loader = BULK_LOADERS.get(conn.dialect.name, load_generic)
+    logger.debug("bulk loading %d rows into %s with %s", len(df), table.name, loader.__name__)
+    loader(conn, table, df)
+    return len(df)
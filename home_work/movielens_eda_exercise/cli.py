@@ -0,0 +1,181 @@
+"""Single command line entry point: `python -m movielens_eda_exercise <command>`.
+
+    download   fetch (or refresh) the MovieLens archive
+    load       download and load the archive into the database
+    eda        profile the loaded tables (pandas, sweetviz, sql or streaming)
+    features   build the per-movie feature store of the regression exercise
+
+Only argparse is imported up front. Every command imports what it needs when it runs, and the database engine
+is created on first use from MOVIELENS_DATABASE_URL (see database.py), so `--help` and the download command do
+not load pandas, SQLAlchemy drivers or the profiling libraries and never touch the database.
+"""
+import sys
+import logging
+import argparse
+
+from pathlib import Path
+
+from movielens_eda_exercise.datasets import DATASETS, get_dataset, select_dataset
+
+logger = logging.getLogger()
+
+EDA_BACKENDS = ["pandas", "sweetviz", "sql", "streaming"]
+
+
+def run_download(args) -> int:
+    from movielens_eda_exercise.downloader import DownloadError, download_archive
+
+    try:
+        dataset = get_dataset()
+        download_archive(args.url or dataset.url, args.zip_path or dataset.zip_path, reload=args.reload)
+    except DownloadError as e:
+        logger.error("download failed: %s", e)
+        return 1
+    return 0
+
+
+def run_load(args) -> int:
+    if args.pipeline:
+        from movielens_eda_exercise.ingest_pipeline import IngestPipeline
+
+        IngestPipeline(args.url, chunk_size=args.chunk_size, workers=args.workers or 1, force=args.force).run()
+        return 0
+
+    from movielens_eda_exercise.read_and_load_data import load_all
+
+    loaded = load_all(stream=args.stream, chunk_size=args.chunk_size, workers=args.workers, force=args.force,
+                      genome=args.genome, export_by=args.export_ratings, zip_path=args.zip_path,
+                      reload=args.reload, download=not args.no_download)
+    return 0 if loaded else 1
+
+
+def run_eda(args) -> int:
+    if args.backend == "sql":
+        from movielens_eda_exercise.perform_eda_with_sql import perform_eda_with
+
+        perform_eda_with(plots_dir=args.plots_dir)
+    elif args.backend == "streaming":
+        from movielens_eda_exercise.streaming_profiler import profile_tables
+
+        profile_tables(['ratings', 'movies'], plots_dir=args.plots_dir)
+    else:
+        if args.backend == "pandas":
+            from movielens_eda_exercise.perform_eda_with_pandas import perform_eda_with
+        else:
+            from movielens_eda_exercise.perform_eda_with_sweetviz import perform_eda_with
+
+        options = {} if args.max_profile_rows is None else {"max_profile_rows": args.max_profile_rows}
+        perform_eda_with(plots_dir=args.plots_dir, refresh_cache=args.refresh_cache, sample_rows=args.sample_rows,
+                         minimal=args.minimal, **options)
+    return 0
+
+
+def run_features(args) -> int:
+    from movielens_regression_exercise.features import (DEFAULT_CHUNK_SIZE, movie_features_from_database,
+                                                         movie_features_from_zip)
+
+    chunk_size = args.chunk_size or DEFAULT_CHUNK_SIZE
+    time_window = None if args.since is None and args.until is None else (args.since, args.until)
+    if args.zip_path is None:
+        result = movie_features_from_database(args.features_dir, refresh=args.refresh, chunk_size=chunk_size,
+                                              window=time_window)
+    else:
+        result = movie_features_from_zip(args.zip_path, args.features_dir, refresh=args.refresh,
+                                         chunk_size=chunk_size, window=time_window)
+    print(result.to_frame().head())
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m movielens_eda_exercise",
+                                     description="Download, load and explore the MovieLens dataset")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("--quiet", action="store_true", help="Only log warnings and errors")
+    verbosity.add_argument("--verbose", action="store_true", help="Also log the nested stages and every chunk")
+    parser.add_argument("--dataset", choices=DATASETS, default=None,
+                        help="MovieLens dataset: ml-latest-small or the full ml-latest with the tag genome "
+                             "(default: $MOVIELENS_DATASET or ml-latest-small)")
+    parser.add_argument("--report", type=Path, default=None,
+                        help="Write the per-stage timings, rows, bytes and peak memory of the run to this JSON file")
+    parser.add_argument("--prometheus-textfile", type=Path, default=None,
+                        help="Also write them in the Prometheus text format (node_exporter textfile collector)")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    download = commands.add_parser("download", help="Download the MovieLens archive")
+    download.add_argument("--url", default=None, help="Archive to download (default: the one of the dataset)")
+    download.add_argument("--zip-path", type=Path, default=None,
+                          help="Where to keep the archive (default: local_data/<dataset>.zip)")
+    download.add_argument("--reload", action="store_true", help="Check for a newer archive even if one exists")
+    download.set_defaults(handler=run_download)
+
+    # the load options are repeated here instead of shared with read_and_load_data, importing it costs pandas
+    load = commands.add_parser("load", help="Download the archive and load it into the database")
+    load.add_argument("--zip-path", type=Path, default=None,
+                      help="Where to keep the archive (default: local_data/<dataset>.zip)")
+    load.add_argument("--reload", action="store_true", help="Check for a newer archive even if one exists")
+    load.add_argument("--no-download", action="store_true",
+                      help="Load the archive at --zip-path as it is (e.g. a synthetic one) instead of downloading")
+    load.add_argument("--stream", action="store_true",
+                      help="Stream each CSV into the database in chunks instead of loading it whole")
+    load.add_argument("--chunk-size", type=int, default=100_000,
+                      help="Rows per chunk (streaming mode) or per partition (parallel inserts)")
+    load.add_argument("--workers", type=int, default=None,
+                      help="Pooled connections used to insert the partitions of a single table (default: the "
+                           "pool size split over the tables loaded at once, 1 on SQLite)")
+    load.add_argument("--force", action="store_true",
+                      help="Reload every table even if the load manifest says it is unchanged")
+    load.add_argument("--genome", action="store_true",
+                      help="Also load genome_tags and genome_scores and build the tag genome relevance matrix "
+                           "(needs --dataset ml-latest)")
+    load.add_argument("--export-ratings", choices=["year", "month"], default=None,
+                      help="Also export the ratings to the time-partitioned Parquet store")
+    load.add_argument("--pipeline", action="store_true",
+                      help="Download, decompress, parse and write concurrently from --url (see ingest_pipeline)")
+    load.add_argument("--url", default=None, help="Archive streamed by --pipeline (default: the one of the dataset)")
+    load.set_defaults(handler=run_load)
+
+    eda = commands.add_parser("eda", help="Profile the loaded tables")
+    eda.add_argument("--backend", choices=EDA_BACKENDS, default="pandas", help="Profiling implementation")
+    eda.add_argument("--plots-dir", type=Path, default=None, help="Directory to save the reports")
+    eda.add_argument("--refresh-cache", action="store_true", help="Re-read the tables from the database")
+    eda.add_argument("--max-profile-rows", type=int, default=None,
+                     help="Use the streaming profiler when ratings has more rows than this")
+    eda.add_argument("--sample-rows", type=int, default=None,
+                     help="Profile a sample of about this many ratings, stratified by movie and user")
+    eda.add_argument("--minimal", action="store_true", help="Build minimal (faster) reports")
+    eda.set_defaults(handler=run_eda)
+
+    features = commands.add_parser("features", help="Build the per-movie feature store")
+    features.add_argument("--zip-path", type=Path, default=None,
+                          help="Read movies and ratings from this MovieLens zip instead of the database")
+    features.add_argument("--features-dir", type=Path, default=None, help="Feature store directory")
+    features.add_argument("--refresh", action="store_true", help="Rebuild the features even if they are cached")
+    features.add_argument("--chunk-size", type=int, default=None, help="Ratings read per chunk")
+    features.add_argument("--since", default=None, help="Only use ratings from this date on")
+    features.add_argument("--until", default=None, help="Only use ratings before this date")
+    features.set_defaults(handler=run_features)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.DEBUG if args.verbose else logging.INFO,
+                        format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    if args.dataset is not None:
+        select_dataset(args.dataset)
+
+    from movielens_eda_exercise.instrumentation import start_run
+
+    run = start_run(args.command)
+    try:
+        return args.handler(args)
+    finally:
+        if args.report is not None:
+            run.write_json(args.report)
+        if args.prometheus_textfile is not None:
+            run.write_prometheus(args.prometheus_textfile)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Shared read path for the EDA and modelling code: tables are pulled from the database once and kept in a
+local columnar cache (Parquet, compact dtypes), which is reused until the table changes.
+
+A cached table is considered stale when the table's row count or its load manifest entry (zip checksum and
+last update) no longer match the fingerprint saved next to the cache file.
+
+The cache files are derived from the local database and live under the git-ignored local_data/ directory; they
+are rebuilt on demand and never committed.
+"""
+import json
+import logging
+
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from movielens_eda_exercise.database import get_engine
+from movielens_eda_exercise.load_manifest import read_manifest
+
+logger = logging.getLogger()
+
+try:
+    import pyarrow  # noqa: F401
+    has_pyarrow = True
+except Exception:
+    has_pyarrow = False
+    logger.debug("pyarrow not available; tables will be read from the database on every call")
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / "local_data" / "cache"
+READ_CHUNK_SIZE = 500_000
+
+
+def compact_dtypes(df: pd.DataFrame, category_ratio: float = 0.5) -> pd.DataFrame:
+    """Downcasts numeric columns to the smallest fitting type and turns repetitive text into categoricals."""
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_integer_dtype(s):
+            df[col] = pd.to_numeric(s, downcast='integer')
+        elif pd.api.types.is_float_dtype(s):
+            df[col] = s.astype('float32')
+        elif pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s):
+            if len(s) and s.nunique(dropna=True) <= category_ratio * len(s):
+                df[col] = s.astype('category')
+    return df
+
+
+def table_row_count(table_name: str) -> int:
+    """Exact number of rows in `table_name`."""
+    engine = get_engine()
+    with engine.connect() as conn:
+        return int(conn.exec_driver_sql(
+            f"SELECT COUNT(*) FROM {engine.dialect.identifier_preparer.quote(table_name)}").scalar())
+
+
+def table_fingerprint(table_name: str) -> dict:
+    """Row count and load manifest state of `table_name`, used to invalidate the cache."""
+    row_count = table_row_count(table_name)
+    with get_engine().connect() as conn:
+        try:
+            entry = read_manifest(conn, table_name)
+        except Exception as e:
+            logger.debug("load manifest not readable: %s", e)
+            entry = None
+    manifest = None if entry is None else f"{entry.zip_checksum}@{entry.updated_at}:{entry.status}"
+    return {"row_count": row_count, "manifest": manifest}
+
+
+def _cache_paths(cache_dir: Path, table_name: str):
+    return cache_dir / f"{table_name}.parquet", cache_dir / f"{table_name}.meta.json"
+
+
+def read_table_from_database(table_name: str, chunk_size: int = READ_CHUNK_SIZE) -> pd.DataFrame:
+    """Reads a whole table from the database in chunks, compacting each chunk before concatenating.
+
+    The rows come from a server-side cursor (stream_results), so the driver does not buffer the whole result
+    set before the first chunk and only the compacted chunks are held in memory."""
+    with get_engine().connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_size)
+        chunks = [compact_dtypes(chunk, category_ratio=0.0)
+                  for chunk in pd.read_sql_table(table_name, conn, chunksize=chunk_size)]
+    if not chunks:
+        return pd.DataFrame()
+    return compact_dtypes(pd.concat(chunks, ignore_index=True))
+
+
+def read_table(table_name: str, columns: Optional[list] = None, cache_dir: Optional[Path] = None,
+               refresh: bool = False) -> pd.DataFrame:
+    """Returns `table_name` as a DataFrame, served from the local columnar cache when it is up to date.
+
+    Parameters
+    - columns: optional subset of columns to return (only those are read from the cache file)
+    - cache_dir: cache location, defaults to `local_data/cache/` next to this file
+    - refresh: ignore the cache and re-materialise it from the database
+    """
+    if not has_pyarrow:
+        df = read_table_from_database(table_name)
+        return df[columns] if columns is not None else df
+
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_path, meta_path = _cache_paths(cache_dir, table_name)
+
+    fingerprint = table_fingerprint(table_name)
+    if not refresh and data_path.exists() and meta_path.exists():
+        if json.loads(meta_path.read_text()) == fingerprint:
+            logger.debug("cache hit for %s: %s", table_name, data_path)
+            return pd.read_parquet(data_path, columns=columns)
+        logger.info("cache for %s is stale, re-reading it from the database", table_name)
+
+    df = read_table_from_database(table_name)
+    tmp_path = data_path.with_suffix('.parquet.tmp')
+    df.to_parquet(tmp_path, index=False)
+    tmp_path.replace(data_path)
+    meta_path.write_text(json.dumps(fingerprint))
+    logger.info("cached %s (%d rows) in %s", table_name, len(df), data_path)
+    return df[columns] if columns is not None else df
@@ -0,0 +1,65 @@
+"""The MovieLens datasets the loaders can work on.
+
+The selected dataset decides the download URL, the local archive path and the directory of the CSV members
+inside the archive; the `inner_path` of every DatasetConfiguration is derived from it. It is read from the
+MOVIELENS_DATASET environment variable (default ml-latest-small) and can be changed with `select_dataset()`,
+which the `--dataset` options of the command line entry points call before loading anything.
+
+    ml-latest-small   ~100k ratings, 610 users, no tag genome
+    ml-latest         ~33M ratings, 330k users, with genome-scores.csv / genome-tags.csv
+"""
+import os
+
+from pathlib import Path
+from collections import namedtuple
+
+DATASET_ENV = "MOVIELENS_DATASET"
+LOCAL_DATA_DIR = Path(__file__).parent / "local_data"
+BASE_URL = "http://files.grouplens.org/datasets/movielens"
+
+
+class Dataset(namedtuple("Dataset", ["name", "has_genome"])):
+    """A MovieLens release: its archive is <name>.zip and its CSV files are in the <name>/ directory of it."""
+    __slots__ = ()
+
+    @property
+    def url(self) -> str:
+        return f"{BASE_URL}/{self.name}.zip"
+
+    @property
+    def zip_path(self) -> Path:
+        """Where the archive is downloaded to."""
+        return LOCAL_DATA_DIR / f"{self.name}.zip"
+
+    def member(self, file_name: str) -> str:
+        """Path of the CSV `file_name` inside the archive."""
+        return f"{self.name}/{file_name}"
+
+
+DATASETS = {
+    "ml-latest-small": Dataset("ml-latest-small", has_genome=False),
+    "ml-latest": Dataset("ml-latest", has_genome=True),
+}
+DEFAULT_DATASET = "ml-latest-small"
+
+_selected = None
+
+
+def get_dataset() -> Dataset:
+    """The selected dataset: the last `select_dataset()`, else MOVIELENS_DATASET, else ml-latest-small."""
+    if _selected is not None:
+        return _selected
+    name = os.environ.get(DATASET_ENV) or DEFAULT_DATASET
+    if name not in DATASETS:
+        raise ValueError(f"{DATASET_ENV}={name!r} is not one of {', '.join(DATASETS)}")
+    return DATASETS[name]
+
+
+def select_dataset(name: str) -> Dataset:
+    """Makes `name` the dataset of this process (and of the processes it starts)."""
+    global _selected
+    if name not in DATASETS:
+        raise ValueError(f"unknown dataset {name!r}, expected one of {', '.join(DATASETS)}")
+    _selected = DATASETS[name]
+    os.environ[DATASET_ENV] = name
+    return _selected
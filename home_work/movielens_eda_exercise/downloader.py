@@ -0,0 +1,301 @@
+"""Resumable, verified download of the MovieLens archive.
+
+- the archive is downloaded into `<zip>.part` and only renamed to `<zip>` once it is verified, so a killed run
+  never leaves a truncated archive behind
+- an interrupted transfer is resumed with an HTTP `Range` request (guarded by `If-Range`, so a partial file of
+  an older version of the archive is discarded), also across retries within the same run
+- the result is verified against the MD5 published next to the archive (`<url>.md5`) when there is one, and
+  always by opening it as a zip archive
+- the ETag / Last-Modified / MD5 / size of the verified archive are kept in the `<zip>.download.json` sidecar;
+  an existing archive is trusted only if it still matches them (one without a sidecar only if it matches the
+  published MD5), and a reload is a conditional request that costs a 304 when the archive did not change
+- only transient failures are retried: dropped connections, timeouts and 5xx / 429 responses
+- the read size adapts to the link: it doubles while blocks arrive quickly and halves when they are slow
+
+`iter_archive` streams an archive block by block with the same resume and retry logic, for consumers that
+process it while it arrives (see ingest_pipeline).
+"""
+import re
+import json
+import time
+import hashlib
+import logging
+import zipfile
+
+from pathlib import Path
+from typing import Optional
+
+import requests
+import urllib3
+
+logger = logging.getLogger()
+
+MIN_BLOCK = 64 * 1024
+MAX_BLOCK = 8 * 1024 * 1024
+# target duration of one read, the block size is adapted to stay around it
+BLOCK_SECONDS = 0.25
+DEFAULT_ATTEMPTS = 5
+TIMEOUT = 60
+# errors after which the transfer is resumed (a dropped connection surfaces from urllib3 while streaming);
+# an HTTP error response is retried only for RETRYABLE_STATUS
+RETRYABLE = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+             requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError, ConnectionError)
+TRANSFER_ERRORS = RETRYABLE + (requests.exceptions.RequestException,)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """The archive could not be downloaded or failed verification."""
+
+
+def _sidecar_path(zip_path: Path) -> Path:
+    return zip_path.with_name(zip_path.name + ".download.json")
+
+
+def _part_paths(zip_path: Path):
+    part = zip_path.with_name(zip_path.name + ".part")
+    return part, part.with_name(part.name + ".json")
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def file_md5(path: Path, block: int = MAX_BLOCK) -> str:
+    digest = hashlib.md5()
+    with path.open('rb') as f:
+        for data in iter(lambda: f.read(block), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def published_md5(url: str) -> Optional[str]:
+    """The MD5 published at `<url>.md5` (GroupLens publishes one per archive), or None."""
+    try:
+        response = requests.get(url + ".md5", timeout=TIMEOUT)
+        if response.status_code != 200:
+            return None
+        match = re.search(r"\b[0-9a-fA-F]{32}\b", response.text)
+        return match.group(0).lower() if match else None
+    except requests.exceptions.RequestException as e:
+        logger.debug("no published checksum for %s: %s", url, e)
+        return None
+
+
+def is_zip_archive(path: Path) -> bool:
+    """True when `path` opens as a zip archive (a truncated download has no central directory)."""
+    try:
+        with zipfile.ZipFile(path):
+            return True
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def is_verified(zip_path: Path) -> bool:
+    """True when `zip_path` is the archive described by its sidecar (size and MD5)."""
+    meta = _read_json(_sidecar_path(zip_path))
+    if not zip_path.exists() or not meta.get("md5"):
+        return False
+    return zip_path.stat().st_size == meta.get("size") and file_md5(zip_path) == meta["md5"]
+
+
+def _validators(headers) -> dict:
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+
+def _read_blocks(response, block: Optional[int] = None):
+    """Yields the body of a streamed response in blocks of `block` bytes, or of an adaptive size when None."""
+    adaptive = block is None
+    block = block or MIN_BLOCK
+    while True:
+        started = time.perf_counter()
+        data = response.raw.read(block)
+        if not data:
+            return
+        yield data
+        if adaptive:
+            elapsed = time.perf_counter() - started
+            if elapsed < BLOCK_SECONDS / 2 and len(data) == block:
+                block = min(block * 2, MAX_BLOCK)
+            elif elapsed > BLOCK_SECONDS * 2:
+                block = max(block // 2, MIN_BLOCK)
+
+
+def _check_complete(response, offset: int):
+    """Raises a retryable error when the response ended before the end of the archive (`offset` bytes in)."""
+    expected = response.headers.get("Content-Range", "").rpartition("/")[2] or None
+    if expected is None and response.status_code == 200:
+        expected = response.headers.get("Content-Length")
+    if expected and expected.isdigit() and offset != int(expected):
+        raise requests.exceptions.ChunkedEncodingError(f"transfer stopped at byte {offset} of {expected}")
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for the transient failures of a transfer: a dropped connection, a timeout, an overloaded server."""
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, RETRYABLE)
+
+
+def _retry_delay(attempt: int) -> int:
+    return min(2 ** attempt, 30)
+
+
+def _transfer(url: str, part: Path, part_meta_path: Path) -> dict:
+    """One attempt: appends the rest of the archive to `part`. Returns the response validators."""
+    part_meta = _read_json(part_meta_path)
+    offset = part.stat().st_size if part.exists() else 0
+    # byte ranges refer to the stored representation, so ask for it unencoded
+    headers = {"Accept-Encoding": "identity"}
+    if offset and (part_meta.get("etag") or part_meta.get("last_modified")):
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = part_meta.get("etag") or part_meta["last_modified"]
+    elif offset:
+        # nothing to check the partial file against: start over
+        offset = 0
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 416:
+            # the partial file already holds the whole archive
+            return part_meta
+        response.raise_for_status()
+        validators = _validators(response.headers)
+        if response.status_code == 206:
+            logger.info("resuming download of %s at byte %d", url, offset)
+            mode = 'ab'
+        else:
+            if offset:
+                logger.info("server sent the whole archive, discarding %d partial bytes", offset)
+            mode = 'wb'
+            offset = 0
+        part_meta_path.write_text(json.dumps(validators))
+
+        with part.open(mode) as f:
+            for data in _read_blocks(response):
+                f.write(data)
+                offset += len(data)
+        _check_complete(response, offset)
+    return validators
+
+
+def _write_sidecar(sidecar: Path, url: str, zip_path: Path, md5: str, validators: dict, verified_against: str):
+    sidecar.write_text(json.dumps(dict(validators, url=url, md5=md5, size=zip_path.stat().st_size,
+                                       verified_against=verified_against), indent=2))
+
+
+def download_archive(url: str, zip_path: Path, reload: bool = False, expected_md5: Optional[str] = None,
+                     attempts: int = DEFAULT_ATTEMPTS) -> Path:
+    """Makes `zip_path` a verified copy of the archive at `url`, transferring as little as possible.
+
+    Raises DownloadError when the archive cannot be fetched within `attempts` tries or fails verification."""
+    sidecar = _sidecar_path(zip_path)
+    part, part_meta_path = _part_paths(zip_path)
+    meta = _read_json(sidecar)
+
+    if zip_path.exists() and not reload:
+        if is_verified(zip_path):
+            logger.debug("file exist and is valid: %s", zip_path)
+            return zip_path
+        if not meta:
+            # no download record (copied in by hand, or left by an older version): trust it only if it is the
+            # published archive
+            expected_md5 = expected_md5 or published_md5(url)
+            if expected_md5 is not None and file_md5(zip_path) == expected_md5.lower() and is_zip_archive(zip_path):
+                _write_sidecar(sidecar, url, zip_path, expected_md5.lower(), {}, "published md5")
+                logger.info("%s matches the published checksum of %s", zip_path, url)
+                return zip_path
+            logger.warning("%s has no download record and does not match a published checksum, downloading it "
+                           "again", zip_path)
+        else:
+            logger.warning("%s does not match its download record, downloading it again", zip_path)
+
+    if zip_path.exists() and reload and meta.get("md5"):
+        conditional = {}
+        if meta.get("etag"):
+            conditional["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            conditional["If-Modified-Since"] = meta["last_modified"]
+        try:
+            response = requests.head(url, headers=conditional, timeout=TIMEOUT, allow_redirects=True)
+            if response.status_code == 304 and is_verified(zip_path):
+                logger.info("%s not modified since the last download", url)
+                return zip_path
+        except requests.exceptions.RequestException as e:
+            logger.debug("conditional request failed, downloading: %s", e)
+
+    if expected_md5 is None:
+        expected_md5 = published_md5(url)
+
+    zip_path.parent.mkdir(parents=True, exist_ok=True)
+    validators = {}
+    for attempt in range(1, attempts + 1):
+        try:
+            validators = _transfer(url, part, part_meta_path)
+            break
+        except TRANSFER_ERRORS as e:
+            if not is_retryable(e):
+                raise DownloadError(f"download of {url} failed: {e}") from e
+            if attempt == attempts:
+                raise DownloadError(f"download of {url} failed after {attempts} attempts: {e}") from e
+            delay = _retry_delay(attempt)
+            logger.warning("download attempt %d/%d failed (%s), resuming in %ds", attempt, attempts, e, delay)
+            time.sleep(delay)
+
+    md5 = file_md5(part)
+    if expected_md5 is not None and md5 != expected_md5.lower():
+        part.unlink()
+        part_meta_path.unlink(missing_ok=True)
+        raise DownloadError(f"checksum mismatch for {url}: got {md5}, expected {expected_md5}")
+    if not is_zip_archive(part):
+        part.unlink()
+        part_meta_path.unlink(missing_ok=True)
+        raise DownloadError(f"{url} is not a valid zip archive")
+
+    part.replace(zip_path)
+    part_meta_path.unlink(missing_ok=True)
+    _write_sidecar(sidecar, url, zip_path, md5, validators, "published md5" if expected_md5 else "zip structure")
+    logger.info("downloaded and verified %s (%d bytes, md5 %s)", zip_path, zip_path.stat().st_size, md5)
+    return zip_path
+
+
+def iter_archive(url: str, block: Optional[int] = None, attempts: int = DEFAULT_ATTEMPTS):
+    """Yields the archive at `url` block by block (see `_read_blocks`) without storing it.
+
+    A transfer that fails part way is resumed after the bytes already yielded with an `If-Range` guarded
+    `Range` request, up to `attempts` tries. Raises DownloadError when that is impossible (the server cannot
+    resume, or the archive changed in between) or when the tries are used up."""
+    offset = 0
+    validator = None
+    for attempt in range(1, attempts + 1):
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # the blocks already handed on cannot be taken back
+                    raise DownloadError(f"{url} changed or cannot be resumed at byte {offset}")
+                if not offset:
+                    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                else:
+                    logger.info("resuming download of %s at byte %d", url, offset)
+                for data in _read_blocks(response, block):
+                    offset += len(data)
+                    yield data
+                _check_complete(response, offset)
+            return
+        except TRANSFER_ERRORS as e:
+            if not is_retryable(e):
+                raise DownloadError(f"download of {url} failed: {e}") from e
+            if offset and validator is None:
+                raise DownloadError(f"download of {url} failed at byte {offset} and cannot be resumed: {e}") from e
+            if attempt == attempts:
+                raise DownloadError(f"download of {url} failed after {attempts} attempts: {e}") from e
+            delay = _retry_delay(attempt)
+            logger.warning("download attempt %d/%d failed (%s), resuming in %ds", attempt, attempts, e, delay)
+            time.sleep(delay)
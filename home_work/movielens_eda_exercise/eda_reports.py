@@ -0,0 +1,77 @@
+"""Steps shared by the report-building EDA scripts (perform_eda_with_pandas / perform_eda_with_sweetviz).
+
+- `read_ratings`: the ratings to profile, all of them from the local columnar cache or a stratified sample
+  streamed from the database, with the note that goes into the report titles
+- `merge_titles`: the ratings joined with the movie titles, for the merged report
+- `build_reports`: runs one report job per frame in a process pool and records each in the run report
+"""
+import os
+import json
+import logging
+
+from pathlib import Path
+from typing import Callable, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from movielens_eda_exercise.data_access import read_table
+from movielens_eda_exercise.instrumentation import current_run
+from movielens_eda_exercise.sampling import stratified_sample_from_database
+
+logger = logging.getLogger()
+
+
+def profiled_rows(ratings_rows: int, sample_rows: Optional[int] = None) -> int:
+    """How many ratings a report would profile: all of them, or the sample."""
+    return ratings_rows if sample_rows is None else min(sample_rows, ratings_rows)
+
+
+def read_ratings(plots_dir: Path, ratings_rows: int, sample_rows: Optional[int] = None,
+                 refresh_cache: bool = False) -> tuple:
+    """The ratings to profile and the note for the report titles ("" when they are all profiled).
+
+    With `sample_rows` below the table size only a stratified sample is read, streamed from the database; the
+    sampling fraction is saved to report_sampling.json in `plots_dir`."""
+    if sample_rows is None or sample_rows >= ratings_rows:
+        ratings, fraction = read_table('ratings', refresh=refresh_cache), 1.0
+    else:
+        ratings, fraction, ratings_rows = stratified_sample_from_database(sample_rows, total_rows=ratings_rows)
+    if sample_rows is None:
+        return ratings, ""
+
+    (plots_dir / "report_sampling.json").write_text(json.dumps(
+        {"ratings_rows": ratings_rows, "sampled_rows": len(ratings), "fraction": fraction,
+         "stratified_by": ["movie_id", "user_id"]}))
+    if fraction >= 1.0:
+        return ratings, ""
+    logger.info("Profiling a stratified sample of %d / %d ratings", len(ratings), ratings_rows)
+    return ratings, f" (stratified sample: {fraction:.2%} of {ratings_rows} ratings)"
+
+
+def merge_titles(ratings: pd.DataFrame, movies: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """The ratings with the title of their movie, or None when the frames have no movie id to join on."""
+    if 'movie_id' not in ratings.columns or ('movie_id' not in movies.columns and 'movieId' not in movies.columns):
+        return None
+    if 'movie_id' in movies.columns:
+        merge_cols = ['movie_id'] + (['title'] if 'title' in movies.columns else [])
+        movies = movies[merge_cols]
+    return ratings.merge(movies, left_on='movie_id', right_on=movies.columns[0], how='left')
+
+
+def build_reports(job: Callable, jobs: list, minimal: bool, kind: str):
+    """Runs `job(df, title, path, minimal)` for every (df, title, path) of `jobs`, one worker process each.
+
+    `job` returns the saved path, the build time and the peak RSS of its worker, which are added to the run
+    report; a failed report is logged and does not stop the others."""
+    with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+        future_to_job = {executor.submit(job, df, title, path, minimal): (df, path) for df, title, path in jobs}
+        for fut in as_completed(future_to_job):
+            df, path = future_to_job[fut]
+            try:
+                saved, seconds, peak_rss = fut.result()
+                current_run().record("eda.profile", table=path.stem, seconds=seconds, rows=len(df),
+                                     peak_rss=peak_rss)
+                logger.info("Saved %s: %s", kind, saved)
+            except Exception as e:
+                logger.exception("Failed to generate %s %s: %s", kind, path, e)
@@ -0,0 +1,161 @@
+"""Dense, memory-mapped movie x tag relevance matrix built from the tag genome.
+
+genome-scores.csv holds a relevance for every (movie, tag) pair, about 15M rows for ~13k movies x 1128 tags.
+Instead of querying `genome_scores` row by row, the scores are written once into a float32 `.npy` matrix that is
+memory-mapped on use, next to sorted movieId / tagId index arrays, the L2 norm of every movie row and the tag
+names. Lookups are then plain vectorised numpy operations on pages the OS keeps cached.
+
+Files in the matrix directory:
+- relevance.npy: float32 [n_movies, n_tags]
+- movie_ids.npy / tag_ids.npy: int32, sorted, row / column ids of the matrix
+- movie_norms.npy: float32 [n_movies], L2 norm of each row (for cosine similarity)
+- tags.json: tag name per tagId
+"""
+import json
+import logging
+
+from pathlib import Path
+from typing import Optional, Union
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+
+from movielens_eda_exercise.datasets import DATASETS, select_dataset
+from movielens_eda_exercise.models.genome.genome_score import GenomeScoresConfiguration
+from movielens_eda_exercise.models.genome.genome_tag import GenomeTagsConfiguration
+
+logger = logging.getLogger()
+
+DEFAULT_MATRIX_DIR = Path(__file__).parent / "local_data" / "genome"
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def _read_member(z: ZipFile, config, chunk_size: Optional[int] = None, usecols=None):
+    return pd.read_csv(z.open(config.inner_path), header=config.header, names=config.columns,
+                       dtype=config.dtypes, usecols=usecols, chunksize=chunk_size)
+
+
+def build_genome_matrix(zip_path: Path, matrix_dir: Optional[Path] = None,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> Path:
+    """Streams genome-scores.csv from the zip archive into the on-disk relevance matrix.
+
+    Two passes over the member: the first collects the movie ids, the second scatters each chunk of scores
+    into the memory-mapped matrix, so memory use is one chunk plus the pages being written."""
+    if matrix_dir is None:
+        matrix_dir = DEFAULT_MATRIX_DIR
+    matrix_dir.mkdir(parents=True, exist_ok=True)
+
+    with ZipFile(zip_path) as z:
+        tags = _read_member(z, GenomeTagsConfiguration)
+        tag_ids = np.sort(tags['tagId'].to_numpy(dtype=np.int32))
+
+        movie_ids = set()
+        with _read_member(z, GenomeScoresConfiguration, chunk_size, usecols=['movieId']) as reader:
+            for chunk in reader:
+                movie_ids.update(chunk['movieId'].unique().tolist())
+        movie_ids = np.array(sorted(movie_ids), dtype=np.int32)
+        logger.debug("genome: %d movies x %d tags", len(movie_ids), len(tag_ids))
+
+        relevance = np.lib.format.open_memmap(matrix_dir / "relevance.npy", mode='w+', dtype=np.float32,
+                                              shape=(len(movie_ids), len(tag_ids)))
+        relevance[:] = 0.0
+        rows = 0
+        with _read_member(z, GenomeScoresConfiguration, chunk_size) as reader:
+            for chunk in reader:
+                r = np.searchsorted(movie_ids, chunk['movieId'].to_numpy())
+                c = np.searchsorted(tag_ids, chunk['tagId'].to_numpy())
+                relevance[r, c] = chunk['relevance'].to_numpy(dtype=np.float32)
+                rows += len(chunk)
+        relevance.flush()
+
+    np.save(matrix_dir / "movie_ids.npy", movie_ids)
+    np.save(matrix_dir / "tag_ids.npy", tag_ids)
+    np.save(matrix_dir / "movie_norms.npy", np.linalg.norm(relevance, axis=1).astype(np.float32))
+    (matrix_dir / "tags.json").write_text(json.dumps(dict(zip(tags['tagId'].astype(int).astype(str),
+                                                              tags['tag'].astype(str)))))
+    del relevance
+    logger.info("built genome matrix from %d scores in %s", rows, matrix_dir)
+    return matrix_dir
+
+
+class GenomeMatrix:
+    """Read-only, memory-mapped view of the relevance matrix with vectorised queries."""
+
+    def __init__(self, matrix_dir: Optional[Path] = None):
+        if matrix_dir is None:
+            matrix_dir = DEFAULT_MATRIX_DIR
+        self.relevance = np.load(matrix_dir / "relevance.npy", mmap_mode='r')
+        self.movie_ids = np.load(matrix_dir / "movie_ids.npy")
+        self.tag_ids = np.load(matrix_dir / "tag_ids.npy")
+        self.movie_norms = np.load(matrix_dir / "movie_norms.npy")
+        names = json.loads((matrix_dir / "tags.json").read_text())
+        self.tag_names = np.array([names.get(str(t), str(t)) for t in self.tag_ids], dtype=object)
+
+    def _movie_row(self, movie_id: int) -> int:
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row >= len(self.movie_ids) or self.movie_ids[row] != movie_id:
+            raise KeyError(f"movie {movie_id} is not in the tag genome")
+        return row
+
+    def _tag_column(self, tag: Union[int, str]) -> int:
+        if isinstance(tag, str):
+            matches = np.flatnonzero(self.tag_names == tag)
+            if not len(matches):
+                raise KeyError(f"tag {tag!r} is not in the tag genome")
+            return int(matches[0])
+        column = int(np.searchsorted(self.tag_ids, tag))
+        if column >= len(self.tag_ids) or self.tag_ids[column] != tag:
+            raise KeyError(f"tag id {tag} is not in the tag genome")
+        return column
+
+    def tag_profile(self, movie_id: int, top_n: Optional[int] = None) -> pd.Series:
+        """Relevance of every tag for `movie_id` (tag name index), most relevant first."""
+        profile = pd.Series(np.asarray(self.relevance[self._movie_row(movie_id)]), index=self.tag_names,
+                            name=movie_id).sort_values(ascending=False)
+        return profile if top_n is None else profile.head(top_n)
+
+    def top_movies_for_tag(self, tag: Union[int, str], n: int = 10) -> pd.Series:
+        """The `n` movies with the highest relevance for `tag` (tag id or name), indexed by movieId."""
+        column = np.asarray(self.relevance[:, self._tag_column(tag)])
+        n = min(n, len(column))
+        top = np.argpartition(-column, n - 1)[:n]
+        top = top[np.argsort(-column[top], kind='stable')]
+        return pd.Series(column[top], index=pd.Index(self.movie_ids[top], name='movieId'), name='relevance')
+
+    def cosine_similarity(self, movie_a: int, movie_b: int) -> float:
+        a, b = self._movie_row(movie_a), self._movie_row(movie_b)
+        denominator = float(self.movie_norms[a]) * float(self.movie_norms[b])
+        if denominator == 0.0:
+            return 0.0
+        return float(np.dot(self.relevance[a], self.relevance[b]) / denominator)
+
+    def similar_movies(self, movie_id: int, n: int = 10) -> pd.Series:
+        """The `n` movies whose tag profiles are most cosine-similar to `movie_id` (itself excluded)."""
+        row = self._movie_row(movie_id)
+        vector = np.asarray(self.relevance[row])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (self.relevance @ vector) / (self.movie_norms * self.movie_norms[row])
+        scores = np.nan_to_num(scores, nan=0.0)
+        scores[row] = -np.inf
+        n = min(n, len(scores) - 1)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return pd.Series(scores[top], index=pd.Index(self.movie_ids[top], name='movieId'), name='cosine')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build the memory-mapped tag genome relevance matrix")
+    parser.add_argument("--zip-path", type=Path, default=DATASETS["ml-latest"].zip_path,
+                        help="MovieLens archive that contains genome-scores.csv and genome-tags.csv")
+    parser.add_argument("--matrix-dir", type=Path, default=None, help="Output directory of the matrix files")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk")
+    args = parser.parse_args()
+
+    # the tag genome only ships with ml-latest, its members are in the ml-latest/ directory of the archive
+    select_dataset("ml-latest")
+    build_genome_matrix(args.zip_path, matrix_dir=args.matrix_dir, chunk_size=args.chunk_size)
@@ -0,0 +1,124 @@
+"""Secondary index management for the MovieLens schema.
+
+The indexes are declared next to the ORM models (`__table_args__`). Maintaining them row by row during a bulk
+load is much slower than building them once over the loaded table, so ingestion drops a table's secondary
+indexes before the load and recreates them when it completes.
+
+`python -m movielens_eda_exercise.index_manager` runs EXPLAIN on the query paths used by the EDA and
+modelling code and reports which index each of them uses.
+"""
+import json
+import logging
+
+from sqlalchemy import Table, inspect, select, func
+
+from movielens_eda_exercise.models.rating import Rating
+from movielens_eda_exercise.models.movie import Movie
+from movielens_eda_exercise.models.tag import Tag
+from movielens_eda_exercise.models.link import Link
+
+logger = logging.getLogger()
+
+
+def existing_indexes(conn, table: Table) -> set:
+    """Names of the indexes that currently exist on `table` in the database."""
+    return {ix['name'] for ix in inspect(conn).get_indexes(table.name)}
+
+
+def drop_secondary_indexes(engine, table: Table) -> list:
+    """Drops the declared secondary indexes of `table` that exist. Returns their names."""
+    dropped = []
+    with engine.begin() as conn:
+        present = existing_indexes(conn, table)
+        for index in table.indexes:
+            if index.name in present:
+                index.drop(conn)
+                dropped.append(index.name)
+    if dropped:
+        logger.debug("dropped indexes of %s before bulk load: %s", table.name, ", ".join(dropped))
+    return dropped
+
+
+def create_secondary_indexes(engine, table: Table) -> list:
+    """Creates the declared secondary indexes of `table` that are missing. Returns their names."""
+    created = []
+    with engine.begin() as conn:
+        present = existing_indexes(conn, table)
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(conn)
+                created.append(index.name)
+    if created:
+        logger.info("built indexes of %s: %s", table.name, ", ".join(created))
+    return created
+
+
+ratings = Rating.__table__
+movies = Movie.__table__
+tags = Tag.__table__
+links = Link.__table__
+
+# The lookups and joins the EDA / modelling code runs, with representative parameters
+QUERY_PATHS = {
+    "ratings_of_user": select(ratings).where(ratings.c.user_id == 1),
+    "rating_of_user_for_movie": select(ratings.c.rating).where(ratings.c.user_id == 1, ratings.c.movie_id == 1),
+    "ratings_of_movie_in_time_range": select(ratings).where(ratings.c.movie_id == 1,
+                                                            ratings.c.timestamp.between(0, 2 ** 31 - 1)),
+    "ratings_in_time_range": select(func.count()).select_from(ratings).where(
+        ratings.c.timestamp.between(1_500_000_000, 1_600_000_000)),
+    "ratings_join_movies": select(movies.c.title, ratings.c.rating)
+        .select_from(ratings.join(movies, ratings.c.movie_id == movies.c.movie_id)).where(ratings.c.user_id == 1),
+    "ratings_per_movie": select(ratings.c.movie_id, func.count(), func.avg(ratings.c.rating))
+        .group_by(ratings.c.movie_id),
+    "tags_of_movie": select(tags.c.tag).where(tags.c.movie_id == 1),
+    "links_of_movie": select(links).where(links.c.movie_id == 1),
+}
+
+EXPLAIN_PREFIX = {'sqlite': "EXPLAIN QUERY PLAN ", 'mysql': "EXPLAIN ", 'postgresql': "EXPLAIN "}
+
+
+def explain(conn, query) -> list:
+    """The dialect's EXPLAIN output of `query`, one string per plan row."""
+    sql = str(query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    prefix = EXPLAIN_PREFIX.get(conn.dialect.name, "EXPLAIN ")
+    result = conn.exec_driver_sql(prefix + sql)
+    return [" | ".join("" if v is None else str(v) for v in row) for row in result]
+
+
+def explain_report(engine, paths: dict = None) -> dict:
+    """Runs EXPLAIN for every query path and lists the declared indexes mentioned in its plan."""
+    if paths is None:
+        paths = QUERY_PATHS
+    index_names = {ix.name for table in (ratings, movies, tags, links) for ix in table.indexes}
+    report = {}
+    with engine.connect() as conn:
+        for name, query in paths.items():
+            plan = explain(conn, query)
+            used = sorted(ix for ix in index_names if any(ix in line for line in plan))
+            report[name] = {"indexes": used, "plan": plan}
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Manage and inspect the secondary indexes of the MovieLens tables")
+    parser.add_argument("--create", action="store_true", help="Create missing declared indexes first")
+    parser.add_argument("--json", action="store_true", help="Print the full report with the plans as JSON")
+    args = parser.parse_args()
+
+    from movielens_eda_exercise.database import get_engine
+
+    engine = get_engine()
+    if args.create:
+        for t in (ratings, movies, tags, links):
+            create_secondary_indexes(engine, t)
+
+    explained = explain_report(engine)
+    if args.json:
+        print(json.dumps(explained, indent=2))
+    else:
+        for path, entry in explained.items():
+            print(f"{path:32} {', '.join(entry['indexes']) or '(no secondary index)'}")
@@ -0,0 +1,464 @@
+"""Staged ingestion: download -> decompress -> parse -> write, all running at the same time.
+
+Instead of downloading the whole archive, then parsing every CSV, then inserting it, the stages are threads
+connected by bounded queues, so the network, the CPU and the database work concurrently and a slow stage
+pushes back on the faster ones (memory stays bounded by the queue sizes):
+
+    download --bytes--> unzip --member bytes--> parse (one per member) --DataFrames--> write (one per member)
+
+- download: streams the archive in DOWNLOAD_BLOCK blocks (optionally keeping a copy of it), resuming a dropped
+  transfer with a Range request like downloader.download_archive
+- unzip: walks the zip local file headers as the bytes arrive (no central directory needed, so no seeking),
+  inflates the wanted members and checks their CRC-32 before a member's end is handed on, so a corrupt member
+  never completes its load (its manifest entry is marked failed and the next run loads it again)
+- parse: `pd.read_csv` in chunks over the member bytes, typed by the member's DatasetConfiguration
+- write: the usual partitioned, manifest-recorded bulk load (`saving_partitions_to_database`)
+
+Every stage reports throughput and time spent blocked, and every queue its depth, see `StageMetrics`.
+"""
+import io
+import json
+import time
+import zlib
+import queue
+import struct
+import logging
+import threading
+
+from itertools import islice
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from movielens_eda_exercise.datasets import DATASETS, get_dataset, select_dataset
+from movielens_eda_exercise.instrumentation import current_run
+from movielens_eda_exercise.downloader import iter_archive
+from movielens_eda_exercise.load_manifest import fail_load, plan_load
+from movielens_eda_exercise.read_and_load_data import DEFAULT_CHUNK_SIZE, prepared_engine, saving_partitions_to_database
+from movielens_eda_exercise.models.rating import RatingsConfiguration
+from movielens_eda_exercise.models.link import LinksConfiguration
+from movielens_eda_exercise.models.movie import MovieConfiguration
+from movielens_eda_exercise.models.tag import TagConfiguration
+
+logger = logging.getLogger()
+
+DOWNLOAD_BLOCK = 1 << 20
+BYTES_QUEUE_BLOCKS = 16
+FRAMES_QUEUE_CHUNKS = 4
+
+LOCAL_HEADER = b"PK\x03\x04"
+DATA_DESCRIPTOR = b"PK\x07\x08"
+LOCAL_HEADER_FORMAT = struct.Struct("<HHHHHIIIHH")
+FLAG_DATA_DESCRIPTOR = 0x08
+ZIP64_EXTRA = 0x0001
+
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised in a stage when another stage failed."""
+
+
+class StageMetrics:
+    """Work done by a stage and time it spent blocked on its queues."""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.units = 0
+        self.items = 0
+        self.blocked = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter()
+
+    def finish(self):
+        with self._lock:
+            self.finished = time.perf_counter()
+
+    def add(self, units: int, items: int = 1):
+        with self._lock:
+            self.units += units
+            self.items += items
+
+    def add_blocked(self, seconds: float):
+        with self._lock:
+            self.blocked += seconds
+
+    def to_dict(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {"stage": self.name, "unit": self.unit, "units": self.units, "items": self.items,
+                "seconds": round(elapsed, 3), "throughput_per_sec": self.units / elapsed if elapsed > 0 else 0.0,
+                "blocked_seconds": round(self.blocked, 3)}
+
+
+class BoundedQueue:
+    """queue.Queue with depth statistics; blocking calls give up when the pipeline is aborted."""
+
+    def __init__(self, name: str, maxsize: int, abort: threading.Event):
+        self.name = name
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._abort = abort
+        self.max_depth = 0
+        self._depth_total = 0
+        self._samples = 0
+
+    def put(self, item, metrics: StageMetrics):
+        started = time.perf_counter()
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted(self.name)
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        metrics.add_blocked(time.perf_counter() - started)
+        depth = self._queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_total += depth
+        self._samples += 1
+
+    def get(self, metrics: StageMetrics):
+        started = time.perf_counter()
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted(self.name)
+            try:
+                item = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        metrics.add_blocked(time.perf_counter() - started)
+        return item
+
+    def to_dict(self) -> dict:
+        return {"queue": self.name, "capacity": self.maxsize, "max_depth": self.max_depth,
+                "mean_depth": self._depth_total / self._samples if self._samples else 0.0}
+
+
+class _ByteStream:
+    """Sequential reader over the blocks of a BoundedQueue, with push-back of unconsumed bytes."""
+
+    def __init__(self, blocks: BoundedQueue, metrics: StageMetrics):
+        self._blocks = blocks
+        self._metrics = metrics
+        self._buffer = b""
+        self.eof = False
+
+    def read_some(self) -> bytes:
+        if self._buffer:
+            data, self._buffer = self._buffer, b""
+            return data
+        if self.eof:
+            return b""
+        block = self._blocks.get(self._metrics)
+        if block is _END:
+            self.eof = True
+            return b""
+        return block
+
+    def read_exact(self, n: int) -> bytes:
+        parts, size = [], 0
+        while size < n:
+            data = self.read_some()
+            if not data:
+                raise EOFError(f"archive ended {n - size} bytes early")
+            parts.append(data)
+            size += len(data)
+        data = b"".join(parts)
+        self.unread(data[n:])
+        return data[:n]
+
+    def unread(self, data: bytes):
+        if data:
+            self._buffer = data + self._buffer
+
+
+class _MemberFile(io.RawIOBase):
+    """Read-only file object over the decompressed blocks of one zip member, for `pd.read_csv`."""
+
+    def __init__(self, blocks: BoundedQueue, metrics: StageMetrics):
+        self._stream = _ByteStream(blocks, metrics)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._stream.read_some()
+        if len(data) > len(buffer):
+            self._stream.unread(data[len(buffer):])
+            data = data[:len(buffer)]
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class IngestPipeline:
+    """Downloads a MovieLens archive from `url` (default: the one of the selected dataset) and loads `configs`
+    while the download is still running."""
+
+    def __init__(self, url: Optional[str] = None, configs: Optional[list] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 1, force: bool = False,
+                 save_to: Optional[Path] = None, download_block: int = DOWNLOAD_BLOCK):
+        self.url = url or get_dataset().url
+        self.configs = {c.inner_path: c for c in (configs or [MovieConfiguration, RatingsConfiguration,
+                                                              LinksConfiguration, TagConfiguration])}
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.force = force
+        self.save_to = save_to
+        self.download_block = download_block
+
+        self.abort = threading.Event()
+        self.errors = []
+        self.threads = []
+        self.stages = {name: StageMetrics(name, unit) for name, unit in
+                       (("download", "bytes"), ("unzip", "bytes"), ("parse", "rows"), ("write", "rows"))}
+        self.queues = [BoundedQueue("download->unzip", BYTES_QUEUE_BLOCKS, self.abort)]
+
+    # ------------------------------------------------------------------ threads
+
+    def _spawn(self, name: str, target, *args):
+        def run():
+            try:
+                target(*args)
+            except PipelineAborted:
+                logger.debug("%s stopped: pipeline aborted", name)
+            except Exception as e:
+                logger.exception("pipeline stage %s failed: %s", name, e)
+                self.errors.append(e)
+                self.abort.set()
+
+        thread = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        self.threads.append(thread)
+        thread.start()
+        return thread
+
+    # ------------------------------------------------------------------ stages
+
+    def _download(self, out: BoundedQueue):
+        metrics = self.stages["download"]
+        metrics.start()
+        copy = None
+        if self.save_to is not None:
+            partial = self.save_to.with_name(self.save_to.name + ".part")
+            copy = partial.open("wb")
+        try:
+            for block in iter_archive(self.url, block=self.download_block):
+                if copy is not None:
+                    copy.write(block)
+                metrics.add(len(block))
+                out.put(block, metrics)
+            out.put(_END, metrics)
+        finally:
+            if copy is not None:
+                copy.close()
+        if copy is not None:
+            partial.replace(self.save_to)
+        metrics.finish()
+
+    def _unzip(self, source: BoundedQueue):
+        metrics = self.stages["unzip"]
+        metrics.start()
+        stream = _ByteStream(source, metrics)
+        while True:
+            signature = stream.read_exact(4)
+            if signature != LOCAL_HEADER:
+                # central directory: every member has been seen
+                break
+            (_, flags, method, _, _, crc, compressed_size, size,
+             name_length, extra_length) = LOCAL_HEADER_FORMAT.unpack(stream.read_exact(LOCAL_HEADER_FORMAT.size))
+            name = stream.read_exact(name_length).decode("utf-8")
+            extra = stream.read_exact(extra_length)
+            zip64 = False
+            if compressed_size == 0xFFFFFFFF or size == 0xFFFFFFFF:
+                zip64 = True
+                size, compressed_size = _zip64_sizes(extra, size, compressed_size)
+            has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+
+            config = self.configs.get(name)
+            sink = None
+            if config is not None:
+                sink = self._start_member(config, None if has_descriptor else f"crc32:{crc:08x}:{size}")
+            actual_crc = self._copy_member(stream, name, method, compressed_size, has_descriptor, sink, metrics)
+            if has_descriptor:
+                crc = _read_data_descriptor(stream, zip64)
+            if sink is not None:
+                # the member's load completes when its parser sees the end, so check the data first
+                if actual_crc != crc:
+                    fail_load(prepared_engine(), config.model.__table__)
+                    raise ValueError(f"CRC-32 mismatch in {name}: {actual_crc:08x} != {crc:08x}")
+                sink.put(_END, metrics)
+        # drain the rest of the download so that it can finish (and the archive copy is complete)
+        while stream.read_some():
+            pass
+        metrics.finish()
+
+    def _copy_member(self, stream: _ByteStream, name: str, method: int, compressed_size: int,
+                     has_descriptor: bool, sink: Optional[BoundedQueue], metrics: StageMetrics) -> int:
+        """Moves one member's data out of the stream, inflating it into `sink` when given. Returns its CRC-32."""
+        crc = 0
+        if method == 8:
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            while not inflater.eof:
+                data = stream.read_some()
+                if not data:
+                    raise EOFError(f"archive ended inside {name}")
+                if sink is None and not has_descriptor:
+                    # not wanted and its size is known: skip without inflating
+                    stream.unread(data)
+                    stream.read_exact(compressed_size)
+                    return 0
+                block = inflater.decompress(data)
+                stream.unread(inflater.unused_data)
+                if block:
+                    crc = zlib.crc32(block, crc)
+                    metrics.add(len(block))
+                    if sink is not None:
+                        sink.put(block, metrics)
+            return crc
+        if method == 0 and not has_descriptor:
+            remaining = compressed_size
+            while remaining:
+                data = stream.read_some()
+                if not data:
+                    raise EOFError(f"archive ended inside {name}")
+                block, rest = data[:remaining], data[remaining:]
+                stream.unread(rest)
+                remaining -= len(block)
+                crc = zlib.crc32(block, crc)
+                metrics.add(len(block))
+                if sink is not None:
+                    sink.put(block, metrics)
+            return crc
+        raise ValueError(f"{name}: compression method {method} cannot be streamed")
+
+    def _start_member(self, config, checksum: Optional[str]) -> Optional[BoundedQueue]:
+        """Plans the load of one member and starts its parse and write stages. Returns the queue the member's
+        decompressed bytes go to, or None when the table is already up to date."""
+        table = config.model.__table__
+        # without sizes in the local header the member cannot be compared with the manifest: reload it
+        plan = plan_load(prepared_engine(), table, config.inner_path, checksum or "stream", self.chunk_size,
+                         force=self.force or checksum is None)
+        if plan.skip:
+            return None
+        member_bytes = BoundedQueue(f"unzip->parse:{config.name}", BYTES_QUEUE_BLOCKS, self.abort)
+        frames = BoundedQueue(f"parse->write:{config.name}", FRAMES_QUEUE_CHUNKS, self.abort)
+        self.queues += [member_bytes, frames]
+        self._spawn(f"parse-{config.name}", self._parse, config, plan, member_bytes, frames)
+        self._spawn(f"write-{config.name}", self._write, config, plan, frames)
+        return member_bytes
+
+    def _parse(self, config, plan, member_bytes: BoundedQueue, frames: BoundedQueue):
+        metrics = self.stages["parse"]
+        metrics.start()
+        member = io.BufferedReader(_MemberFile(member_bytes, metrics), buffer_size=DOWNLOAD_BLOCK)
+        with pd.read_csv(member, header=config.header, names=config.columns, dtype=config.dtypes,
+                         chunksize=self.chunk_size) as reader:
+            # chunks committed by an interrupted load are parsed (to find the rest) but not handed on
+            for chunk in islice(reader, plan.first_chunk, None):
+                metrics.add(len(chunk))
+                frames.put(chunk, metrics)
+        frames.put(_END, metrics)
+        metrics.finish()
+
+    def _write(self, config, plan, frames: BoundedQueue):
+        metrics = self.stages["write"]
+        metrics.start()
+
+        def partitions():
+            while True:
+                chunk = frames.get(metrics)
+                if chunk is _END:
+                    return
+                yield chunk
+
+        rows = saving_partitions_to_database(config, partitions(), workers=self.workers, plan=plan)
+        metrics.add(rows)
+        metrics.finish()
+        logger.info("pipeline loaded %s: %d rows", config.name, rows)
+
+    # ------------------------------------------------------------------ driver
+
+    def run(self) -> dict:
+        """Runs all stages to completion and returns their metrics; raises the first stage error."""
+        started = time.perf_counter()
+        downloaded = self.queues[0]
+        self._spawn("download", self._download, downloaded)
+        unzip = self._spawn("unzip", self._unzip, downloaded)
+        unzip.join()
+        # member stages are only spawned by unzip, so the list is complete once it is done
+        for thread in list(self.threads):
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+        report = {"url": self.url, "seconds": round(time.perf_counter() - started, 3),
+                  "stages": [s.to_dict() for s in self.stages.values()],
+                  "queues": [q.to_dict() for q in self.queues]}
+        for stage in report["stages"]:
+            counted = {"bytes": stage["units"]} if stage["unit"] == "bytes" else {"rows": stage["units"]}
+            current_run().record("pipeline." + stage["stage"], seconds=stage["seconds"], **counted)
+            logger.info("stage %-8s %12d %-5s in %7.2fs  %12.0f %s/s  blocked %.2fs", stage["stage"],
+                        stage["units"], stage["unit"], stage["seconds"], stage["throughput_per_sec"],
+                        stage["unit"], stage["blocked_seconds"])
+        for q in report["queues"]:
+            logger.debug("queue %-28s max depth %d/%d, mean %.1f", q["queue"], q["max_depth"], q["capacity"],
+                         q["mean_depth"])
+        return report
+
+
+def _zip64_sizes(extra: bytes, size: int, compressed_size: int):
+    """Real (uncompressed, compressed) sizes from the ZIP64 extra field of a local header."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from("<HH", extra, offset)
+        if header_id == ZIP64_EXTRA:
+            values = list(struct.unpack_from(f"<{length // 8}Q", extra, offset + 4))
+            if size == 0xFFFFFFFF and values:
+                size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF and values:
+                compressed_size = values.pop(0)
+            break
+        offset += 4 + length
+    return size, compressed_size
+
+
+def _read_data_descriptor(stream: _ByteStream, zip64: bool) -> int:
+    """Consumes the data descriptor following a member and returns its CRC-32."""
+    head = stream.read_exact(4)
+    if head == DATA_DESCRIPTOR:
+        head = stream.read_exact(4)
+    stream.read_exact(16 if zip64 else 8)
+    return struct.unpack("<I", head)[0]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Download and load the MovieLens archive in one overlapped pass")
+    parser.add_argument("--dataset", choices=DATASETS, default=get_dataset().name,
+                        help="MovieLens dataset to load (default: $MOVIELENS_DATASET or ml-latest-small)")
+    parser.add_argument("--url", default=None,
+                        help="Archive URL (default: the one of the selected dataset, or e.g. a local HTTP server)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per parsed chunk")
+    parser.add_argument("--workers", type=int, default=1, help="Pooled connections writing each table")
+    parser.add_argument("--force", action="store_true", help="Reload tables even if they are unchanged")
+    parser.add_argument("--save-to", type=Path, default=None, help="Also keep the downloaded archive here")
+    parser.add_argument("--metrics-json", type=Path, default=None, help="Write the stage metrics to this file")
+    args = parser.parse_args()
+
+    select_dataset(args.dataset)
+    result = IngestPipeline(args.url, chunk_size=args.chunk_size, workers=args.workers, force=args.force,
+                            save_to=args.save_to).run()
+    if args.metrics_json is not None:
+        args.metrics_json.write_text(json.dumps(result, indent=2))
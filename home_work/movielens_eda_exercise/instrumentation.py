@@ -0,0 +1,289 @@
+"""Run instrumentation: wall time, rows, throughput, bytes and peak memory per stage and per table.
+
+The loaders and the EDA wrap their stages in `stage()`:
+
+    with stage("read_csv", table="ratings") as s:
+        df = pd.read_csv(...)
+        s.rows, s.bytes = len(df), member.file_size
+
+Every closed stage is added to the current RunReport and logged as one line with its rows/s: at INFO for
+the outermost stage of a thread (one per table for the loaders), at DEBUG for the stages nested in it. At the end of a run the
+report is written as JSON (`RunReport.write_json`) and optionally as a Prometheus textfile
+(`RunReport.write_prometheus`, for the node_exporter textfile collector), so runs can be compared over time.
+
+Peak RSS is sampled by one background thread that polls the resident set size every SAMPLE_INTERVAL seconds
+while at least one stage is open and raises the peak of every open stage. Stages that overlap (the loader runs
+one thread per table) therefore share the process peak of the time they were running. The RSS comes from
+psutil when it is installed, otherwise from /proc/self/statm; without either only wall time and counts are
+recorded.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+
+from pathlib import Path
+from typing import Optional
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger()
+
+try:
+    import psutil
+    has_psutil = True
+except Exception:
+    has_psutil = False
+
+SAMPLE_INTERVAL = 0.05
+PROMETHEUS_PREFIX = "movielens"
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None when it cannot be read."""
+    if has_psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def process_peak_rss() -> Optional[int]:
+    """High-water mark of the resident set size of this process in bytes (e.g. of a worker process)."""
+    try:
+        # unlike ru_maxrss, VmHWM is not inherited from the parent across fork and exec
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    if has_psutil:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    return current_rss()
+
+
+class StageRecord:
+    """Counters of one stage run; `rows` and `bytes` are filled in by the instrumented code."""
+
+    def __init__(self, stage: str, table: Optional[str] = None):
+        self.stage = stage
+        self.table = table
+        self.started_at = time.time()
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.peak_rss = None
+        self.error = None
+
+    def observe_rss(self, rss: Optional[int]):
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def to_dict(self) -> dict:
+        return {"stage": self.stage, "table": self.table,
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "seconds": round(self.seconds, 4), "rows": self.rows,
+                "rows_per_sec": round(self.rows / self.seconds, 1) if self.seconds > 0 else 0.0,
+                "bytes": self.bytes,
+                "bytes_per_sec": round(self.bytes / self.seconds, 1) if self.seconds > 0 else 0.0,
+                "peak_rss_bytes": self.peak_rss, "error": self.error}
+
+
+class _RssSampler:
+    """Polls the RSS while stages are open and feeds it to them."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._open = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self.peak = None
+
+    def add(self, record: StageRecord):
+        rss = current_rss()
+        record.observe_rss(rss)
+        with self._lock:
+            self._observe(rss)
+            self._open.add(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def remove(self, record: StageRecord):
+        record.observe_rss(current_rss())
+        with self._lock:
+            self._open.discard(record)
+
+    def _observe(self, rss):
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._open:
+                    self._wake.wait()
+            rss = current_rss()
+            if rss is None:
+                return
+            with self._lock:
+                self._observe(rss)
+                for record in self._open:
+                    record.observe_rss(rss)
+            time.sleep(self.interval)
+
+
+_sampler = _RssSampler()
+# stages open in the current thread, to log only the outermost one at INFO
+_open_stages = threading.local()
+
+
+class RunReport:
+    """The stages recorded during one run (one CLI command), thread-safe."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record: StageRecord):
+        with self._lock:
+            self.records.append(record)
+
+    def record(self, stage: str, table: Optional[str] = None, seconds: float = 0.0, rows: int = 0,
+               bytes: int = 0, peak_rss: Optional[int] = None) -> StageRecord:
+        """Adds a stage that was measured elsewhere (e.g. in a worker process)."""
+        entry = StageRecord(stage, table)
+        entry.started_at -= seconds
+        entry.seconds, entry.rows, entry.bytes, entry.peak_rss = seconds, rows, bytes, peak_rss
+        self.add(entry)
+        return entry
+
+    def totals(self, key: str) -> dict:
+        """Seconds, rows, bytes and peak RSS summed (peak: maximum) over the records grouped by `key`."""
+        groups = {}
+        with self._lock:
+            records = list(self.records)
+        for r in records:
+            name = getattr(r, key) or "-"
+            group = groups.setdefault(name, {"runs": 0, "seconds": 0.0, "rows": 0, "bytes": 0,
+                                             "peak_rss_bytes": None})
+            group["runs"] += 1
+            group["seconds"] += r.seconds
+            group["rows"] += r.rows
+            group["bytes"] += r.bytes
+            if r.peak_rss is not None:
+                group["peak_rss_bytes"] = max(group["peak_rss_bytes"] or 0, r.peak_rss)
+        for group in groups.values():
+            group["seconds"] = round(group["seconds"], 4)
+            group["rows_per_sec"] = round(group["rows"] / group["seconds"], 1) if group["seconds"] > 0 else 0.0
+        return groups
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            records = [r.to_dict() for r in self.records]
+        return {"run": self.name, "host": socket.gethostname(), "pid": os.getpid(),
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "seconds": round(time.time() - self.started_at, 4),
+                "peak_rss_bytes": process_peak_rss(),
+                "stages": records, "by_stage": self.totals("stage"), "by_table": self.totals("table")}
+
+    def write_json(self, path: Path) -> dict:
+        report = self.to_dict()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2))
+        logger.info("run report written to %s", path)
+        return report
+
+    def write_prometheus(self, path: Path):
+        """Writes the per stage and table totals in the Prometheus text format.
+
+        The file is replaced atomically, as the node_exporter textfile collector may read it at any time."""
+        metrics = {
+            "stage_seconds": ("gauge", "Wall time of the stage in seconds", "seconds"),
+            "stage_rows": ("gauge", "Rows processed by the stage", "rows"),
+            "stage_rows_per_second": ("gauge", "Rows processed per second of wall time", "rows_per_sec"),
+            "stage_bytes": ("gauge", "Bytes read by the stage", "bytes"),
+            "stage_peak_rss_bytes": ("gauge", "Peak resident set size while the stage ran", "peak_rss_bytes"),
+        }
+        groups = {}
+        with self._lock:
+            records = list(self.records)
+        for r in records:
+            groups.setdefault((r.stage, r.table or ""), []).append(r)
+        lines = []
+        for metric, (kind, help_text, field) in metrics.items():
+            name = f"{PROMETHEUS_PREFIX}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (stage_name, table), group in sorted(groups.items()):
+                seconds = sum(r.seconds for r in group)
+                rows = sum(r.rows for r in group)
+                values = {"seconds": seconds, "rows": rows, "bytes": sum(r.bytes for r in group),
+                          "rows_per_sec": rows / seconds if seconds > 0 else 0.0,
+                          "peak_rss_bytes": max((r.peak_rss for r in group if r.peak_rss is not None),
+                                                default=None)}
+                if values[field] is not None:
+                    lines.append(f'{name}{{run="{self.name}",stage="{stage_name}",table="{table}"}} '
+                                 f'{values[field]:.6g}')
+        lines.append(f'{PROMETHEUS_PREFIX}_run_timestamp_seconds{{run="{self.name}"}} {self.started_at:.0f}')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        tmp.replace(path)
+        logger.info("prometheus metrics written to %s", path)
+
+
+_current = RunReport("movielens")
+
+
+def current_run() -> RunReport:
+    return _current
+
+
+def start_run(name: str) -> RunReport:
+    """Starts a new, empty run report and makes it the current one."""
+    global _current
+    _current = RunReport(name)
+    return _current
+
+
+@contextmanager
+def stage(name: str, table: Optional[str] = None):
+    """Times the enclosed block as stage `name` of `table` and adds it to the current run report."""
+    record = StageRecord(name, table)
+    depth = getattr(_open_stages, "depth", 0)
+    _open_stages.depth = depth + 1
+    started = time.perf_counter()
+    _sampler.add(record)
+    try:
+        yield record
+    except BaseException as e:
+        record.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record.seconds = time.perf_counter() - started
+        _open_stages.depth = depth
+        _sampler.remove(record)
+        _current.add(record)
+        logger.log(logging.DEBUG if depth else logging.INFO,
+                   "%s%s: %d rows, %.1f MiB in %.3fs (%.0f rows/s), peak RSS %s", name,
+                   f" [{table}]" if table else "", record.rows, record.bytes / 2 ** 20, record.seconds,
+                   record.rows / record.seconds if record.seconds > 0 else 0.0,
+                   f"{record.peak_rss / 2 ** 20:.0f} MiB" if record.peak_rss is not None else "n/a")
@@ -0,0 +1,111 @@
+"""Incremental, resumable ingestion backed by the load_manifest table.
+
+Each zip member is fingerprinted with the CRC-32 and size stored in the archive's directory, so detecting a
+changed member does not require reading it. A member whose fingerprint matches a completed manifest entry is
+skipped. While a member is loading, every committed chunk is recorded in load_manifest_chunks inside the
+chunk's own transaction, so an interrupted load resumes after exactly the chunks that made it to the database.
+"""
+import logging
+
+from collections import namedtuple
+from datetime import datetime, timezone
+from zipfile import ZipFile
+
+from sqlalchemy import Table, select, func
+from sqlalchemy.engine import Connection
+
+from movielens_eda_exercise.bulk_loader import truncate_table
+from movielens_eda_exercise.models.manifest import LoadManifest, LoadManifestChunk
+
+logger = logging.getLogger()
+
+STATUS_LOADING = 'loading'
+STATUS_COMPLETE = 'complete'
+STATUS_FAILED = 'failed'
+
+LoadPlan = namedtuple("LoadPlan", ["skip", "first_chunk", "committed"])
+
+manifest_table = LoadManifest.__table__
+chunks_table = LoadManifestChunk.__table__
+
+
+def member_checksum(zip_file: ZipFile, inner_path: str) -> str:
+    """Fingerprint of a zip member taken from the archive directory (CRC-32 and uncompressed size)."""
+    info = zip_file.getinfo(inner_path)
+    return f"crc32:{info.CRC:08x}:{info.file_size}"
+
+
+def read_manifest(conn: Connection, table_name: str):
+    """Returns the manifest row of `table_name`, or None if it was never loaded."""
+    return conn.execute(select(manifest_table).where(manifest_table.c.table_name == table_name)).first()
+
+
+def _contiguous_prefix(committed: set) -> int:
+    """Index of the last chunk of the unbroken run of committed chunks starting at 0 (-1 if chunk 0 is missing)."""
+    last = -1
+    while last + 1 in committed:
+        last += 1
+    return last
+
+
+def _write_manifest(conn: Connection, table_name: str, **values):
+    values['updated_at'] = datetime.now(timezone.utc)
+    if read_manifest(conn, table_name) is None:
+        conn.execute(manifest_table.insert().values(table_name=table_name, **values))
+    else:
+        conn.execute(manifest_table.update().where(manifest_table.c.table_name == table_name).values(**values))
+
+
+def plan_load(engine, table: Table, inner_path: str, checksum: str, chunk_size: int, force: bool = False) -> LoadPlan:
+    """Decides how `table` should be (re)loaded from the zip member fingerprinted by `checksum`.
+
+    - unchanged and complete: skip it
+    - same member and chunk size, load interrupted: resume after the committed chunks
+    - anything else (including a failed load): empty the table and start a fresh load
+    """
+    with engine.begin() as conn:
+        entry = read_manifest(conn, table.name)
+        same_source = entry is not None and entry.zip_checksum == checksum and not force
+
+        if same_source and entry.status == STATUS_COMPLETE:
+            logger.info("%s unchanged since last load (%s, %d rows), skipping", table.name, checksum, entry.row_count)
+            return LoadPlan(True, 0, frozenset())
+
+        if same_source and entry.status == STATUS_LOADING and entry.chunk_size == chunk_size:
+            committed = set(conn.execute(
+                select(chunks_table.c.chunk_index).where(chunks_table.c.table_name == table.name)).scalars())
+            first_chunk = _contiguous_prefix(committed) + 1
+            _write_manifest(conn, table.name, last_chunk=first_chunk - 1)
+            logger.info("resuming %s after chunk %d (%d chunks already committed)",
+                        table.name, first_chunk - 1, len(committed))
+            return LoadPlan(False, first_chunk, frozenset(c for c in committed if c >= first_chunk))
+
+        truncate_table(conn, table)
+        conn.execute(chunks_table.delete().where(chunks_table.c.table_name == table.name))
+        _write_manifest(conn, table.name, inner_path=inner_path, zip_checksum=checksum, chunk_size=chunk_size,
+                        row_count=0, last_chunk=-1, status=STATUS_LOADING)
+        return LoadPlan(False, 0, frozenset())
+
+
+def record_chunk(conn: Connection, table: Table, chunk_index: int, rows: int):
+    """Records a loaded chunk; call it on the connection (and transaction) that inserted the chunk."""
+    conn.execute(chunks_table.insert().values(table_name=table.name, chunk_index=chunk_index, row_count=rows))
+
+
+def complete_load(engine, table: Table) -> int:
+    """Marks the load of `table` as complete and clears its chunk records. Returns the table's row count."""
+    with engine.begin() as conn:
+        chunk_rows = conn.execute(
+            select(func.count(), func.coalesce(func.sum(chunks_table.c.row_count), 0))
+            .where(chunks_table.c.table_name == table.name)).one()
+        conn.execute(chunks_table.delete().where(chunks_table.c.table_name == table.name))
+        _write_manifest(conn, table.name, row_count=int(chunk_rows[1]), last_chunk=int(chunk_rows[0]) - 1,
+                        status=STATUS_COMPLETE)
+    return int(chunk_rows[1])
+
+
+
+def fail_load(engine, table: Table):
+    """Marks the load of `table` as failed, e.g. after a corrupt member, so its chunks are not resumed."""
+    with engine.begin() as conn:
+        _write_manifest(conn, table.name, status=STATUS_FAILED)
@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, Float, PrimaryKeyConstraint
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import Column, Integer, Float, Index, PrimaryKeyConstraint
 
-Base = declarative_base()
+from movielens_eda_exercise.database import Base
+from movielens_eda_exercise.models.support import DatasetConfiguration
 
 
 # ============================================================================
@@ -34,6 +34,7 @@ class GenomeScore(Base):
 
     __table_args__ = (
         PrimaryKeyConstraint("movie_id", "tag_id"),
+        Index("ix_genome_scores_tag_relevance", "tag_id", "relevance"),
     )
 
 
@@ -41,7 +42,9 @@ class GenomeScore(Base):
 # Dataset Configuration Dictionaries
 # ============================================================================
 
-genome_scores = {  # contains movie-tag relevance data
-    "inner_path": "ml-latest/genome-scores.csv",
-    "columns": ["movieId", "tagId", "relevance"]
-}
+# contains movie-tag relevance data
+GenomeScoresConfiguration = DatasetConfiguration(name="genome_scores", file_name="genome-scores.csv",
+                                                 columns=["movieId", "tagId", "relevance"],
+                                                 dtypes={"movieId": "int32", "tagId": "int32",
+                                                         "relevance": "float32"},
+                                                 model=GenomeScore)
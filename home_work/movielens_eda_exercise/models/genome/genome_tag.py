@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field
 from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import declarative_base
 
-Base = declarative_base()
+from movielens_eda_exercise.database import Base
+from movielens_eda_exercise.models.support import DatasetConfiguration
 
 
 # ============================================================================
@@ -35,7 +35,8 @@ class GenomeTag(Base):
 # Dataset Configuration Dictionaries
 # ============================================================================
 
-genome_tags = {  # provides the tag descriptions for the tag IDs in the genome file
-    "inner_path": "ml-latest/genome-tags.csv",
-    "columns": ["tagId", "tag"]
-}
+# provides the tag descriptions for the tag IDs in the genome file
+GenomeTagsConfiguration = DatasetConfiguration(name="genome_tags", file_name="genome-tags.csv",
+                                               columns=["tagId", "tag"],
+                                               dtypes={"tagId": "int32", "tag": "string"},
+                                               model=GenomeTag)
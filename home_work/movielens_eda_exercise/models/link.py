@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer
+from sqlalchemy import Column, Integer, Index
 
 from .support import DatasetConfiguration
 from movielens_eda_exercise.database import Base
@@ -16,10 +16,16 @@ class Link(Base):
     imdb_id = Column(Integer, nullable=True)
     tmdb_id = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        Index("ix_links_movie", "movie_id"),
+    )
+
 
 # ============================================================================
 # Dataset Configuration Dictionaries
 # ============================================================================
 
-LinksConfiguration = DatasetConfiguration(name="links", inner_path="ml-latest-small/links.csv",
-                                          columns=["movieId", "imdbId", "tmdbId"])
+LinksConfiguration = DatasetConfiguration(name="links", file_name="links.csv",
+                                          columns=["movieId", "imdbId", "tmdbId"],
+                                          dtypes={"movieId": "int32", "imdbId": "int32", "tmdbId": "Int32"},
+                                          model=Link)
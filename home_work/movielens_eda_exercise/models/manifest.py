@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime
+
+from movielens_eda_exercise.database import Base
+
+
+# ============================================================================
+# SQLAlchemy ORM Model
+# ============================================================================
+
+class LoadManifest(Base):
+    """SQLAlchemy ORM model for load_manifest table: one row per ingested zip member."""
+    __tablename__ = "load_manifest"
+
+    table_name = Column(String(64), primary_key=True)
+    inner_path = Column(String(255), nullable=False)
+    zip_checksum = Column(String(64), nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    row_count = Column(BigInteger, nullable=False, default=0)
+    last_chunk = Column(Integer, nullable=False, default=-1)
+    status = Column(String(16), nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class LoadManifestChunk(Base):
+    """SQLAlchemy ORM model for load_manifest_chunks table: the chunks committed by an unfinished load."""
+    __tablename__ = "load_manifest_chunks"
+
+    table_name = Column(String(64), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True, autoincrement=False)
+    row_count = Column(Integer, nullable=False)
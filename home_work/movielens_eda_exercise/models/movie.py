@@ -20,5 +20,7 @@ class Movie(Base):
 # ============================================================================
 # Dataset Configuration Dictionaries
 # ============================================================================
-MovieConfiguration = DatasetConfiguration(name="movies", inner_path="ml-latest-small/movies.csv",
-                                          columns=["movieId", "title", "genres"])
+MovieConfiguration = DatasetConfiguration(name="movies", file_name="movies.csv",
+                                          columns=["movieId", "title", "genres"],
+                                          dtypes={"movieId": "int32", "title": "string", "genres": "category"},
+                                          model=Movie)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float
+from sqlalchemy import Column, Integer, Float, Index
 
 from .support import DatasetConfiguration
 from movielens_eda_exercise.database import Base
@@ -17,8 +17,18 @@ class Rating(Base):
     rating = Column(Float, nullable=False)
     timestamp = Column(Integer, nullable=False)
 
+    # secondary indexes, dropped before a bulk load and rebuilt after it (see index_manager)
+    __table_args__ = (
+        Index("ix_ratings_user_movie", "user_id", "movie_id"),
+        Index("ix_ratings_movie_timestamp", "movie_id", "timestamp"),
+        Index("ix_ratings_timestamp", "timestamp"),
+    )
+
 # ============================================================================
 # Dataset Configuration Dictionaries
 # ============================================================================
-RatingsConfiguration = DatasetConfiguration(name="ratings", inner_path="ml-latest-small/ratings.csv",
-                                            columns=['userId', 'movieId', 'rating', 'timestamp'])
+RatingsConfiguration = DatasetConfiguration(name="ratings", file_name="ratings.csv",
+                                            columns=['userId', 'movieId', 'rating', 'timestamp'],
+                                            dtypes={'userId': 'int32', 'movieId': 'int32', 'rating': 'float32',
+                                                    'timestamp': 'int64'},
+                                            model=Rating)
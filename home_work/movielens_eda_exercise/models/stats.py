@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Integer, BigInteger, Float
+
+from movielens_eda_exercise.database import Base
+
+# Rating histogram buckets: MovieLens ratings go from 0.5 to 5.0 in half-star steps
+HISTOGRAM_COLUMNS = [f"hist_{i // 2}_{(i % 2) * 5}" for i in range(1, 11)]
+
+
+# ============================================================================
+# SQLAlchemy ORM Model
+# ============================================================================
+
+class RatingAggregates:
+    """Columns shared by the aggregate tables, all of them additive (or min/max) so deltas can be merged."""
+    rating_count = Column(BigInteger, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0.0)
+    rating_sum_sq = Column(Float, nullable=False, default=0.0)
+    first_timestamp = Column(BigInteger, nullable=True)
+    last_timestamp = Column(BigInteger, nullable=True)
+    # one count per half-star rating, see HISTOGRAM_COLUMNS
+    hist_0_5 = Column(BigInteger, nullable=False, default=0)
+    hist_1_0 = Column(BigInteger, nullable=False, default=0)
+    hist_1_5 = Column(BigInteger, nullable=False, default=0)
+    hist_2_0 = Column(BigInteger, nullable=False, default=0)
+    hist_2_5 = Column(BigInteger, nullable=False, default=0)
+    hist_3_0 = Column(BigInteger, nullable=False, default=0)
+    hist_3_5 = Column(BigInteger, nullable=False, default=0)
+    hist_4_0 = Column(BigInteger, nullable=False, default=0)
+    hist_4_5 = Column(BigInteger, nullable=False, default=0)
+    hist_5_0 = Column(BigInteger, nullable=False, default=0)
+
+
+class MovieStats(RatingAggregates, Base):
+    """SQLAlchemy ORM model for movie_stats table: rating aggregates per movie."""
+    __tablename__ = "movie_stats"
+
+    movie_id = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class UserStats(RatingAggregates, Base):
+    """SQLAlchemy ORM model for user_stats table: rating aggregates per user."""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
@@ -1,3 +1,23 @@
+import re
 from collections import namedtuple
 
-DatasetConfiguration = namedtuple("DatasetConfiguration", ["name", "inner_path", "columns"])
+from movielens_eda_exercise.datasets import get_dataset
+
+
+# file_name: name of the CSV inside the dataset directory of the archive (see `inner_path`)
+# dtypes: pandas dtype per CSV column, used when parsing the CSV
+# header: row number of the CSV header line (replaced by `columns`), or None when the file has no header
+class DatasetConfiguration(namedtuple("DatasetConfiguration",
+                                      ["name", "file_name", "columns", "model", "dtypes", "header"],
+                                      defaults=[None, None, 0])):
+    __slots__ = ()
+
+    @property
+    def inner_path(self) -> str:
+        """Path of the CSV in the archive of the selected dataset (see datasets.py)."""
+        return get_dataset().member(self.file_name)
+
+
+def to_snake_case(column: str) -> str:
+    """Maps a MovieLens CSV header (e.g. `movieId`) to its ORM column name (e.g. `movie_id`)."""
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', column).lower()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index
 
 from .support import DatasetConfiguration
 from movielens_eda_exercise.database import Base
@@ -17,9 +17,17 @@ class Tag(Base):
     tag = Column(String(255), nullable=False)
     timestamp = Column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index("ix_tags_movie", "movie_id"),
+        Index("ix_tags_user_movie", "user_id", "movie_id"),
+    )
+
 
 # ============================================================================
 # Dataset Configuration Dictionaries
 # ============================================================================
-TagConfiguration = DatasetConfiguration(name="tag", inner_path="ml-latest-small/tags.csv",
-                                        columns=["userId", "movieId", "tag", "timestamp"])
+TagConfiguration = DatasetConfiguration(name="tag", file_name="tags.csv",
+                                        columns=["userId", "movieId", "tag", "timestamp"],
+                                        dtypes={"userId": "int32", "movieId": "int32", "tag": "category",
+                                                "timestamp": "int64"},
+                                        model=Tag)
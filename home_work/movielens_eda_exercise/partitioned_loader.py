@@ -0,0 +1,88 @@
+"""Intra-table parallel loading: a large table is split into row ranges that are bulk loaded concurrently,
+each partition on its own pooled connection and in its own transaction."""
+import logging
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator
+
+import pandas as pd
+
+from sqlalchemy import Table
+
+from movielens_eda_exercise.bulk_loader import bulk_load
+
+logger = logging.getLogger()
+
+PartitionResult = namedtuple("PartitionResult", ["index", "rows", "error"])
+
+
+def pool_capacity(engine) -> int:
+    """Number of connections the engine's pool can hand out at once (pool_size + max_overflow)."""
+    pool = engine.pool
+    size = pool.size() if hasattr(pool, 'size') else 1
+    overflow = max(0, getattr(pool, '_max_overflow', 0))
+    return max(1, size + overflow)
+
+
+def default_workers(engine, tables: int = 1) -> int:
+    """Default partition workers of each of `tables` tables loaded at once: their share of the pool size, or a
+    single writer on SQLite."""
+    if engine.dialect.name == 'sqlite':
+        return 1
+    size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+    return max(1, size // tables)
+
+
+def split_frame(df: pd.DataFrame, partition_rows: int) -> Iterator[pd.DataFrame]:
+    """Yields consecutive row ranges of `df` with at most `partition_rows` rows each."""
+    for start in range(0, len(df), partition_rows):
+        yield df.iloc[start:start + partition_rows]
+
+
+def _load_partition(engine, table: Table, index: int, partition: pd.DataFrame, on_partition,
+                    on_frame) -> PartitionResult:
+    try:
+        with engine.begin() as conn:
+            rows = bulk_load(conn, table, partition)
+            if on_frame is not None:
+                on_frame(conn, partition)
+            if on_partition is not None:
+                on_partition(conn, table, index, rows)
+        logger.debug("committed partition %d of %s (%d rows)", index, table.name, rows)
+        return PartitionResult(index, rows, None)
+    except Exception as e:
+        logger.exception("partition %d of %s failed: %s", index, table.name, e)
+        return PartitionResult(index, 0, e)
+
+
+def load_partitions(engine, table: Table, partitions: Iterable[pd.DataFrame], workers: int = 1,
+                    first_index: int = 0, skip: frozenset = frozenset(), on_partition=None,
+                    on_frame=None) -> list:
+    """Bulk loads `partitions` into `table` over up to `workers` pooled connections at once.
+
+    Every partition is committed on its own, a failing partition does not roll back the others. At most
+    2 * workers partitions are in flight, so a lazy iterable of partitions is consumed with bounded memory.
+    Partitions are numbered from `first_index`; those listed in `skip` are not loaded. `on_partition(conn,
+    table, index, rows)` and `on_frame(conn, partition)` run in the partition's transaction, right before it
+    commits (e.g. to record the chunk or to maintain aggregates of the loaded rows).
+    Returns one PartitionResult per loaded partition, ordered by partition index."""
+    if engine.dialect.name == 'sqlite' and workers > 1:
+        logger.debug("sqlite allows a single writer, loading %s with one worker", table.name)
+        workers = 1
+    workers = max(1, min(workers, pool_capacity(engine)))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"load-{table.name}") as executor:
+        pending = set()
+        for index, partition in enumerate(partitions, start=first_index):
+            if index in skip:
+                continue
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in done)
+            pending.add(executor.submit(_load_partition, engine, table, index, partition, on_partition,
+                                        on_frame))
+        results.extend(f.result() for f in wait(pending).done)
+
+    return sorted(results, key=lambda r: r.index)
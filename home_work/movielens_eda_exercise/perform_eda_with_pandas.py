@@ -1,33 +1,62 @@
+import time
 import pandas as pd
 import logging
 from pathlib import Path
+from functools import lru_cache
 from typing import Optional
 
-from movielens_eda_exercise.database import engine
+from movielens_eda_exercise.database import get_engine
+from movielens_eda_exercise.data_access import read_table, table_row_count
+from movielens_eda_exercise.eda_reports import build_reports, merge_titles, profiled_rows, read_ratings
+from movielens_eda_exercise.instrumentation import process_peak_rss, stage
+from movielens_eda_exercise.streaming_profiler import profile_tables
 
-logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(levelname)s: %(message)s')
 logger = logging.getLogger()
 
-# Detect pandas_profiling (or ydata_profiling)
-try:
-    from pandas_profiling import ProfileReport  # type: ignore
-    has_profile = True
-except Exception:
+# Above this many ratings the full in-memory ProfileReport is replaced by the streaming profiler
+MAX_PROFILE_ROWS = 2_000_000
+
+
+@lru_cache(maxsize=None)
+def profile_report_class():
+    """ProfileReport of pandas_profiling (or ydata_profiling), or None when neither is installed.
+
+    Imported on first use: loading either library takes seconds."""
     try:
-        from ydata_profiling import ProfileReport  # type: ignore
-        has_profile = True
+        from pandas_profiling import ProfileReport  # type: ignore
     except Exception:
-        has_profile = False
-        logger.debug("pandas_profiling / ydata_profiling not available; will produce basic summaries instead")
+        try:
+            from ydata_profiling import ProfileReport  # type: ignore
+        except Exception:
+            logger.debug("pandas_profiling / ydata_profiling not available; will use the streaming profiler instead")
+            return None
+    return ProfileReport
+
+
+def _profile_report_job(df: pd.DataFrame, title: str, path: Path, minimal: bool) -> tuple:
+    """Builds and saves a single ProfileReport; runs in a worker process.
+
+    Returns the path with the build time and the peak RSS of the worker, for the run report."""
+    started = time.perf_counter()
+    profile_report_class()(df, title=title, minimal=minimal).to_file(str(path))
+    return path, time.perf_counter() - started, process_peak_rss()
+
 
+def perform_eda_with(plots_dir: Optional[Path] = None, refresh_cache: bool = False,
+                     max_profile_rows: int = MAX_PROFILE_ROWS, sample_rows: Optional[int] = None,
+                     minimal: bool = False):
+    """Generate pandas profiling reports (or streaming sketch profiles) for MovieLens tables.
 
-def perform_eda_with(plots_dir: Optional[Path] = None):
-    """Generate pandas profiling reports (or basic summaries) for MovieLens tables."""
+    The ratings, movies and merged reports are independent and are built in parallel worker processes.
+    With `sample_rows` the ratings (and therefore the merged frame) are replaced by a sample stratified by
+    movie and user, streamed from the database, and only the sample size is compared with `max_profile_rows`;
+    the sampling fraction is shown in the report titles and saved to report_sampling.json."""
     if plots_dir is None:
         plots_dir = Path(__file__).parent / "plots"
     plots_dir.mkdir(parents=True, exist_ok=True)
 
     try:
+        engine = get_engine()
         with engine.connect() as conn:
             # Try MySQL-style INFORMATION_SCHEMA first, fall back to sqlite_master
             try:
@@ -56,72 +85,61 @@ def perform_eda_with(plots_dir: Optional[Path] = None):
                 logger.error("Required tables 'ratings' and 'movies' not found in database. Found: %s", tables)
                 return
 
-            ratings = pd.read_sql_table('ratings', conn)
-            movies = pd.read_sql_table('movies', conn)
+            ratings_rows = table_row_count('ratings')
+            has_profile = profile_report_class() is not None
+            # a sample is streamed from the database, so only its size counts against the limit
+            use_streaming = not has_profile or profiled_rows(ratings_rows, sample_rows) > max_profile_rows
+            if not use_streaming:
+                # served from the local columnar cache unless the tables changed since the last run
+                with stage("eda.read", table='ratings') as s:
+                    ratings, sample_note = read_ratings(plots_dir, ratings_rows, sample_rows, refresh_cache)
+                    s.rows, s.bytes = len(ratings), int(ratings.memory_usage(index=False).sum())
+                with stage("eda.read", table='movies') as s:
+                    movies = read_table('movies', refresh=refresh_cache)
+                    s.rows, s.bytes = len(movies), int(movies.memory_usage(index=False).sum())
 
     except Exception as e:
         logger.exception("Failed to read tables from DB: %s", e)
         return
 
-    # Normalize rating column
-    if 'rating' in ratings.columns:
-        ratings['rating'] = pd.to_numeric(ratings['rating'], errors='coerce')
-
-    # Prepare merged dataframe when possible
-    merged = None
-    if 'movie_id' in ratings.columns and ('movie_id' in movies.columns or 'movieId' in movies.columns):
-        if 'movie_id' in movies.columns:
-            merge_cols = ['movie_id'] + (['title'] if 'title' in movies.columns else [])
-            movies_for_merge = movies[merge_cols]
-        else:
-            movies_for_merge = movies
-        merged = ratings.merge(movies_for_merge, left_on='movie_id',
-                               right_on=movies_for_merge.columns[0], how='left')
-
-    # Generate detailed ProfileReport if available
-    if has_profile:
+    if use_streaming:
+        # Fallback: single-pass sketch profiles, memory does not depend on the table size
         try:
-            logger.debug("Generating ProfileReport reports (this may take a while)...")
-
-            rpt = ProfileReport(ratings, title="Ratings Profile", minimal=False)
-            p_r = plots_dir / "ratings_profile_pandas_profiling.html"
-            rpt.to_file(str(p_r))
-            logger.info("Saved ratings ProfileReport: %s", p_r)
-
-            rpt = ProfileReport(movies, title="Movies Profile", minimal=False)
-            p_m = plots_dir / "movies_profile_pandas_profiling.html"
-            rpt.to_file(str(p_m))
-            logger.info("Saved movies ProfileReport: %s", p_m)
+            logger.info("Profiling with the streaming profiler (profile library available: %s, ratings rows: %d)",
+                        has_profile, ratings_rows)
+            profile_tables(['ratings', 'movies'], plots_dir=plots_dir)
+        except Exception as e:
+            logger.exception("Failed to generate streaming profiles: %s", e)
+        logger.info("EDA finished. Outputs saved to %s", plots_dir)
+        return
 
-            if merged is not None:
-                rpt = ProfileReport(merged, title="Merged Profile", minimal=False)
-                p_mm = plots_dir / "merged_profile_pandas_profiling.html"
-                rpt.to_file(str(p_mm))
-                logger.info("Saved merged ProfileReport: %s", p_mm)
+    # Generate detailed ProfileReports, one worker process per report
+    jobs = [
+        (ratings, "Ratings Profile" + sample_note, plots_dir / "ratings_profile_pandas_profiling.html"),
+        (movies, "Movies Profile", plots_dir / "movies_profile_pandas_profiling.html"),
+    ]
+    merged = merge_titles(ratings, movies)
+    if merged is not None:
+        jobs.append((merged, "Merged Profile" + sample_note, plots_dir / "merged_profile_pandas_profiling.html"))
 
-        except Exception as e:
-            logger.exception("Failed to generate ProfileReport reports: %s", e)
-    else:
-        # Fallback: save simple descriptive statistics and head samples
-        try:
-            logger.debug("pandas_profiling not available; saving basic summaries instead")
-            (plots_dir / "ratings_describe.csv").write_text(ratings.describe(include='all').to_csv())
-            (plots_dir / "ratings_head.csv").write_text(ratings.head(100).to_csv(index=False))
-            (plots_dir / "movies_describe.csv").write_text(movies.describe(include='all').to_csv())
-            (plots_dir / "movies_head.csv").write_text(movies.head(100).to_csv(index=False))
-            if merged is not None:
-                (plots_dir / "merged_describe.csv").write_text(merged.describe(include='all').to_csv())
-                (plots_dir / "merged_head.csv").write_text(merged.head(100).to_csv(index=False))
-            logger.info("Saved basic CSV summaries to %s", plots_dir)
-        except Exception as e:
-            logger.exception("Failed to save basic summaries: %s", e)
+    logger.debug("Generating ProfileReport reports (this may take a while)...")
+    build_reports(_profile_report_job, jobs, minimal, "ProfileReport")
 
     logger.info("EDA finished. Outputs saved to %s", plots_dir)
 
 
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser(description="Perform EDA using pandas_profiling / basic summaries")
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description="Perform EDA using pandas_profiling / streaming profiles")
     parser.add_argument("--plots-dir", type=Path, default=None, help="Directory to save reports")
+    parser.add_argument("--refresh-cache", action="store_true", help="Re-read the tables from the database")
+    parser.add_argument("--max-profile-rows", type=int, default=MAX_PROFILE_ROWS,
+                        help="Use the streaming profiler when ratings has more rows than this")
+    parser.add_argument("--sample-rows", type=int, default=None,
+                        help="Profile a sample of about this many ratings, stratified by movie and user")
+    parser.add_argument("--minimal", action="store_true", help="Build minimal (faster) ProfileReports")
     args = parser.parse_args()
-    perform_eda_with(plots_dir=args.plots_dir)
+    perform_eda_with(plots_dir=args.plots_dir, refresh_cache=args.refresh_cache,
+                     max_profile_rows=args.max_profile_rows, sample_rows=args.sample_rows, minimal=args.minimal)
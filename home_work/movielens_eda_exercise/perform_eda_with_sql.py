@@ -0,0 +1,153 @@
+import pandas as pd
+import logging
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import select, func, case, inspect, literal_column
+
+from movielens_eda_exercise.database import get_engine
+from movielens_eda_exercise.instrumentation import stage
+from movielens_eda_exercise.models.rating import Rating
+from movielens_eda_exercise.models.movie import Movie
+
+logger = logging.getLogger()
+
+ratings = Rating.__table__
+movies = Movie.__table__
+
+# Calendar year of a unix `timestamp` column, per dialect
+YEAR_EXPRESSIONS = {
+    'mysql': "YEAR(FROM_UNIXTIME(timestamp))",
+    'sqlite': "CAST(strftime('%Y', timestamp, 'unixepoch') AS INTEGER)",
+    'postgresql': "CAST(EXTRACT(YEAR FROM to_timestamp(timestamp)) AS INTEGER)",
+}
+
+
+def _null_count(column):
+    return func.sum(case((column.is_(None), 1), else_=0))
+
+
+def ratings_summary_query():
+    """describe()-style statistics of the ratings table in a single aggregate query."""
+    r = ratings.c
+    return select(
+        func.count().label('rows'),
+        func.count(func.distinct(r.user_id)).label('distinct_users'),
+        func.count(func.distinct(r.movie_id)).label('distinct_movies'),
+        func.avg(r.rating).label('rating_mean'),
+        func.avg(r.rating * r.rating).label('rating_mean_of_squares'),
+        func.min(r.rating).label('rating_min'),
+        func.max(r.rating).label('rating_max'),
+        func.min(r.timestamp).label('timestamp_min'),
+        func.max(r.timestamp).label('timestamp_max'),
+        _null_count(r.user_id).label('user_id_nulls'),
+        _null_count(r.movie_id).label('movie_id_nulls'),
+        _null_count(r.rating).label('rating_nulls'),
+        _null_count(r.timestamp).label('timestamp_nulls'),
+    )
+
+
+def rating_histogram_query():
+    r = ratings.c
+    return select(r.rating, func.count().label('count')).group_by(r.rating).order_by(r.rating)
+
+
+def movie_stats_query():
+    """Per-movie aggregates joined with the movie titles (ratings ⋈ movies on the database side)."""
+    r = ratings.c
+    stats = (select(r.movie_id,
+                    func.count().label('num_ratings'),
+                    func.avg(r.rating).label('avg_rating'),
+                    func.min(r.rating).label('min_rating'),
+                    func.max(r.rating).label('max_rating'),
+                    func.min(r.timestamp).label('first_rated'),
+                    func.max(r.timestamp).label('last_rated'))
+             .group_by(r.movie_id)
+             .subquery())
+    return (select(stats, movies.c.title, movies.c.genres)
+            .select_from(stats.outerjoin(movies, movies.c.movie_id == stats.c.movie_id))
+            .order_by(stats.c.num_ratings.desc()))
+
+
+def user_stats_query():
+    r = ratings.c
+    return (select(r.user_id,
+                   func.count().label('num_ratings'),
+                   func.avg(r.rating).label('avg_rating'),
+                   func.min(r.timestamp).label('first_rated'),
+                   func.max(r.timestamp).label('last_rated'))
+            .group_by(r.user_id))
+
+
+def ratings_per_year_query(dialect_name: str):
+    expression = YEAR_EXPRESSIONS.get(dialect_name)
+    if expression is None:
+        return None
+    year = literal_column(expression).label('year')
+    return (select(year, func.count().label('num_ratings'), func.avg(ratings.c.rating).label('avg_rating'))
+            .group_by(literal_column(expression)).order_by(literal_column(expression)))
+
+
+def movies_summary_query():
+    m = movies.c
+    return select(
+        func.count().label('rows'),
+        _null_count(m.title).label('title_nulls'),
+        _null_count(m.genres).label('genres_nulls'),
+        func.sum(case((m.genres == '(no genres listed)', 1), else_=0)).label('no_genres_listed'),
+    )
+
+
+def perform_eda_with(plots_dir: Optional[Path] = None):
+    """Computes the EDA summaries inside the database and saves the (small) results as CSV files.
+
+    Only aggregates cross the wire, so the run time is bounded by the database and not by client memory."""
+    if plots_dir is None:
+        plots_dir = Path(__file__).parent / "plots"
+    plots_dir.mkdir(parents=True, exist_ok=True)
+
+    engine = get_engine()
+    inspector = inspect(engine)
+    if not inspector.has_table('ratings') or not inspector.has_table('movies'):
+        logger.error("Required tables 'ratings' and 'movies' not found in database.")
+        return
+
+    queries = {
+        'ratings_summary': ratings_summary_query(),
+        'rating_histogram': rating_histogram_query(),
+        'movie_stats': movie_stats_query(),
+        'user_stats': user_stats_query(),
+        'movies_summary': movies_summary_query(),
+    }
+    per_year = ratings_per_year_query(engine.dialect.name)
+    if per_year is not None:
+        queries['ratings_per_year'] = per_year
+
+    try:
+        with engine.connect() as conn:
+            for name, query in queries.items():
+                with stage("eda.sql", table=name) as s:
+                    result = pd.read_sql_query(query, conn)
+                    s.rows = len(result)
+                if name == 'ratings_summary':
+                    variance = result['rating_mean_of_squares'] - result['rating_mean'] ** 2
+                    result['rating_std'] = variance.clip(lower=0) ** 0.5
+                    result = result.drop(columns=['rating_mean_of_squares'])
+                p = plots_dir / f"{name}_sql.csv"
+                p.write_text(result.to_csv(index=False))
+                logger.info("Saved %s (%d rows): %s", name, len(result), p)
+    except Exception as e:
+        logger.exception("Failed to run pushdown EDA queries: %s", e)
+        return
+
+    logger.info("EDA finished. Outputs saved to %s", plots_dir)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description="Perform EDA on MovieLens data with SQL pushdown aggregates")
+    parser.add_argument("--plots-dir", type=Path, default=None, help="Directory to save summaries")
+    args = parser.parse_args()
+    perform_eda_with(plots_dir=args.plots_dir)
@@ -1,22 +1,57 @@
+import time
 import pandas as pd
 
 import logging
 
-import sweetviz as sv
 from pathlib import Path
+from functools import lru_cache
 from typing import Optional
 
-from movielens_eda_exercise.database import engine
+from movielens_eda_exercise.database import get_engine
+from movielens_eda_exercise.data_access import read_table, table_row_count
+from movielens_eda_exercise.eda_reports import build_reports, merge_titles, profiled_rows, read_ratings
+from movielens_eda_exercise.instrumentation import process_peak_rss, stage
+from movielens_eda_exercise.streaming_profiler import profile_tables
 
-logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(levelname)s: %(message)s')
 logger = logging.getLogger()
 
+# Above this many ratings sweetviz is replaced by the streaming profiler
+MAX_PROFILE_ROWS = 2_000_000
 
-def perform_eda_with(plots_dir: Optional[Path] = None):
+
+@lru_cache(maxsize=None)
+def sweetviz_module():
+    """The sweetviz module imported on first use, or None when it is not installed."""
+    try:
+        import sweetviz
+    except Exception:
+        logger.debug("sweetviz not available; will use the streaming profiler instead")
+        return None
+    return sweetviz
+
+
+def _sweetviz_report_job(df: pd.DataFrame, name: str, path: Path, minimal: bool) -> tuple:
+    """Builds and saves a single sweetviz report; runs in a worker process.
+
+    Returns the path with the build time and the peak RSS of the worker, for the run report."""
+    started = time.perf_counter()
+    report = sweetviz_module().analyze([df, name], pairwise_analysis='off' if minimal else 'auto')
+    report.show_html(str(path), open_browser=False)
+    return path, time.perf_counter() - started, process_peak_rss()
+
+
+def perform_eda_with(plots_dir: Optional[Path] = None, refresh_cache: bool = False,
+                     max_profile_rows: int = MAX_PROFILE_ROWS, sample_rows: Optional[int] = None,
+                     minimal: bool = False):
     """Performs exploratory data analysis on the MovieLens DB.
 
     Parameters
     - plots_dir: optional Path to save plots. Defaults to a `plots/` folder next to this file.
+    - refresh_cache: re-read the tables from the database instead of the local columnar cache.
+    - max_profile_rows: use the streaming profiler when ratings has more rows than this.
+    - sample_rows: profile about this many ratings, stratified by movie and user, instead of all of them; the
+      sample is streamed from the database and only its size is compared with max_profile_rows.
+    - minimal: skip the pairwise association analysis.
     """
 
     if plots_dir is None:
@@ -24,6 +59,7 @@ def perform_eda_with(plots_dir: Optional[Path] = None):
     plots_dir.mkdir(parents=True, exist_ok=True)
 
     try:
+        engine = get_engine()
         with engine.connect() as conn:
             # Try MySQL-style INFORMATION_SCHEMA first
             try:
@@ -53,50 +89,46 @@ def perform_eda_with(plots_dir: Optional[Path] = None):
                 logger.error("Required tables 'ratings' and 'movies' not found in database. Found: %s", tables)
                 return
 
-            ratings = pd.read_sql_table('ratings', conn)
-            movies = pd.read_sql_table('movies', conn)
+            ratings_rows = table_row_count('ratings')
+            has_sweetviz = sweetviz_module() is not None
+            # a sample is streamed from the database, so only its size counts against the limit
+            use_streaming = not has_sweetviz or profiled_rows(ratings_rows, sample_rows) > max_profile_rows
+            if not use_streaming:
+                # served from the local columnar cache unless the tables changed since the last run
+                with stage("eda.read", table='ratings') as s:
+                    ratings, sample_note = read_ratings(plots_dir, ratings_rows, sample_rows, refresh_cache)
+                    s.rows, s.bytes = len(ratings), int(ratings.memory_usage(index=False).sum())
+                with stage("eda.read", table='movies') as s:
+                    movies = read_table('movies', refresh=refresh_cache)
+                    s.rows, s.bytes = len(movies), int(movies.memory_usage(index=False).sum())
 
     except Exception as e:
         logger.exception("Failed to read tables from DB: %s", e)
         return
 
-    # Convert rating column to numeric
-    if 'rating' in ratings.columns:
-        ratings['rating'] = pd.to_numeric(ratings['rating'], errors='coerce')
+    if use_streaming:
+        # Fallback: single-pass sketch profiles, memory does not depend on the table size
+        try:
+            logger.info("Profiling with the streaming profiler (sweetviz available: %s, ratings rows: %d)",
+                        has_sweetviz, ratings_rows)
+            profile_tables(['ratings', 'movies'], plots_dir=plots_dir)
+        except Exception as e:
+            logger.exception("Failed to generate streaming profiles: %s", e)
+        logger.info('EDA finished. Plots saved to %s', plots_dir)
+        return
 
-    # Generate profiling reports using sweetviz if available
-    try:
-        logger.debug("Generating sweetviz reports for ratings and movies (this may take a while)...")
-
-        # Ratings report
-        ratings_report = sv.analyze(ratings)
-        p_ratings = plots_dir / 'ratings_profile_sweetviz.html'
-        ratings_report.show_html(str(p_ratings), open_browser=False)
-        logger.info("Saved ratings sweetviz report: %s", p_ratings)
-
-        # Movies report
-        movies_report = sv.analyze(movies)
-        p_movies = plots_dir / 'movies_profile_sweetviz.html'
-        movies_report.show_html(str(p_movies), open_browser=False)
-        logger.info("Saved movies sweetviz report: %s", p_movies)
-
-        # Merged report when possible (include title when available)
-        if 'movie_id' in ratings.columns and ('movie_id' in movies.columns or 'movieId' in movies.columns):
-            if 'movie_id' in movies.columns:
-                merge_cols = ['movie_id'] + (['title'] if 'title' in movies.columns else [])
-                movies_for_merge_prof = movies[merge_cols]
-            else:
-                movies_for_merge_prof = movies
-
-            merged_prof = ratings.merge(movies_for_merge_prof, left_on='movie_id',
-                                        right_on=movies_for_merge_prof.columns[0], how='left')
-            merged_report = sv.analyze(merged_prof)
-            p_merged = plots_dir / 'merged_profile_sweetviz.html'
-            merged_report.show_html(str(p_merged), open_browser=False)
-            logger.info("Saved merged sweetviz report: %s", p_merged)
+    jobs = [
+        (ratings, "Ratings" + sample_note, plots_dir / 'ratings_profile_sweetviz.html'),
+        (movies, "Movies", plots_dir / 'movies_profile_sweetviz.html'),
+    ]
+    # Merged report when possible (include title when available)
+    merged_prof = merge_titles(ratings, movies)
+    if merged_prof is not None:
+        jobs.append((merged_prof, "Ratings + movies" + sample_note, plots_dir / 'merged_profile_sweetviz.html'))
 
-    except Exception as e:
-        logger.exception("Failed to generate sweetviz reports: %s", e)
+    # Generate profiling reports using sweetviz, one worker process per report
+    logger.debug("Generating sweetviz reports for ratings and movies (this may take a while)...")
+    build_reports(_sweetviz_report_job, jobs, minimal, "sweetviz report")
 
     logger.info('EDA finished. Plots saved to %s', plots_dir)
 
@@ -104,9 +136,18 @@ def perform_eda_with(plots_dir: Optional[Path] = None):
 if __name__ == "__main__":
     import argparse
 
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
     parser = argparse.ArgumentParser(description="Perform EDA on MovieLens data")
     parser.add_argument("--plots-dir", type=Path, default=None, help="Directory to save plots")
+    parser.add_argument("--refresh-cache", action="store_true", help="Re-read the tables from the database")
+    parser.add_argument("--max-profile-rows", type=int, default=MAX_PROFILE_ROWS,
+                        help="Use the streaming profiler when ratings has more rows than this")
+    parser.add_argument("--sample-rows", type=int, default=None,
+                        help="Profile a sample of about this many ratings, stratified by movie and user")
+    parser.add_argument("--minimal", action="store_true", help="Skip the pairwise association analysis")
 
     args = parser.parse_args()
 
-    perform_eda_with(plots_dir=args.plots_dir)
+    perform_eda_with(plots_dir=args.plots_dir, refresh_cache=args.refresh_cache,
+                     max_profile_rows=args.max_profile_rows, sample_rows=args.sample_rows, minimal=args.minimal)
@@ -0,0 +1,257 @@
+"""Incrementally maintained rating aggregates per movie (`movie_stats`) and per user (`user_stats`).
+
+Every loaded chunk of ratings is reduced to one delta row per movie and per user (count, sum, sum of squares,
+first/last timestamp and a half-star histogram). A `RatingAggregator` collects the deltas of the chunks of one
+load in memory, combined to O(movies + users) rows, and merges them into the aggregate tables with a dialect
+upsert in a single transaction once every chunk has committed. Merging in the chunks' own transactions made
+the concurrent partitions upsert the same hot movie rows and deadlock or queue behind each other.
+
+A fresh load of `ratings` empties the aggregates first. A resumed load cannot know the deltas of the chunks
+committed by the interrupted run, so it recomputes the aggregates from the ratings table once it completes
+(`rebuild_stats`). Until a load has finished the aggregates do not include its ratings.
+
+Readers then get counts, mean and variance per movie or user from a table of O(movies) / O(users) rows
+instead of grouping all the ratings again.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import Table, select, func, case
+from sqlalchemy.engine import Connection
+
+from movielens_eda_exercise.database import get_engine
+from movielens_eda_exercise.models.rating import Rating
+from movielens_eda_exercise.models.stats import MovieStats, UserStats, HISTOGRAM_COLUMNS
+from movielens_eda_exercise.models.support import to_snake_case
+
+logger = logging.getLogger()
+
+ratings_table = Rating.__table__
+# aggregate table -> the ratings column it groups by
+STATS_TABLES = {MovieStats.__table__: 'movie_id', UserStats.__table__: 'user_id'}
+SUM_COLUMNS = ['rating_count', 'rating_sum', 'rating_sum_sq'] + HISTOGRAM_COLUMNS
+# collected delta frames are combined into one when there are this many
+COMBINE_EVERY = 16
+# rows per upsert statement of the final merge
+MERGE_BATCH = 10_000
+
+UPSERTS = {}
+
+
+def register_upsert(dialect_name: str):
+    """Registers the decorated function as the aggregate upsert for `dialect_name`."""
+    def decorator(func):
+        UPSERTS[dialect_name] = func
+        return func
+    return decorator
+
+
+def rating_deltas(ratings: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Aggregates a chunk of ratings per `key` ('movie_id' or 'user_id') into delta rows of the stats tables."""
+    ratings = ratings.rename(columns=to_snake_case).dropna(subset=[key])
+    values = ratings['rating'].to_numpy(dtype=np.float64)
+    bucket = np.clip(np.rint(values * 2).astype(np.int64) - 1, 0, len(HISTOGRAM_COLUMNS) - 1)
+    frame = pd.DataFrame({
+        key: ratings[key].to_numpy(dtype=np.int64),
+        'rating_count': 1,
+        'rating_sum': values,
+        'rating_sum_sq': values * values,
+        'first_timestamp': ratings['timestamp'].to_numpy(dtype=np.int64),
+        'last_timestamp': ratings['timestamp'].to_numpy(dtype=np.int64),
+    })
+    for i, column in enumerate(HISTOGRAM_COLUMNS):
+        frame[column] = (bucket == i).astype(np.int64)
+    return _combine(frame, key)
+
+
+def _combine(frame: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Sums the delta rows of `frame` per `key` (min / max of the timestamps), sorted by key."""
+    aggregations = dict.fromkeys(SUM_COLUMNS, 'sum')
+    aggregations.update(first_timestamp='min', last_timestamp='max')
+    return frame.groupby(key, sort=True).agg(aggregations).reset_index()
+
+
+def _merge_values(table: Table, new):
+    """SET clause adding the delta `new` (the dialect's inserted/excluded row) to the stored aggregates."""
+    values = {c: table.c[c] + new[c] for c in SUM_COLUMNS}
+    values['first_timestamp'] = func.coalesce(func.least(table.c.first_timestamp, new.first_timestamp),
+                                              new.first_timestamp)
+    values['last_timestamp'] = func.coalesce(func.greatest(table.c.last_timestamp, new.last_timestamp),
+                                             new.last_timestamp)
+    return values
+
+
+@register_upsert('mysql')
+def upsert_mysql(conn: Connection, table: Table, key: str, rows: list):
+    from sqlalchemy.dialects.mysql import insert
+
+    stmt = insert(table)
+    conn.execute(stmt.on_duplicate_key_update(_merge_values(table, stmt.inserted)), rows)
+
+
+@register_upsert('postgresql')
+def upsert_postgresql(conn: Connection, table: Table, key: str, rows: list):
+    from sqlalchemy.dialects.postgresql import insert
+
+    stmt = insert(table)
+    conn.execute(stmt.on_conflict_do_update(index_elements=[key], set_=_merge_values(table, stmt.excluded)), rows)
+
+
+@register_upsert('sqlite')
+def upsert_sqlite(conn: Connection, table: Table, key: str, rows: list):
+    from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(table)
+    values = _merge_values(table, stmt.excluded)
+    # sqlite has no LEAST/GREATEST, its multi-argument min()/max() are the scalar equivalents
+    values['first_timestamp'] = func.coalesce(func.min(table.c.first_timestamp, stmt.excluded.first_timestamp),
+                                              stmt.excluded.first_timestamp)
+    values['last_timestamp'] = func.coalesce(func.max(table.c.last_timestamp, stmt.excluded.last_timestamp),
+                                             stmt.excluded.last_timestamp)
+    conn.execute(stmt.on_conflict_do_update(index_elements=[key], set_=values), rows)
+
+
+def upsert_generic(conn: Connection, table: Table, key: str, rows: list):
+    """Read-modify-write fallback for dialects without an upsert statement."""
+    existing = {row[0]: row for row in conn.execute(
+        select(table.c[key], *[table.c[c] for c in SUM_COLUMNS], table.c.first_timestamp, table.c.last_timestamp)
+        .where(table.c[key].in_([r[key] for r in rows]))).mappings()}
+    for row in rows:
+        old = existing.get(row[key])
+        if old is None:
+            conn.execute(table.insert().values(**row))
+            continue
+        merged = {c: old[c] + row[c] for c in SUM_COLUMNS}
+        merged['first_timestamp'] = min(t for t in (old['first_timestamp'], row['first_timestamp']) if t is not None)
+        merged['last_timestamp'] = max(t for t in (old['last_timestamp'], row['last_timestamp']) if t is not None)
+        conn.execute(table.update().where(table.c[key] == row[key]).values(**merged))
+
+
+def merge_deltas(conn: Connection, table: Table, key: str, deltas: pd.DataFrame):
+    """Adds the delta rows to the stored aggregates of `table`, in key order so that concurrent merges lock the
+    rows in the same order."""
+    upsert = UPSERTS.get(conn.dialect.name, upsert_generic)
+    deltas = deltas.sort_values(key)
+    for start in range(0, len(deltas), MERGE_BATCH):
+        upsert(conn, table, key, deltas.iloc[start:start + MERGE_BATCH].astype(object).to_dict('records'))
+
+
+class RatingAggregator:
+    """Maintains movie_stats and user_stats for one load of ratings.
+
+    `add(conn, ratings)` has the signature of the loaders' per-frame hook: it only collects the deltas of the
+    frame (thread safe, the connection is not used). `finish(engine)` merges them once the load is complete.
+    When the load resumes an interrupted one (`fresh=False`) nothing is collected and `finish` rebuilds the
+    aggregates from the ratings table instead."""
+
+    def __init__(self, fresh: bool = True):
+        self.fresh = fresh
+        self.ratings = 0
+        self._deltas = {key: [] for key in STATS_TABLES.values()}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def reset(conn: Connection):
+        reset_stats(conn)
+
+    def add(self, conn: Connection, ratings: pd.DataFrame):
+        if not self.fresh or ratings.empty:
+            return
+        deltas = {key: rating_deltas(ratings, key) for key in self._deltas}
+        with self._lock:
+            self.ratings += len(ratings)
+            for key, frame in deltas.items():
+                collected = self._deltas[key]
+                collected.append(frame)
+                if len(collected) >= COMBINE_EVERY:
+                    collected[:] = [_combine(pd.concat(collected, ignore_index=True), key)]
+
+    def finish(self, engine):
+        """Merges the collected deltas in one transaction (or rebuilds the aggregates of a resumed load)."""
+        if not self.fresh:
+            rebuild_stats(engine)
+            return
+        with self._lock, engine.begin() as conn:
+            for table, key in STATS_TABLES.items():
+                collected = self._deltas[key]
+                if collected:
+                    merge_deltas(conn, table, key, _combine(pd.concat(collected, ignore_index=True), key))
+                collected.clear()
+        logger.debug("merged rating aggregates of %d ratings", self.ratings)
+
+
+def reset_stats(conn: Connection):
+    """Empties the aggregate tables, e.g. before a fresh load of ratings."""
+    for table in STATS_TABLES:
+        conn.execute(table.delete())
+
+
+def rebuild_stats(engine):
+    """Recomputes the aggregate tables from the whole ratings table with one GROUP BY each, for databases that
+    were loaded before the aggregates existed."""
+    with engine.begin() as conn:
+        reset_stats(conn)
+        rating = ratings_table.c.rating
+        for table, key in STATS_TABLES.items():
+            histogram = [func.sum(case((func.round(rating * 2) == i, 1), else_=0)).label(column)
+                         for i, column in enumerate(HISTOGRAM_COLUMNS, start=1)]
+            query = select(ratings_table.c[key], func.count().label('rating_count'),
+                           func.sum(rating).label('rating_sum'), func.sum(rating * rating).label('rating_sum_sq'),
+                           *histogram,
+                           func.min(ratings_table.c.timestamp).label('first_timestamp'),
+                           func.max(ratings_table.c.timestamp).label('last_timestamp')) \
+                .where(ratings_table.c[key].is_not(None)).group_by(ratings_table.c[key])
+            conn.execute(table.insert().from_select([key, 'rating_count', 'rating_sum', 'rating_sum_sq']
+                                                    + HISTOGRAM_COLUMNS + ['first_timestamp', 'last_timestamp'],
+                                                    query))
+    logger.info("rebuilt movie_stats and user_stats from ratings")
+
+
+def _read_stats(engine, table: Table, key: str, ids=None) -> pd.DataFrame:
+    query = select(table)
+    if ids is not None:
+        query = query.where(table.c[key].in_(list(ids)))
+    with engine.connect() as conn:
+        stats = pd.read_sql_query(query, conn, index_col=key)
+    count = stats['rating_count'].astype('float64')
+    stats['mean_rating'] = stats['rating_sum'] / count
+    # population variance from the running sums, clipped at 0 against rounding
+    stats['rating_var'] = (stats['rating_sum_sq'] / count - stats['mean_rating'] ** 2).clip(lower=0.0)
+    return stats
+
+
+def movie_stats(ids=None, engine=None) -> pd.DataFrame:
+    """Per-movie rating count, mean, variance, first/last timestamp and histogram, indexed by movie_id."""
+    if engine is None:
+        engine = get_engine()
+    return _read_stats(engine, MovieStats.__table__, 'movie_id', ids)
+
+
+def user_stats(ids=None, engine=None) -> pd.DataFrame:
+    """Per-user rating count, mean, variance, first/last timestamp and histogram, indexed by user_id."""
+    if engine is None:
+        engine = get_engine()
+    return _read_stats(engine, UserStats.__table__, 'user_id', ids)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Rebuild or show the per-movie and per-user rating aggregates")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the aggregates from the ratings table")
+    parser.add_argument("--top", type=int, default=10, help="Show this many of the most rated movies")
+    args = parser.parse_args()
+
+    from movielens_eda_exercise.database import Base
+
+    engine = get_engine()
+    Base.metadata.create_all(engine, tables=list(STATS_TABLES))
+    if args.rebuild:
+        rebuild_stats(engine)
+    stats = movie_stats(engine=engine)
+    print(stats.nlargest(args.top, 'rating_count')[['rating_count', 'mean_rating', 'rating_var']])
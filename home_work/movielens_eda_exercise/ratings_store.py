@@ -0,0 +1,195 @@
+"""Time-partitioned Parquet copy of the ratings with partition and column pruning on read.
+
+`export_ratings` streams the ratings (from the database or the zip archive) into a Hive-style directory tree,
+`year=YYYY/` or `year=YYYY/month=M/`, with the rows of every file sorted by movie_id so that the Parquet
+row-group statistics also narrow down movie filters. The export is written to a temporary directory and
+swapped in when complete, next to an `_export.json` describing it.
+
+`read_ratings` / `iter_ratings` take a time range, a movie set and/or a user set plus the wanted columns, and
+let pyarrow.dataset read only the matching partitions, row groups and columns, so a time-windowed feature build
+touches a fraction of the data, e.g.:
+
+    build_movie_features(movies, iter_ratings(start="2015-01-01", end="2016-01-01"))
+"""
+import json
+import shutil
+import logging
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from movielens_eda_exercise.models.support import to_snake_case
+
+logger = logging.getLogger()
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    has_pyarrow = True
+except Exception:
+    has_pyarrow = False
+    logger.debug("pyarrow not available; the partitioned ratings store cannot be used")
+
+DEFAULT_STORE_DIR = Path(__file__).parent / "local_data" / "ratings_parquet"
+DEFAULT_CHUNK_SIZE = 1_000_000
+RATING_COLUMNS = ['user_id', 'movie_id', 'rating', 'timestamp']
+
+TimeBound = Union[None, int, str, datetime, pd.Timestamp]
+
+
+def _require_pyarrow():
+    if not has_pyarrow:
+        raise RuntimeError("the partitioned ratings store needs pyarrow")
+
+
+def _partition_keys(by_month: bool) -> list:
+    return ['year', 'month'] if by_month else ['year']
+
+
+def export_ratings(chunks: Iterable[pd.DataFrame], store_dir: Optional[Path] = None, by_month: bool = False,
+                   source: Optional[dict] = None) -> dict:
+    """Writes chunks of ratings into the year (and optionally month) partitioned Parquet store.
+
+    Returns the export description that is also saved as `_export.json`."""
+    _require_pyarrow()
+    if store_dir is None:
+        store_dir = DEFAULT_STORE_DIR
+    keys = _partition_keys(by_month)
+    staging = store_dir.with_name(store_dir.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    partitioning = ds.partitioning(pa.schema([(k, pa.int16()) for k in keys]), flavor='hive')
+    rows, years = 0, set()
+    for chunk_no, chunk in enumerate(chunks):
+        chunk = chunk.rename(columns=to_snake_case)[RATING_COLUMNS]
+        moments = chunk['timestamp'].to_numpy(dtype=np.int64).astype('datetime64[s]')
+        chunk = chunk.assign(year=moments.astype('datetime64[Y]').astype(np.int64) + 1970)
+        if by_month:
+            chunk = chunk.assign(month=moments.astype('datetime64[M]').astype(np.int64) % 12 + 1)
+        chunk = chunk.sort_values(keys + ['movie_id', 'timestamp'], kind='stable')
+        table = pa.Table.from_pandas(chunk.astype({k: 'int16' for k in keys}), preserve_index=False)
+        ds.write_dataset(table, staging, format='parquet', partitioning=partitioning,
+                         basename_template=f"part-{chunk_no:05d}-{{i}}.parquet",
+                         existing_data_behavior='overwrite_or_ignore')
+        rows += len(chunk)
+        years.update(chunk['year'].unique().tolist())
+        logger.debug("exported chunk %d (%d ratings so far)", chunk_no, rows)
+
+    description = {"rows": rows, "partitioning": keys, "years": sorted(int(y) for y in years),
+                   "source": source, "exported_at": datetime.now(timezone.utc).isoformat()}
+    (staging / "_export.json").write_text(json.dumps(description, indent=2))
+    shutil.rmtree(store_dir, ignore_errors=True)
+    staging.rename(store_dir)
+    logger.info("exported %d ratings to %s partitioned by %s", rows, store_dir, "/".join(keys))
+    return description
+
+
+def export_description(store_dir: Optional[Path] = None) -> Optional[dict]:
+    """The `_export.json` of the store, or None if nothing was exported yet."""
+    path = (store_dir or DEFAULT_STORE_DIR) / "_export.json"
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def epoch_seconds(bound: TimeBound) -> Optional[int]:
+    """A time bound as UTC epoch seconds (naive dates and times are taken as UTC)."""
+    if bound is None or isinstance(bound, (int, np.integer)):
+        return bound
+    moment = pd.Timestamp(bound)
+    if moment.tzinfo is None:
+        moment = moment.tz_localize('UTC')
+    return int(moment.timestamp())
+
+
+def _filter(keys: list, start: Optional[int], end: Optional[int], movie_ids, user_ids):
+    """Row filter with the matching partition predicates, so pyarrow can skip whole directories."""
+    condition = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if start is not None:
+        first = pd.Timestamp(start, unit='s')
+        condition = both(condition, ds.field('year') >= first.year)
+        if 'month' in keys:
+            condition = both(condition, (ds.field('year') > first.year) | (ds.field('month') >= first.month))
+        condition = both(condition, ds.field('timestamp') >= start)
+    if end is not None:
+        last = pd.Timestamp(end - 1, unit='s')
+        condition = both(condition, ds.field('year') <= last.year)
+        if 'month' in keys:
+            condition = both(condition, (ds.field('year') < last.year) | (ds.field('month') <= last.month))
+        condition = both(condition, ds.field('timestamp') < end)
+    if movie_ids is not None:
+        condition = both(condition, ds.field('movie_id').isin(pa.array(np.asarray(list(movie_ids), dtype=np.int32))))
+    if user_ids is not None:
+        condition = both(condition, ds.field('user_id').isin(pa.array(np.asarray(list(user_ids), dtype=np.int32))))
+    return condition
+
+
+def ratings_dataset(store_dir: Optional[Path] = None):
+    """The exported store as a pyarrow dataset, with its partition keys."""
+    _require_pyarrow()
+    store_dir = store_dir or DEFAULT_STORE_DIR
+    description = export_description(store_dir)
+    if description is None:
+        raise FileNotFoundError(f"no exported ratings in {store_dir}, run export_ratings first")
+    partitioning = ds.partitioning(pa.schema([(k, pa.int16()) for k in description['partitioning']]),
+                                   flavor='hive')
+    return ds.dataset(store_dir, format='parquet', partitioning=partitioning), description['partitioning']
+
+
+def iter_ratings(start: TimeBound = None, end: TimeBound = None, movie_ids=None, user_ids=None,
+                 columns: Optional[list] = None, store_dir: Optional[Path] = None,
+                 batch_rows: int = DEFAULT_CHUNK_SIZE) -> Iterable[pd.DataFrame]:
+    """Yields the ratings with start <= timestamp < end (and in `movie_ids` / `user_ids` when given) in
+    DataFrames of at most `batch_rows` rows, reading only the matching partitions and `columns`."""
+    dataset, keys = ratings_dataset(store_dir)
+    condition = _filter(keys, epoch_seconds(start), epoch_seconds(end), movie_ids, user_ids)
+    scanner = dataset.scanner(columns=columns or RATING_COLUMNS, filter=condition, batch_size=batch_rows)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def read_ratings(start: TimeBound = None, end: TimeBound = None, movie_ids=None, user_ids=None,
+                 columns: Optional[list] = None, store_dir: Optional[Path] = None) -> pd.DataFrame:
+    """Same selection as `iter_ratings`, as a single DataFrame."""
+    dataset, keys = ratings_dataset(store_dir)
+    condition = _filter(keys, epoch_seconds(start), epoch_seconds(end), movie_ids, user_ids)
+    return dataset.to_table(columns=columns or RATING_COLUMNS, filter=condition).to_pandas()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Export the ratings to a time-partitioned Parquet store")
+    parser.add_argument("--zip-path", type=Path, default=None,
+                        help="Export the ratings of this MovieLens zip instead of the database table")
+    parser.add_argument("--store-dir", type=Path, default=None, help="Output directory of the Parquet store")
+    parser.add_argument("--by-month", action="store_true", help="Partition by year and month instead of year")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Ratings read per chunk")
+    args = parser.parse_args()
+
+    from movielens_eda_exercise.streaming_profiler import iter_database_chunks, iter_zip_chunks
+
+    if args.zip_path is None:
+        from movielens_eda_exercise.data_access import table_fingerprint
+
+        export_ratings(iter_database_chunks('ratings', args.chunk_size), args.store_dir, by_month=args.by_month,
+                       source={"database": table_fingerprint('ratings')})
+    else:
+        from zipfile import ZipFile
+        from movielens_eda_exercise.load_manifest import member_checksum
+        from movielens_eda_exercise.models.rating import RatingsConfiguration
+
+        with ZipFile(args.zip_path) as z:
+            checksum = member_checksum(z, RatingsConfiguration.inner_path)
+        export_ratings(iter_zip_chunks(args.zip_path, RatingsConfiguration, args.chunk_size), args.store_dir,
+                       by_month=args.by_month, source={"zip": checksum})
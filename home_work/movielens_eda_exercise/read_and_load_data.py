@@ -1,107 +1,217 @@
-import requests
 import logging
+import threading
 
 import pandas as pd
 
 from pathlib import Path
 from zipfile import ZipFile
-from io import BytesIO
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from movielens_eda_exercise.database import Base, engine
+from movielens_eda_exercise.database import Base, get_engine
+from movielens_eda_exercise.datasets import DATASETS, get_dataset, select_dataset
+from movielens_eda_exercise.downloader import DownloadError, download_archive
+from movielens_eda_exercise.instrumentation import stage, start_run
+from movielens_eda_exercise.bulk_loader import tune_for_bulk_load
+from movielens_eda_exercise.partitioned_loader import default_workers, load_partitions, split_frame
+from movielens_eda_exercise.load_manifest import member_checksum, plan_load, record_chunk, complete_load
+from movielens_eda_exercise.index_manager import drop_secondary_indexes, create_secondary_indexes
+from movielens_eda_exercise.rating_stats import RatingAggregator
+from movielens_eda_exercise.models import manifest  # noqa: F401  (registers the manifest tables)
 from movielens_eda_exercise.models.rating import RatingsConfiguration
 from movielens_eda_exercise.models.link import LinksConfiguration
 from movielens_eda_exercise.models.movie import MovieConfiguration
 from movielens_eda_exercise.models.tag import TagConfiguration
+from movielens_eda_exercise.models.genome.genome_tag import GenomeTagsConfiguration
+from movielens_eda_exercise.models.genome.genome_score import GenomeScoresConfiguration
+from movielens_eda_exercise.genome_matrix import build_genome_matrix
+from movielens_eda_exercise.ratings_store import export_ratings
 
-logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(levelname)s: %(message)s')
 logger = logging.getLogger()
 
-Base.metadata.create_all(engine)
+# tables whose loaded rows also feed incrementally maintained aggregates (the aggregator class), see rating_stats
+AGGREGATE_HOOKS = {RatingsConfiguration.model.__tablename__: RatingAggregator}
 
+DEFAULT_CHUNK_SIZE = 100_000
 
-def download_movielens_data(zip_path: Path, reload=False) -> bool:
-    """Downloads the MovieLens latest dataset zip file to the specified path.
-    If the file already exists and reload is False, it will not download again."""
+try:
+    import pyarrow  # noqa: F401
+    has_pyarrow = True
+except Exception:
+    has_pyarrow = False
+    logger.debug("pyarrow not available; whole CSV files are parsed with the C engine")
 
-    # movielens_url = "https://files.grouplens.org/datasets/movielens/ml-latest.zip"
-    movielens_url = "http://files.grouplens.org/datasets/movielens/ml-latest-small.zip"
+_prepared = False
+_prepare_lock = threading.Lock()
 
-    logger.debug("start download: %s", movielens_url)
-    if zip_path.exists() and not reload:
-        logger.debug("file exist: %s", zip_path)
-        return True
+
+def prepared_engine():
+    """The engine, with the schema created and tuned for bulk loads on the first call.
+
+    Nothing touches the database when this module is imported; the loaders call this on first use."""
+    global _prepared
+    engine = get_engine()
+    if not _prepared:
+        with _prepare_lock:
+            if not _prepared:
+                Base.metadata.create_all(engine)
+                tune_for_bulk_load(engine)
+                _prepared = True
+    return engine
+
+
+def download_movielens_data(zip_path: Path, reload=False) -> bool:
+    """Downloads the zip file of the selected MovieLens dataset (see datasets.py) to the specified path.
+    If the file already exists and reload is False, it will not download again.
+
+    Interrupted downloads resume where they stopped and the archive is verified before it replaces
+    `zip_path`, see downloader.download_archive."""
 
     try:
-        response = requests.get(movielens_url, stream=True)
-        response.raise_for_status()
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        with zip_path.open(mode='wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        logger.debug("success download to: %s", zip_path)
+        with stage("download") as s:
+            download_archive(get_dataset().url, zip_path, reload=reload)
+            s.bytes = zip_path.stat().st_size
         return True
 
-    except requests.exceptions.RequestException as e:
-        logger.exception(f"**❌ Error during download:** {e}")
+    except DownloadError as e:
+        logger.exception("**❌ Error during download:** %s", e)
         return False
 
 
-def load_ml_csvs_from_zip(zip_path: Path, models_struct: list) -> dict:
-    """Loads specified CSV files from the MovieLens zip archive into pandas DataFrames."""
+def load_single_csv_from_zip(zip_path: Path, inner_path: str, columns: list, dtypes: dict = None,
+                             header=0) -> pd.DataFrame:
+    """Loads a single CSV file from the MovieLens zip archive into a pandas DataFrame.
 
-    logger.debug("start load csvs from zip: %s", zip_path)
+    Columns are parsed straight into `dtypes` (pyarrow engine when available); `header` is the row of the
+    header line that `columns` replaces, or None when the file has none."""
 
-    laded_models = {}
-    for single_model in models_struct:
-        laded_models[single_model.name] = load_single_csv_from_zip(
-            zip_path=zip_path,
-            inner_path=single_model.inner_path,
-            columns=single_model.columns
-        )
-        logger.debug("loaded model: %s", single_model.name)
+    engine_options = {"engine": "pyarrow"} if has_pyarrow else {"low_memory": False}
+    with stage("read_csv", table=Path(inner_path).stem) as s, ZipFile(zip_path) as z:
+        df = pd.read_csv(z.open(inner_path), header=header, names=columns, dtype=dtypes, **engine_options)
+        s.rows, s.bytes = len(df), z.getinfo(inner_path).file_size
 
-    logger.debug("finished loading all models")
-    return laded_models
+    return df
 
-def load_single_csv_from_zip(zip_path: Path, inner_path: str, columns: list) -> pd.DataFrame:
-    """Loads a single CSV file from the MovieLens zip archive into a pandas DataFrame."""
+def iter_csv_chunks_from_zip(zip_file: ZipFile, inner_path: str, columns: list, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             skip_chunks: int = 0, dtypes: dict = None, header=0):
+    """Yields a CSV member of an already opened zip archive as DataFrames of at most `chunk_size` rows.
 
-    logger.debug("start load single csv from zip: %s", zip_path)
-    z = ZipFile(BytesIO(zip_path.read_bytes()))
+    Only the current chunk is held in memory, the member itself is decompressed on the fly. The first
+    `skip_chunks` chunks are skipped without being converted to DataFrames (used to resume a load)."""
 
-    df = pd.read_csv(z.open(inner_path), names=columns, low_memory=False)
-    logger.debug("loaded single csv: %s", inner_path)
+    first_row = 0 if header is None else header + 1
+    skiprows = range(first_row, first_row + skip_chunks * chunk_size) if skip_chunks else None
+    with zip_file.open(inner_path) as member:
+        with pd.read_csv(member, header=header, names=columns, dtype=dtypes, chunksize=chunk_size,
+                         skiprows=skiprows) as reader:
+            yield from reader
 
-    return df
+def saving_partitions_to_database(model_cls, partitions, workers: int = 1, plan=None) -> int:
+    """Loads `partitions` into the table of `model_cls` over `workers` pooled connections.
+
+    The table must already be prepared by `plan_load`; partitions already committed according to `plan` are
+    skipped and each new one is recorded in the load manifest in its own transaction. Failed partitions are
+    collected and reported together once all partitions have been attempted, leaving the manifest in the
+    loading state so that the next run resumes. Returns the number of rows loaded by this call.
+
+    The table's secondary indexes are dropped for the load and rebuilt once it is complete; an interrupted
+    load leaves them dropped until the resumed load completes. Tables listed in AGGREGATE_HOOKS also update
+    their aggregates once all partitions have committed; a fresh load (nothing committed yet) resets them first
+    and a resumed one recomputes them."""
+    engine = prepared_engine()
+    table = model_cls.model.__table__
+    aggregator_cls = AGGREGATE_HOOKS.get(table.name)
+    aggregator = None
+    if aggregator_cls is not None:
+        aggregator = aggregator_cls(fresh=plan.first_chunk == 0 and not plan.committed)
+        if aggregator.fresh:
+            with engine.begin() as conn:
+                aggregator.reset(conn)
+    drop_secondary_indexes(engine, table)
+    with stage("write", table=table.name) as s:
+        results = load_partitions(engine, table, partitions, workers=workers, first_index=plan.first_chunk,
+                                  skip=plan.committed, on_partition=record_chunk,
+                                  on_frame=aggregator.add if aggregator is not None else None)
+        s.rows = sum(r.rows for r in results)
+    failed = [r for r in results if r.error is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(results)} partitions of {model_cls.name} failed: "
+                           + "; ".join(f"#{r.index}: {r.error}" for r in failed))
+    if aggregator is not None:
+        with stage("aggregate", table=table.name):
+            aggregator.finish(engine)
+    total = complete_load(engine, table)
+    with stage("create_indexes", table=table.name) as s:
+        s.rows = total
+        create_secondary_indexes(engine, table)
+    return sum(r.rows for r in results)
+
+def stream_model_to_database(zip_file: ZipFile, model_cls, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             workers: int = 1, force: bool = False) -> int:
+    """Streams a single model from the zip archive into the database chunk by chunk.
+
+    Each chunk is a partition committed on its own and up to `workers` chunks are inserted at once, so peak
+    memory is bounded by `chunk_size` rather than by the size of the CSV. Unchanged members are skipped and
+    interrupted loads resume from the load manifest. Returns the number of rows written by this run."""
+
+    table = model_cls.model.__table__
+    checksum = member_checksum(zip_file, model_cls.inner_path)
+    plan = plan_load(prepared_engine(), table, model_cls.inner_path, checksum, chunk_size, force=force)
+    if plan.skip:
+        return 0
 
-def saving_to_database(m_name: str, m_date: pd.DataFrame):
-    """Saves the loaded MovieLens DataFrames into the database."""
-    logger.debug("start saving models to database")
-    m_date.to_sql(m_name, engine, if_exists='replace')
-    logger.debug("saved model to database: %s", m_name)
+    with stage("stream", table=table.name) as s:
+        chunks = iter_csv_chunks_from_zip(zip_file=zip_file,
+                                          inner_path=model_cls.inner_path,
+                                          columns=model_cls.columns,
+                                          chunk_size=chunk_size,
+                                          skip_chunks=plan.first_chunk,
+                                          dtypes=model_cls.dtypes,
+                                          header=model_cls.header)
+        s.rows = saving_partitions_to_database(model_cls, chunks, workers=workers, plan=plan)
+        s.bytes = zip_file.getinfo(model_cls.inner_path).file_size
+    return s.rows
 
-def process_model(model_cls):
+def process_model(model_cls, zip_path: Path, workers: int = 1, partition_rows: int = DEFAULT_CHUNK_SIZE,
+                  force: bool = False):
     name = model_cls.name
     try:
-        logger.debug("start processing model: %s", name)
-        df = load_single_csv_from_zip(zip_path=zip_path,
-                                        inner_path=model_cls.inner_path,
-                                        columns=model_cls.columns)
-        saving_to_database(name, df)
-        logger.debug("finished processing model: %s", name)
+        table = model_cls.model.__table__
+        with ZipFile(zip_path) as z:
+            checksum = member_checksum(z, model_cls.inner_path)
+            member_size = z.getinfo(model_cls.inner_path).file_size
+        plan = plan_load(prepared_engine(), table, model_cls.inner_path, checksum, partition_rows, force=force)
+        if plan.skip:
+            return
+
+        with stage("process_model", table=table.name) as s:
+            df = load_single_csv_from_zip(zip_path=zip_path,
+                                            inner_path=model_cls.inner_path,
+                                            columns=model_cls.columns,
+                                            dtypes=model_cls.dtypes,
+                                            header=model_cls.header)
+            partitions = split_frame(df.iloc[plan.first_chunk * partition_rows:], partition_rows)
+            s.rows = saving_partitions_to_database(model_cls, partitions, workers=workers, plan=plan)
+            s.bytes = member_size
     except Exception as e:
         logger.exception("error processing model %s: %s", name, e)
         raise
 
-if __name__ == "__main__":
-    zip_path = Path(Path(__file__).parent, "local_data/ml-latest-small.zip")
-
-    load_status = download_movielens_data(zip_path=zip_path)
+def load_all(stream: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = None, force: bool = False,
+             genome: bool = False, export_by: str = None, zip_path: Path = None, reload: bool = False,
+             download: bool = True) -> bool:
+    """Downloads the archive of the selected dataset and loads the movies, ratings, links and tags (plus
+    optionally the tag genome and the Parquet ratings store). With download=False the archive at `zip_path` is
+    loaded as it is, e.g. a synthetic one. Returns False when the archive could not be downloaded or the tag
+    genome is asked for on a dataset without it."""
+    dataset = get_dataset()
+    if genome and not dataset.has_genome:
+        logger.error("%s has no tag genome, select a dataset that has one (e.g. --dataset ml-latest)", dataset.name)
+        return False
+    if zip_path is None:
+        zip_path = dataset.zip_path
 
-    if not load_status:
-        exit(1)
+    if download and not download_movielens_data(zip_path=zip_path, reload=reload):
+        return False
 
     # process each model in its own thread: load single csv from zip then save to db
     models = [
@@ -112,11 +222,87 @@ if __name__ == "__main__":
         ]
 
     max_workers = min(4, max(1, len(models)))
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_name = {executor.submit(process_model, m): m.name for m in models}
+    # the tables load at the same time, so each gets its share of the pool unless `workers` is given
+    table_workers = workers if workers is not None else default_workers(prepared_engine(), tables=max_workers)
+    with ZipFile(zip_path) as zip_file, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if stream:
+            # the archive is opened once and shared, each thread decompresses its own member
+            future_to_name = {
+                executor.submit(stream_model_to_database, zip_file, m, chunk_size, table_workers, force): m.name
+                for m in models
+            }
+        else:
+            future_to_name = {
+                executor.submit(process_model, m, zip_path, table_workers, chunk_size, force): m.name
+                for m in models
+            }
         for fut in as_completed(future_to_name):
             name = future_to_name[fut]
             try:
                 fut.result()
             except Exception as exc:
                 logger.exception("thread failed for %s: %s", name, exc)
+
+    if genome:
+        with ZipFile(zip_path) as zip_file:
+            missing = [c.inner_path for c in (GenomeTagsConfiguration, GenomeScoresConfiguration)
+                       if c.inner_path not in zip_file.namelist()]
+            if missing:
+                logger.error("%s does not contain %s, skipping the tag genome", zip_path, ", ".join(missing))
+                return False
+            process_model(GenomeTagsConfiguration, zip_path, force=force)
+            # ~15M rows, always streamed, on its own so with the whole pool
+            if workers is None:
+                workers = default_workers(prepared_engine())
+            stream_model_to_database(zip_file, GenomeScoresConfiguration, chunk_size, workers, force)
+        build_genome_matrix(zip_path)
+
+    if export_by:
+        with ZipFile(zip_path) as zip_file:
+            export_ratings(iter_csv_chunks_from_zip(zip_file, RatingsConfiguration.inner_path,
+                                                    RatingsConfiguration.columns, chunk_size,
+                                                    dtypes=RatingsConfiguration.dtypes,
+                                                    header=RatingsConfiguration.header),
+                           by_month=export_by == "month",
+                           source={"zip": member_checksum(zip_file, RatingsConfiguration.inner_path)})
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Download the MovieLens dataset and load it into the database")
+    parser.add_argument("--dataset", choices=DATASETS, default=get_dataset().name,
+                        help="MovieLens dataset to download and load (default: $MOVIELENS_DATASET or ml-latest-small)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream each CSV into the database in chunks instead of loading it whole")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Rows per chunk (streaming mode) or per partition (parallel inserts)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Pooled connections used to insert the partitions of a single table "
+                             "(default: the pool size split over the tables loaded at once, 1 on SQLite)")
+    parser.add_argument("--force", action="store_true",
+                        help="Reload every table even if the load manifest says it is unchanged")
+    parser.add_argument("--genome", action="store_true",
+                        help="Also load genome_tags and genome_scores and build the memory-mapped tag genome "
+                             "relevance matrix (needs a dataset with the tag genome, i.e. ml-latest)")
+    parser.add_argument("--export-ratings", choices=["year", "month"], default=None,
+                        help="Also export the ratings to the time-partitioned Parquet store, by year or by month")
+    parser.add_argument("--report", type=Path, default=None,
+                        help="Write the per-stage timings, rows, bytes and peak memory to this JSON file")
+    parser.add_argument("--prometheus-textfile", type=Path, default=None,
+                        help="Also write them in the Prometheus text format (node_exporter textfile collector)")
+    args = parser.parse_args()
+
+    select_dataset(args.dataset)
+    run = start_run("load")
+    loaded = load_all(stream=args.stream, chunk_size=args.chunk_size, workers=args.workers, force=args.force,
+                      genome=args.genome, export_by=args.export_ratings)
+    if args.report is not None:
+        run.write_json(args.report)
+    if args.prometheus_textfile is not None:
+        run.write_prometheus(args.prometheus_textfile)
+    if not loaded:
+        exit(1)
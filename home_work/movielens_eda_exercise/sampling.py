@@ -0,0 +1,83 @@
+"""Stratified sampling of the ratings table for report generation.
+
+Rows are stratified by movie popularity and user activity (deciles of ratings per movie and per user), so the
+sample keeps the long tail of rarely rated movies and casual users in proportion instead of being dominated by
+the blockbusters and heavy raters that a uniform sample over-represents in absolute terms.
+
+`stratified_sample` samples a frame that is already in memory. `stratified_sample_from_database` takes the
+ratings per movie and per user from GROUP BY queries and samples the table chunk by chunk while streaming it,
+so only the sample is ever held in memory.
+"""
+import logging
+
+from typing import Optional
+
+import pandas as pd
+
+logger = logging.getLogger()
+
+DEFAULT_BUCKETS = 10
+SAMPLE_CHUNK_SIZE = 500_000
+
+
+def _activity_deciles(counts: pd.Series, buckets: int) -> pd.Series:
+    """Decile (0..buckets-1) of every key by its count, indexed by key."""
+    n_buckets = min(buckets, len(counts))
+    if n_buckets <= 1:
+        return pd.Series(0, index=counts.index)
+    return pd.qcut(counts.rank(method='first'), n_buckets, labels=False)
+
+
+def _activity_bucket(keys: pd.Series, buckets: int) -> pd.Series:
+    """Decile (0..buckets-1) of how often each key occurs, mapped back onto the rows."""
+    return keys.map(_activity_deciles(keys.value_counts(), buckets))
+
+
+def stratified_sample(ratings: pd.DataFrame, n_rows: int, buckets: int = DEFAULT_BUCKETS,
+                      random_state: int = 42):
+    """Samples about `n_rows` ratings, stratified by movie popularity and user activity.
+
+    Returns the sample and the sampling fraction (1.0 when the table already has at most `n_rows` rows)."""
+    if n_rows >= len(ratings):
+        return ratings, 1.0
+    fraction = n_rows / len(ratings)
+    strata = (_activity_bucket(ratings['movie_id'], buckets) * buckets
+              + _activity_bucket(ratings['user_id'], buckets))
+    sample = ratings.groupby(strata.to_numpy(), group_keys=False).sample(frac=fraction, random_state=random_state)
+    return sample.sort_index(), fraction
+
+
+def _key_counts(conn, table_name: str, column: str) -> pd.Series:
+    """Rows per value of `column`, counted by the database."""
+    quote = conn.dialect.identifier_preparer.quote
+    counts = pd.read_sql_query(f"SELECT {quote(column)}, COUNT(*) AS n FROM {quote(table_name)} "
+                               f"GROUP BY {quote(column)}", conn)
+    return counts.set_index(column)['n']
+
+
+def stratified_sample_from_database(n_rows: int, table_name: str = 'ratings', buckets: int = DEFAULT_BUCKETS,
+                                    chunk_size: int = SAMPLE_CHUNK_SIZE, random_state: int = 42,
+                                    total_rows: Optional[int] = None) -> tuple:
+    """Samples about `n_rows` rows of the ratings table with the strata of `stratified_sample`, streaming it.
+
+    Returns the sample, the sampling fraction and the row count of the table."""
+    from movielens_eda_exercise.database import get_engine
+    from movielens_eda_exercise.data_access import compact_dtypes, table_row_count
+    from movielens_eda_exercise.streaming_profiler import iter_database_chunks
+
+    if total_rows is None:
+        total_rows = table_row_count(table_name)
+    fraction = min(1.0, n_rows / total_rows) if total_rows else 1.0
+    with get_engine().connect() as conn:
+        movie_buckets = _activity_deciles(_key_counts(conn, table_name, 'movie_id'), buckets)
+        user_buckets = _activity_deciles(_key_counts(conn, table_name, 'user_id'), buckets)
+
+    samples = []
+    for i, chunk in enumerate(iter_database_chunks(table_name, chunk_size)):
+        strata = chunk['movie_id'].map(movie_buckets) * buckets + chunk['user_id'].map(user_buckets)
+        samples.append(compact_dtypes(chunk.groupby(strata.to_numpy(), group_keys=False)
+                                      .sample(frac=fraction, random_state=random_state + i), category_ratio=0.0))
+        logger.debug("sampled chunk %d of %s (%d rows so far)", i, table_name, sum(len(s) for s in samples))
+    if not samples:
+        return pd.DataFrame(), fraction, total_rows
+    return compact_dtypes(pd.concat(samples, ignore_index=True)), fraction, total_rows
@@ -0,0 +1,210 @@
+"""Sparse user x movie rating matrix and a precomputed top-K item-item similarity index.
+
+The rating matrix is built by streaming the ratings (from the database or the zip archive) into compact
+int32/float32 coordinate arrays and converting them to CSR once; the id-to-index maps are saved next to it.
+
+The similarity index holds, for every movie, its K most similar movies by cosine (or adjusted cosine, where
+each rating is centred on its user's mean) similarity. It is computed with blocked sparse products
+`items[block] @ items.T` spread over worker processes, so only one block of similarities exists at a time and
+the dense item x item matrix is never materialised. The result is two `.npy` arrays that are memory-mapped for
+lookups.
+
+Files in the index directory:
+- ratings_csr.npz: scipy CSR matrix [n_users, n_movies] of float32 ratings
+- user_ids.npy / movie_ids.npy: int32, sorted, row / column ids of the matrix
+- neighbors.npy: int32 [n_movies, K] column indexes of the most similar movies (-1 when fewer than K)
+- scores.npy: float32 [n_movies, K] their similarities
+"""
+import os
+import logging
+
+from pathlib import Path
+from typing import Iterable, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from movielens_eda_exercise.models.support import to_snake_case
+
+logger = logging.getLogger()
+
+DEFAULT_INDEX_DIR = Path(__file__).parent / "local_data" / "similarity"
+DEFAULT_K = 50
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def build_rating_matrix(chunks: Iterable[pd.DataFrame], index_dir: Optional[Path] = None) -> sp.csr_matrix:
+    """Builds the CSR user x movie matrix from chunks of ratings and saves it with its id maps."""
+    if index_dir is None:
+        index_dir = DEFAULT_INDEX_DIR
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    users, movies, ratings, timestamps = [], [], [], []
+    for chunk in chunks:
+        chunk = chunk.rename(columns=to_snake_case)
+        users.append(chunk['user_id'].to_numpy(dtype=np.int32))
+        movies.append(chunk['movie_id'].to_numpy(dtype=np.int32))
+        ratings.append(chunk['rating'].to_numpy(dtype=np.float32))
+        if timestamps is not None and 'timestamp' in chunk:
+            timestamps.append(chunk['timestamp'].to_numpy(dtype=np.int64))
+        else:
+            timestamps = None
+
+    user_ids, rows = np.unique(np.concatenate(users), return_inverse=True)
+    del users
+    movie_ids, cols = np.unique(np.concatenate(movies), return_inverse=True)
+    del movies
+    ratings = np.concatenate(ratings)
+    # keep only the latest rating when a user rated the same movie more than once (by timestamp, ties and
+    # chunks without timestamps by the order of the input)
+    keys = rows.astype(np.int64) * len(movie_ids) + cols
+    if len(np.unique(keys)) != len(keys):
+        if timestamps is not None:
+            order = np.lexsort((np.concatenate(timestamps), keys))
+        else:
+            order = np.argsort(keys, kind='stable')
+        last = np.flatnonzero(np.append(keys[order][1:] != keys[order][:-1], True))
+        keep = order[last]
+        rows, cols, ratings = rows[keep], cols[keep], ratings[keep]
+    del keys, timestamps
+    matrix = sp.csr_matrix((ratings, (rows.astype(np.int32), cols.astype(np.int32))),
+                           shape=(len(user_ids), len(movie_ids)), dtype=np.float32)
+
+    sp.save_npz(index_dir / "ratings_csr.npz", matrix)
+    np.save(index_dir / "user_ids.npy", user_ids.astype(np.int32))
+    np.save(index_dir / "movie_ids.npy", movie_ids.astype(np.int32))
+    logger.info("built %d x %d rating matrix with %d ratings in %s",
+                matrix.shape[0], matrix.shape[1], matrix.nnz, index_dir)
+    return matrix
+
+
+def normalized_item_vectors(matrix: sp.csr_matrix, adjusted: bool = True) -> sp.csr_matrix:
+    """Item x user matrix whose rows have unit L2 norm, so their dot products are cosine similarities.
+
+    With `adjusted` every rating is first centred on the mean rating of its user (adjusted cosine)."""
+    matrix = matrix.astype(np.float32, copy=True)
+    if adjusted:
+        counts = np.diff(matrix.indptr)
+        sums = np.asarray(matrix.sum(axis=1)).ravel()
+        means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        matrix.data -= np.repeat(means, counts).astype(np.float32)
+    items = matrix.T.tocsr()
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0).astype(np.float32)
+    return sp.csr_matrix(sp.diags(inverse) @ items, dtype=np.float32)
+
+
+# worker state, loaded once per process by _init_worker
+_items = None
+_items_t = None
+
+
+def _init_worker(items_path: str):
+    global _items, _items_t
+    _items = sp.load_npz(items_path).tocsr()
+    _items_t = _items.T.tocsc()
+
+
+def _top_k_block(start: int, stop: int, k: int):
+    """Top-k neighbours (excluding the item itself) of items [start, stop)."""
+    similarities = (_items[start:stop] @ _items_t).tocsr()
+    neighbors = np.full((stop - start, k), -1, dtype=np.int32)
+    scores = np.zeros((stop - start, k), dtype=np.float32)
+    for i in range(stop - start):
+        lo, hi = similarities.indptr[i], similarities.indptr[i + 1]
+        cols = similarities.indices[lo:hi]
+        vals = similarities.data[lo:hi]
+        keep = cols != start + i
+        cols, vals = cols[keep], vals[keep]
+        if len(vals) > k:
+            top = np.argpartition(-vals, k - 1)[:k]
+            cols, vals = cols[top], vals[top]
+        order = np.argsort(-vals, kind='stable')
+        neighbors[i, :len(order)] = cols[order]
+        scores[i, :len(order)] = vals[order]
+    return start, neighbors, scores
+
+
+def build_similarity_index(matrix: sp.csr_matrix, index_dir: Optional[Path] = None, k: int = DEFAULT_K,
+                           adjusted: bool = True, block_size: int = DEFAULT_BLOCK_SIZE,
+                           workers: Optional[int] = None) -> Path:
+    """Computes the top-k item-item similarity index of `matrix` and saves it to `index_dir`."""
+    if index_dir is None:
+        index_dir = DEFAULT_INDEX_DIR
+    index_dir.mkdir(parents=True, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    items = normalized_item_vectors(matrix, adjusted=adjusted)
+    items_path = index_dir / "items_normalized.npz"
+    sp.save_npz(items_path, items)
+    n_items = items.shape[0]
+
+    neighbors = np.lib.format.open_memmap(index_dir / "neighbors.npy", mode='w+', dtype=np.int32,
+                                          shape=(n_items, k))
+    scores = np.lib.format.open_memmap(index_dir / "scores.npy", mode='w+', dtype=np.float32, shape=(n_items, k))
+    blocks = [(start, min(start + block_size, n_items)) for start in range(0, n_items, block_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(items_path),)) as executor:
+        futures = [executor.submit(_top_k_block, start, stop, k) for start, stop in blocks]
+        for done, future in enumerate(futures, start=1):
+            start, block_neighbors, block_scores = future.result()
+            neighbors[start:start + len(block_neighbors)] = block_neighbors
+            scores[start:start + len(block_scores)] = block_scores
+            logger.debug("similarity block %d/%d done", done, len(blocks))
+    neighbors.flush()
+    scores.flush()
+    del neighbors, scores
+    items_path.unlink()
+
+    logger.info("built top-%d item similarity index for %d movies in %s", k, n_items, index_dir)
+    return index_dir
+
+
+class SimilarityIndex:
+    """Memory-mapped top-K item-item similarity index for "users who liked X also liked" lookups."""
+
+    def __init__(self, index_dir: Optional[Path] = None):
+        if index_dir is None:
+            index_dir = DEFAULT_INDEX_DIR
+        self.movie_ids = np.load(index_dir / "movie_ids.npy")
+        self.neighbors = np.load(index_dir / "neighbors.npy", mmap_mode='r')
+        self.scores = np.load(index_dir / "scores.npy", mmap_mode='r')
+
+    def similar_movies(self, movie_id: int, n: Optional[int] = None):
+        """Returns (movie ids, similarities) of the movies most similar to `movie_id`, best first."""
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row >= len(self.movie_ids) or self.movie_ids[row] != movie_id:
+            raise KeyError(f"movie {movie_id} has no ratings")
+        neighbors = self.neighbors[row, :n]
+        valid = neighbors >= 0
+        return self.movie_ids[neighbors[valid]], np.asarray(self.scores[row, :n])[valid]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build the sparse rating matrix and top-K item similarity index")
+    parser.add_argument("--zip-path", type=Path, default=None,
+                        help="Read ratings from this MovieLens zip instead of the database")
+    parser.add_argument("--index-dir", type=Path, default=None, help="Output directory of the index files")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="Neighbours kept per movie")
+    parser.add_argument("--plain-cosine", action="store_true", help="Do not centre ratings on the user mean")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Movies per similarity block")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="Ratings read per chunk")
+    args = parser.parse_args()
+
+    from movielens_eda_exercise.streaming_profiler import iter_database_chunks, iter_zip_chunks
+    from movielens_eda_exercise.models.rating import RatingsConfiguration
+
+    if args.zip_path is None:
+        rating_chunks = iter_database_chunks('ratings', args.chunk_size)
+    else:
+        rating_chunks = iter_zip_chunks(args.zip_path, RatingsConfiguration, args.chunk_size)
+    rating_matrix = build_rating_matrix(rating_chunks, index_dir=args.index_dir)
+    build_similarity_index(rating_matrix, index_dir=args.index_dir, k=args.k, adjusted=not args.plain_cosine,
+                           block_size=args.block_size, workers=args.workers)
@@ -0,0 +1,179 @@
+"""Mergeable approximate sketches used by the streaming profiler.
+
+Every sketch is fed chunk by chunk with vectorised `add` calls, keeps a fixed (or compressed) amount of state
+regardless of how many values it has seen, and can be combined with another sketch of the same kind with
+`merge`, so chunks can be profiled independently and reduced afterwards.
+
+- HyperLogLog: distinct counts (about 1% error with the default precision)
+- TDigest: quantiles, accurate at the tails
+- CountMinSketch: frequency estimates with a top-k list of heavy hitters
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+_SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_SPLITMIX_M1 = np.uint64(0xBF58476D1CE4E5B9)
+_SPLITMIX_M2 = np.uint64(0x94D049BB133111EB)
+
+
+def hash64(values) -> np.ndarray:
+    """Stable 64-bit hashes of `values`; numbers hash by value, anything else by its string form."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iub':
+        arr = arr.astype(np.int64)
+    elif arr.dtype.kind == 'f':
+        arr = arr.astype(np.float64)
+    else:
+        arr = arr.astype(str).astype(object)
+    return pd.util.hash_array(arr)
+
+
+def _remix(hashes: np.ndarray, seed: int) -> np.ndarray:
+    """Derives an independent hash from `hashes` (splitmix64 finaliser over hash + seed * gamma)."""
+    with np.errstate(over='ignore'):
+        z = hashes + np.uint64(seed) * _SPLITMIX_GAMMA
+        z = (z ^ (z >> np.uint64(30))) * _SPLITMIX_M1
+        z = (z ^ (z >> np.uint64(27))) * _SPLITMIX_M2
+        return z ^ (z >> np.uint64(31))
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers."""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        hashes = hash64(values)
+        if not len(hashes):
+            return
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # frexp gives the bit length exactly, `rest` has fewer than 53 significant bits
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (64 - p) - bit_length + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TDigest:
+    """Merging t-digest (k1 scale function) for streaming quantile estimates."""
+
+    def __init__(self, compression: int = 200):
+        self.compression = compression
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def total(self) -> float:
+        return float(self.weights.sum())
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        means, counts = np.unique(values, return_counts=True)
+        self._compress(means, counts.astype(np.float64))
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        if len(other.means):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress(other.means, other.weights)
+        return self
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+
+        # centroids whose mid-quantile falls in the same unit of k-space are merged
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        k = self.compression / (2 * math.pi) * np.arcsin(2 * q - 1)
+        group = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q: float) -> float:
+        if not len(self.means):
+            return math.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        xp = np.r_[0.0, centers, self.total]
+        fp = np.r_[self.min, self.means, self.max]
+        return float(np.interp(q * self.total, xp, fp))
+
+
+class CountMinSketch:
+    """Count-min sketch with a list of the `top_k` most frequent values seen so far."""
+
+    def __init__(self, width: int = 1 << 16, depth: int = 4, top_k: int = 20):
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.top = {}
+
+    def _columns(self, keys) -> np.ndarray:
+        hashes = hash64(keys)
+        return np.stack([(_remix(hashes, seed) % np.uint64(self.width)).astype(np.int64)
+                         for seed in range(1, self.depth + 1)])
+
+    def add(self, values):
+        counts = pd.Series(values).dropna().value_counts()
+        if counts.empty:
+            return
+        keys = counts.index.to_numpy()
+        columns = self._columns(keys)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts.to_numpy())
+        self.total += int(counts.sum())
+        # heavy hitters of the whole stream are either current top values or frequent in this chunk
+        self._refresh_top(list(self.top) + keys[:self.top_k].tolist())
+
+    def estimate(self, keys) -> np.ndarray:
+        columns = self._columns(keys)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        self.table += other.table
+        self.total += other.total
+        self._refresh_top(list(self.top) + list(other.top))
+        return self
+
+    def _refresh_top(self, candidates: list):
+        if not candidates:
+            return
+        unique = list(dict.fromkeys(candidates))
+        estimates = self.estimate(unique)
+        order = np.argsort(-estimates, kind='stable')[:self.top_k]
+        self.top = {unique[i]: int(estimates[i]) for i in order}
+
+    def most_common(self) -> list:
+        return sorted(self.top.items(), key=lambda item: -item[1])
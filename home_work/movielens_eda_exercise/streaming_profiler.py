@@ -0,0 +1,260 @@
+"""Single-pass streaming profiler for MovieLens tables.
+
+Tables are read in chunks (from the database or straight from the zip archive) and every column keeps
+mergeable sketches instead of the data itself, so memory stays flat whatever the table size:
+- id columns (`*_id`): HyperLogLog distinct count and count-min top-k of the most frequent ids
+- numeric columns: count/nulls/mean/std/min/max, HyperLogLog distinct count and t-digest quantiles
+- text columns: HyperLogLog distinct count and count-min top-k (multi-valued columns such as genres are
+  split into their tokens first)
+
+The result is written as `<table>_profile_streaming.json` and `.html` in `plots/`. The EDA scripts fall back
+to this profiler when the full-profile libraries are missing or a table is too large to profile in memory.
+"""
+import html
+import json
+import logging
+import math
+
+from pathlib import Path
+from typing import Iterable, Optional
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+
+from movielens_eda_exercise.instrumentation import stage
+from movielens_eda_exercise.sketches import HyperLogLog, TDigest, CountMinSketch
+
+logger = logging.getLogger()
+
+DEFAULT_CHUNK_SIZE = 200_000
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+SKIPPED_COLUMNS = {'id', 'index'}
+SPLIT_COLUMNS = {'genres': '|'}
+
+
+def _is_id_column(name: str) -> bool:
+    return name.endswith('_id') or name.endswith('Id')
+
+
+class ColumnProfile:
+    """Sketch-based statistics of a single column."""
+
+    def __init__(self, name: str, kind: str, separator: Optional[str] = None, top_k: int = 20):
+        self.name = name
+        self.kind = kind
+        self.separator = separator
+        self.count = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.digest = TDigest() if kind == 'numeric' else None
+        self.frequent = CountMinSketch(top_k=top_k) if kind in ('id', 'text') else None
+
+    def update(self, series: pd.Series):
+        values = series.dropna()
+        self.count += len(series)
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+
+        if self.kind in ('numeric', 'id'):
+            numbers = values.to_numpy(dtype=np.float64)
+            self.sum += float(numbers.sum())
+            self.sum_of_squares += float(np.square(numbers).sum())
+            self.min = min(self.min, float(numbers.min()))
+            self.max = max(self.max, float(numbers.max()))
+        if self.separator is not None:
+            values = values.astype(str).str.split(self.separator, regex=False).explode()
+
+        self.distinct.add(values.to_numpy())
+        if self.digest is not None:
+            self.digest.add(values.to_numpy(dtype=np.float64))
+        if self.frequent is not None:
+            self.frequent.add(values)
+
+    def merge(self, other: "ColumnProfile") -> "ColumnProfile":
+        self.count += other.count
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.digest is not None:
+            self.digest.merge(other.digest)
+        if self.frequent is not None:
+            self.frequent.merge(other.frequent)
+        return self
+
+    def to_dict(self) -> dict:
+        present = self.count - self.nulls
+        result = {
+            'kind': self.kind,
+            'count': self.count,
+            'nulls': self.nulls,
+            'distinct_approx': self.distinct.count(),
+        }
+        if self.kind in ('numeric', 'id') and present:
+            mean = self.sum / present
+            result.update(mean=mean,
+                          std=math.sqrt(max(self.sum_of_squares / present - mean * mean, 0.0)),
+                          min=self.min, max=self.max)
+        if self.digest is not None and present:
+            result['quantiles_approx'] = {str(q): self.digest.quantile(q) for q in QUANTILES}
+        if self.frequent is not None:
+            result['top_approx'] = [[_jsonable(value), count] for value, count in self.frequent.most_common()]
+        if self.separator is not None:
+            result['split_on'] = self.separator
+        return result
+
+
+def _jsonable(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class StreamingProfiler:
+    """Profiles a table chunk by chunk; two profilers of the same table can be merged."""
+
+    def __init__(self, name: str, split_columns: Optional[dict] = None, top_k: int = 20):
+        self.name = name
+        self.split_columns = SPLIT_COLUMNS if split_columns is None else split_columns
+        self.top_k = top_k
+        self.rows = 0
+        self.columns = {}
+
+    def _column(self, name: str, series: pd.Series) -> ColumnProfile:
+        if name not in self.columns:
+            if _is_id_column(name):
+                kind = 'id'
+            elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                kind = 'numeric'
+            else:
+                kind = 'text'
+            self.columns[name] = ColumnProfile(name, kind, self.split_columns.get(name), self.top_k)
+        return self.columns[name]
+
+    def update(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        for name in chunk.columns:
+            if name in SKIPPED_COLUMNS:
+                continue
+            self._column(name, chunk[name]).update(chunk[name])
+
+    def merge(self, other: "StreamingProfiler") -> "StreamingProfiler":
+        self.rows += other.rows
+        for name, column in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                self.columns[name] = column
+        return self
+
+    def to_dict(self) -> dict:
+        return {'table': self.name, 'rows': self.rows,
+                'columns': {name: column.to_dict() for name, column in self.columns.items()}}
+
+
+def iter_database_chunks(table_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterable[pd.DataFrame]:
+    """Yields a database table in chunks of `chunk_size` rows.
+
+    The rows come from a server-side cursor (stream_results), so the driver fetches them as the chunks are
+    consumed instead of buffering the whole result set in the client first."""
+    from movielens_eda_exercise.database import get_engine
+
+    with get_engine().connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_size)
+        yield from pd.read_sql_table(table_name, conn, chunksize=chunk_size)
+
+
+def iter_zip_chunks(zip_path: Path, config, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterable[pd.DataFrame]:
+    """Yields a MovieLens CSV member of the zip archive in chunks, typed by its DatasetConfiguration."""
+    with ZipFile(zip_path) as z, z.open(config.inner_path) as member:
+        with pd.read_csv(member, header=config.header, names=config.columns, dtype=config.dtypes,
+                         chunksize=chunk_size) as reader:
+            yield from reader
+
+
+def profile_chunks(name: str, chunks: Iterable[pd.DataFrame]) -> StreamingProfiler:
+    profiler = StreamingProfiler(name)
+    for chunk_no, chunk in enumerate(chunks):
+        profiler.update(chunk)
+        logger.debug("profiled chunk %d of %s (%d rows so far)", chunk_no, name, profiler.rows)
+    return profiler
+
+
+def _render_html(profile: dict) -> str:
+    sections = []
+    for name, column in profile['columns'].items():
+        scalars = {k: v for k, v in column.items() if not isinstance(v, (dict, list))}
+        rows = "".join(f"<tr><th>{html.escape(k)}</th><td>{html.escape(str(v))}</td></tr>"
+                       for k, v in scalars.items())
+        for q, v in column.get('quantiles_approx', {}).items():
+            rows += f"<tr><th>p{float(q) * 100:g}</th><td>{v:.6g}</td></tr>"
+        top = "".join(f"<tr><td>{html.escape(str(v))}</td><td>{c}</td></tr>" for v, c in column.get('top_approx', []))
+        top_table = f"<h4>most frequent (approx.)</h4><table>{top}</table>" if top else ""
+        sections.append(f"<section><h3>{html.escape(name)}</h3><table>{rows}</table>{top_table}</section>")
+    title = html.escape(f"{profile['table']} streaming profile")
+    return (f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title>"
+            "<style>body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:1em}"
+            "th,td{border:1px solid #ccc;padding:2px 8px;text-align:left}</style></head>"
+            f"<body><h1>{title}</h1><p>{profile['rows']} rows, approximate statistics from a single pass.</p>"
+            f"{''.join(sections)}</body></html>")
+
+
+def write_report(profiler: StreamingProfiler, plots_dir: Path) -> dict:
+    """Writes the profile of `profiler` as JSON and HTML to `plots_dir` and returns it as a dict."""
+    plots_dir.mkdir(parents=True, exist_ok=True)
+    profile = profiler.to_dict()
+    p_json = plots_dir / f"{profiler.name}_profile_streaming.json"
+    p_json.write_text(json.dumps(profile, indent=2, default=str))
+    p_html = plots_dir / f"{profiler.name}_profile_streaming.html"
+    p_html.write_text(_render_html(profile), encoding='utf-8')
+    logger.info("Saved %s streaming profile: %s", profiler.name, p_html)
+    return profile
+
+
+def profile_tables(table_names: Iterable[str], plots_dir: Optional[Path] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    """Profiles database tables in a single streaming pass each and writes their reports."""
+    if plots_dir is None:
+        plots_dir = Path(__file__).parent / "plots"
+    profiles = {}
+    for name in table_names:
+        with stage("eda.streaming", table=name) as s:
+            profiler = profile_chunks(name, iter_database_chunks(name, chunk_size))
+            profiles[name] = write_report(profiler, plots_dir)
+            s.rows = profiler.rows
+    return profiles
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Profile MovieLens tables in a single streaming pass")
+    parser.add_argument("--plots-dir", type=Path, default=None, help="Directory to save reports")
+    parser.add_argument("--tables", nargs="+", default=["ratings", "movies", "tags"], help="Tables to profile")
+    parser.add_argument("--zip-path", type=Path, default=None,
+                        help="Profile the CSVs of this MovieLens zip instead of the database tables")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk")
+    args = parser.parse_args()
+
+    if args.zip_path is None:
+        profile_tables(args.tables, plots_dir=args.plots_dir, chunk_size=args.chunk_size)
+    else:
+        from movielens_eda_exercise.models.rating import RatingsConfiguration
+        from movielens_eda_exercise.models.movie import MovieConfiguration
+        from movielens_eda_exercise.models.tag import TagConfiguration
+        from movielens_eda_exercise.models.link import LinksConfiguration
+
+        configs = {c.model.__tablename__: c for c in
+                   (RatingsConfiguration, MovieConfiguration, TagConfiguration, LinksConfiguration)}
+        plots_dir = args.plots_dir or Path(__file__).parent / "plots"
+        for table_name in args.tables:
+            chunks = iter_zip_chunks(args.zip_path, configs[table_name], args.chunk_size)
+            write_report(profile_chunks(table_name, chunks), plots_dir)
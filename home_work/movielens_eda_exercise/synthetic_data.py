@@ -0,0 +1,321 @@
+"""Deterministic synthetic MovieLens archives for benchmarks and offline runs.
+
+`generate_archive(path, "1m")` writes a zip with movies.csv, ratings.csv, links.csv and tags.csv (plus the tag
+genome in the ml-latest layout) in the MovieLens CSV formats, with the skew that makes the real data
+hard to process:
+
+- movie popularity follows a Zipf-like law, a few movies collect a large share of the ratings
+- user activity is heavy tailed, every user has at least MIN_RATINGS_PER_USER ratings
+- (user, movie) pairs are unique, ratings.csv is ordered by userId then movieId like the real file
+- a rating is a half star value from a movie effect, a user effect and noise; some users only give whole stars
+- every user rates within a session window after a random start between 1996 and 2018
+
+The number of users and movies grows with the number of ratings, interpolated (log-log) between ml-latest-small
+(100k ratings, 610 users, 9742 movies) and ml-latest (33M ratings, 330975 users, 86537 movies).
+
+The archive has the layout of one of the datasets in datasets.py, ml-latest for the scales of LATEST_FROM
+ratings and more and ml-latest-small below, so the members are where the loaders, the feature builder and the
+similarity index look for them once that dataset is selected. The tag genome is only written in the ml-latest
+layout, like the real archives. The output depends only on the scale, the seed and
+GENERATOR_VERSION (every batch of users draws from its own random stream), so an archive can be regenerated
+instead of being stored. It is never written to the download path of a real archive (see datasets.py).
+"""
+import io
+import math
+import logging
+import zipfile
+
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from movielens_eda_exercise.datasets import DATASETS, Dataset
+from movielens_eda_exercise.models.rating import RatingsConfiguration
+from movielens_eda_exercise.models.link import LinksConfiguration
+from movielens_eda_exercise.models.movie import MovieConfiguration
+from movielens_eda_exercise.models.tag import TagConfiguration
+from movielens_eda_exercise.models.genome.genome_tag import GenomeTagsConfiguration
+from movielens_eda_exercise.models.genome.genome_score import GenomeScoresConfiguration
+
+logger = logging.getLogger()
+
+GENERATOR_VERSION = 2
+SCALES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000, "33m": 33_000_000}
+# scales from which on the archive looks like ml-latest (with the tag genome) instead of ml-latest-small
+LATEST_FROM = 10_000_000
+
+SMALL_SHAPE = (100_000, 610, 9_742)
+LATEST_SHAPE = (33_000_000, 330_975, 86_537)
+MIN_RATINGS_PER_USER = 20
+MOVIE_SKEW, MOVIE_OFFSET = 0.8, 10.0
+USER_SKEW, USER_OFFSET = 0.9, 5.0
+# a user rates at most this share of the movies
+MAX_USER_SHARE = 0.2
+TAG_SHARE = 0.036
+TAGGING_USER_SHARE = 0.1
+GENOME_TAGS = 1128
+GENOME_MOVIE_SHARE = 0.15
+FIRST_TIMESTAMP, LAST_TIMESTAMP = 828_000_000, 1_537_000_000
+SESSION_DAYS = 30
+USERS_PER_BATCH = 2_000
+ARCHIVE_DATE = (2018, 9, 26, 0, 0, 0)
+# ratings and genome relevances are written from preformatted labels, formatting floats dominates the run time
+RATING_LABELS = np.array([f"{half_stars / 2:.1f}" for half_stars in range(11)], dtype=object)
+RELEVANCE_STEPS = 10_000
+RELEVANCE_LABELS = np.array([f"{step / RELEVANCE_STEPS:.5f}" for step in range(RELEVANCE_STEPS + 1)], dtype=object)
+
+GENRES = ["Action", "Adventure", "Animation", "Children", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+          "Film-Noir", "Horror", "IMAX", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+GENRE_WEIGHTS = [8, 5, 2, 3, 12, 5, 3, 16, 3, 0.5, 4, 1, 1, 2, 6, 3, 7, 1.5, 1]
+COMMON_TAGS = ["atmospheric", "twist ending", "dark comedy", "funny", "sci-fi", "visually appealing",
+               "thought-provoking", "based on a book", "classic", "superhero", "surreal", "great soundtrack",
+               "nonlinear", "quirky", "dystopia", "time travel", "psychology", "cinematography", "stylized",
+               "space", "mindfuck", "violence", "World War II", "Disney", "crime", "romance", "animation"]
+
+
+def dataset_shape(ratings: int) -> tuple:
+    """(users, movies) of a MovieLens-like dataset with `ratings` ratings."""
+    def interpolate(small, latest):
+        slope = math.log(latest / small) / math.log(LATEST_SHAPE[0] / SMALL_SHAPE[0])
+        return int(round(small * (ratings / SMALL_SHAPE[0]) ** slope))
+
+    users = interpolate(SMALL_SHAPE[1], LATEST_SHAPE[1])
+    movies = interpolate(SMALL_SHAPE[2], LATEST_SHAPE[2])
+    users = min(users, ratings // MIN_RATINGS_PER_USER)
+    movies = max(movies, int(MIN_RATINGS_PER_USER / MAX_USER_SHARE))
+    return max(users, 1), movies
+
+
+def _zipf_weights(n: int, skew: float, offset: float) -> np.ndarray:
+    weights = 1.0 / (np.arange(n) + offset) ** skew
+    return weights / weights.sum()
+
+
+def _user_counts(rng, ratings: int, users: int, movies: int) -> np.ndarray:
+    """Ratings per user: MIN_RATINGS_PER_USER each plus a heavy tailed share of the rest, summing to `ratings`."""
+    cap = max(MIN_RATINGS_PER_USER, int(movies * MAX_USER_SHARE))
+    weights = rng.permutation(_zipf_weights(users, USER_SKEW, USER_OFFSET))
+    counts = np.full(users, MIN_RATINGS_PER_USER, dtype=np.int64)
+    remaining = ratings - counts.sum()
+    while remaining > 0:
+        open_users = counts < cap
+        if not open_users.any():
+            raise ValueError(f"{ratings} ratings do not fit {users} users x {movies} movies")
+        share = np.where(open_users, weights, 0.0)
+        counts += rng.multinomial(remaining, share / share.sum())
+        over = np.maximum(counts - cap, 0)
+        counts -= over
+        remaining = int(over.sum())
+    return counts
+
+
+def _distinct_movies(rng, counts: np.ndarray, cdf: np.ndarray) -> tuple:
+    """For each user i, counts[i] distinct movie indices drawn by popularity. Returns (user, movie) arrays."""
+    movies = len(cdf)
+    need = counts.copy()
+    chosen = np.empty(0, dtype=np.int64)
+    rounds = 0
+    while need.sum() > 0:
+        rounds += 1
+        pending = np.flatnonzero(need)
+        draws = np.ceil(need[pending] * 1.25).astype(np.int64) + 2
+        users = np.repeat(pending, draws)
+        if rounds <= 8:
+            picked = np.searchsorted(cdf, rng.random(len(users)), side='right')
+        else:
+            # the popular movies of a heavy user are taken, fill up uniformly
+            picked = rng.integers(0, movies, len(users))
+        keys = np.concatenate([chosen, users * movies + np.minimum(picked, movies - 1)])
+        keys, first = np.unique(keys, return_index=True)
+        # drop the pairs chosen before, keep the new candidates in draw order
+        new = first >= len(chosen)
+        keys = keys[new][np.argsort(first[new], kind='stable')]
+        users = keys // movies
+        order = np.argsort(users, kind='stable')
+        keys, users = keys[order], users[order]
+        starts = np.searchsorted(users, users, side='left')
+        keep = (np.arange(len(keys)) - starts) < need[users]
+        keys = keys[keep]
+        chosen = np.concatenate([chosen, keys])
+        need -= np.bincount(keys // movies, minlength=len(need))
+    chosen.sort()
+    return chosen // movies, chosen % movies
+
+
+class _Catalog:
+    """The movies, users and their latent effects of one synthetic dataset."""
+
+    def __init__(self, ratings: int, seed: int):
+        self.ratings = ratings
+        self.seed = seed
+        rng = np.random.default_rng([seed, GENERATOR_VERSION, 0])
+        self.users, self.movies = dataset_shape(ratings)
+        # movieIds have gaps like the real ones
+        self.movie_ids = np.sort(rng.choice(np.arange(1, self.movies * 2 + 1), self.movies, replace=False))
+        # popularity rank -> movie index
+        self.popularity = rng.permutation(self.movies)
+        weights = np.empty(self.movies)
+        weights[self.popularity] = _zipf_weights(self.movies, MOVIE_SKEW, MOVIE_OFFSET)
+        self.cdf = np.cumsum(weights)
+        self.cdf /= self.cdf[-1]
+        self.movie_effect = rng.normal(0.0, 0.45, self.movies)
+        self.user_effect = rng.normal(0.0, 0.35, self.users)
+        self.whole_stars = rng.random(self.users) < 0.4
+        self.user_start = rng.integers(FIRST_TIMESTAMP, LAST_TIMESTAMP - SESSION_DAYS * 86_400, self.users)
+        self.counts = _user_counts(rng, ratings, self.users, self.movies)
+
+
+def _ratings_batch(catalog: _Catalog, batch: int, first_user: int, last_user: int) -> pd.DataFrame:
+    rng = np.random.default_rng([catalog.seed, GENERATOR_VERSION, 1, batch])
+    users, movies = _distinct_movies(rng, catalog.counts[first_user:last_user], catalog.cdf)
+    users += first_user
+    score = (3.5 + catalog.movie_effect[movies] + catalog.user_effect[users]
+             + rng.normal(0.0, 0.85, len(users)))
+    step = np.where(catalog.whole_stars[users], 1.0, 0.5)
+    rating = np.clip(np.round(score / step) * step, step, 5.0)
+    timestamp = catalog.user_start[users] + rng.exponential(SESSION_DAYS * 86_400 / 4, len(users)).astype(np.int64)
+    return pd.DataFrame({"userId": users + 1, "movieId": catalog.movie_ids[movies],
+                         "rating": RATING_LABELS[(rating * 2).astype(np.int64)],
+                         "timestamp": np.minimum(timestamp, LAST_TIMESTAMP)})
+
+
+def iter_ratings(catalog: _Catalog):
+    """Yields ratings.csv as DataFrames of USERS_PER_BATCH users, ordered by userId and movieId."""
+    for batch, first_user in enumerate(range(0, catalog.users, USERS_PER_BATCH)):
+        yield _ratings_batch(catalog, batch, first_user, min(first_user + USERS_PER_BATCH, catalog.users))
+
+
+def movies_frame(catalog: _Catalog) -> pd.DataFrame:
+    rng = np.random.default_rng([catalog.seed, GENERATOR_VERSION, 2])
+    years = np.clip(np.round(2018 - rng.exponential(18, catalog.movies)), 1902, 2018).astype(int)
+    # weighted sampling without replacement of 1-4 genres per movie (Gumbel top-k)
+    keys = np.log(np.asarray(GENRE_WEIGHTS)) + rng.gumbel(size=(catalog.movies, len(GENRES)))
+    ranked = np.argsort(-keys, axis=1)
+    counts = rng.integers(1, 5, catalog.movies)
+    unlisted = rng.random(catalog.movies) < 0.005
+    genres = ["(no genres listed)" if none else "|".join(GENRES[g] for g in sorted(row[:n]))
+              for row, n, none in zip(ranked, counts, unlisted)]
+    articles = rng.random(catalog.movies) < 0.1
+    titles = [f"Synthetic Movie {movie_id}{', The' if article else ''} ({year})"
+              for movie_id, article, year in zip(catalog.movie_ids, articles, years)]
+    return pd.DataFrame({"movieId": catalog.movie_ids, "title": titles, "genres": genres})
+
+
+def links_frame(catalog: _Catalog) -> pd.DataFrame:
+    rng = np.random.default_rng([catalog.seed, GENERATOR_VERSION, 3])
+    imdb = rng.choice(np.arange(100_000, 9_999_999), catalog.movies, replace=False)
+    tmdb = pd.array(rng.choice(np.arange(2, 999_999), catalog.movies, replace=False), dtype="Int32")
+    tmdb[rng.random(catalog.movies) < 0.001] = pd.NA
+    return pd.DataFrame({"movieId": catalog.movie_ids, "imdbId": [f"{i:07d}" for i in imdb], "tmdbId": tmdb})
+
+
+def tags_frame(catalog: _Catalog) -> pd.DataFrame:
+    rng = np.random.default_rng([catalog.seed, GENERATOR_VERSION, 4])
+    n = max(1, int(catalog.ratings * TAG_SHARE))
+    taggers = rng.choice(catalog.users, max(1, int(catalog.users * TAGGING_USER_SHARE)), replace=False)
+    users = taggers[np.minimum(np.searchsorted(np.cumsum(_zipf_weights(len(taggers), 1.1, 2.0)), rng.random(n)),
+                               len(taggers) - 1)]
+    movies = np.minimum(np.searchsorted(catalog.cdf, rng.random(n), side='right'), catalog.movies - 1)
+    vocabulary = COMMON_TAGS + [f"keyword {i}" for i in range(max(100, n // 20))]
+    words = np.minimum(np.searchsorted(np.cumsum(_zipf_weights(len(vocabulary), 1.0, 1.0)), rng.random(n)),
+                       len(vocabulary) - 1)
+    frame = pd.DataFrame({"userId": users + 1, "movieId": catalog.movie_ids[movies],
+                          "tag": np.asarray(vocabulary, dtype=object)[words],
+                          "timestamp": rng.integers(1_137_000_000, LAST_TIMESTAMP, n)})
+    return frame.sort_values(["userId", "movieId"], kind='stable').reset_index(drop=True)
+
+
+def iter_genome_scores(catalog: _Catalog):
+    """Yields genome-scores.csv for the most rated GENOME_MOVIE_SHARE of the movies, one block per 1000 movies."""
+    covered = np.sort(catalog.movie_ids[catalog.popularity[:max(1, int(catalog.movies * GENOME_MOVIE_SHARE))]])
+    tag_ids = np.arange(1, GENOME_TAGS + 1)
+    for block, start in enumerate(range(0, len(covered), 1000)):
+        rng = np.random.default_rng([catalog.seed, GENERATOR_VERSION, 5, block])
+        movie_ids = covered[start:start + 1000]
+        relevance = np.round(rng.beta(0.6, 4.0, len(movie_ids) * GENOME_TAGS) * RELEVANCE_STEPS).astype(np.int64)
+        yield pd.DataFrame({"movieId": np.repeat(movie_ids, GENOME_TAGS),
+                            "tagId": np.tile(tag_ids, len(movie_ids)), "relevance": RELEVANCE_LABELS[relevance]})
+
+
+def _member_info(inner_path: str) -> zipfile.ZipInfo:
+    # a fixed modification time keeps the archive byte for byte reproducible
+    info = zipfile.ZipInfo(inner_path, date_time=ARCHIVE_DATE)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def default_dataset(ratings: int) -> Dataset:
+    """The dataset whose layout a synthetic archive with `ratings` ratings has."""
+    return DATASETS["ml-latest" if ratings >= LATEST_FROM else "ml-latest-small"]
+
+
+def _write_member(z: zipfile.ZipFile, inner_path: str, frames):
+    with z.open(_member_info(inner_path), 'w', force_zip64=True) as raw, io.TextIOWrapper(raw, encoding='utf-8', newline='') as f:
+        header = True
+        for frame in frames:
+            frame.to_csv(f, index=False, header=header)
+            header = False
+
+
+def generate_archive(path: Union[str, Path], scale: Union[str, int], seed: int = 0, genome: bool = None,
+                     dataset: Optional[Dataset] = None) -> dict:
+    """Writes a synthetic MovieLens zip with `scale` ratings ("100k", "1m", "10m", "33m" or a number) to `path`.
+
+    The archive has the layout of `dataset` (default: see `default_dataset`) and includes the tag genome when
+    the dataset has one, unless `genome` says otherwise. Returns the description that is also stored as
+    README.txt in the archive."""
+    path = Path(path)
+    if any(path.resolve() == d.zip_path.resolve() for d in DATASETS.values()):
+        # the downloader would take it for the real archive
+        raise ValueError(f"{path} is the download path of a real MovieLens archive, write synthetic data elsewhere")
+    ratings = SCALES[scale] if isinstance(scale, str) else int(scale)
+    if dataset is None:
+        dataset = default_dataset(ratings)
+    if genome is None:
+        genome = dataset.has_genome
+    elif genome and not dataset.has_genome:
+        raise ValueError(f"{dataset.name} has no tag genome, generate the ml-latest layout for it")
+    catalog = _Catalog(ratings, seed)
+    description = {"generator_version": GENERATOR_VERSION, "seed": seed, "ratings": ratings,
+                   "users": catalog.users, "movies": catalog.movies, "dataset": dataset.name, "genome": genome}
+    logger.info("generating %s: %d ratings, %d users, %d movies", path, ratings, catalog.users, catalog.movies)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr(_member_info(dataset.member("README.txt")),
+                   "Synthetic MovieLens-like dataset, not real user data.\n"
+                   + "".join(f"{k}: {v}\n" for k, v in description.items()))
+        _write_member(z, dataset.member(MovieConfiguration.file_name), [movies_frame(catalog)])
+        _write_member(z, dataset.member(LinksConfiguration.file_name), [links_frame(catalog)])
+        _write_member(z, dataset.member(TagConfiguration.file_name), [tags_frame(catalog)])
+        _write_member(z, dataset.member(RatingsConfiguration.file_name), iter_ratings(catalog))
+        if genome:
+            tags = pd.DataFrame({"tagId": np.arange(1, GENOME_TAGS + 1),
+                                 "tag": (COMMON_TAGS + [f"genome tag {i}" for i in range(GENOME_TAGS)])[:GENOME_TAGS]})
+            _write_member(z, dataset.member(GenomeTagsConfiguration.file_name), [tags])
+            _write_member(z, dataset.member(GenomeScoresConfiguration.file_name), iter_genome_scores(catalog))
+    tmp.replace(path)
+    logger.info("generated %s (%.1f MiB)", path, path.stat().st_size / 2 ** 20)
+    return description
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic MovieLens zip archive")
+    parser.add_argument("--scale", default="100k", help=f"Number of ratings: {', '.join(SCALES)} or a number")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--dataset", choices=DATASETS, default=None,
+                        help="Layout of the archive (default: ml-latest for scales of 10m ratings and more)")
+    parser.add_argument("--genome", action=argparse.BooleanOptionalAction, default=None,
+                        help="Include the tag genome (default: in the ml-latest layout)")
+    parser.add_argument("output", type=Path, help="Zip archive to write")
+    args = parser.parse_args()
+
+    generate_archive(args.output, args.scale if args.scale in SCALES else int(args.scale), args.seed, args.genome,
+                     DATASETS[args.dataset] if args.dataset else None)
@@ -0,0 +1,283 @@
+"""Per-movie feature store for the regression workflow.
+
+The features are computed in one vectorised pass over the ratings, chunk by chunk (from the database or
+straight from the zip archive), without ever building the ratings x movies merged frame: every chunk's movie
+ids are mapped to row indexes of the movies table and count / sum / sum of squares / first and last timestamp
+are accumulated per movie with `np.bincount` and `np.minimum.at` / `np.maximum.at`. Genres become a sparse
+multi-hot CSR matrix built straight from the split genre strings.
+
+Features per movie (indexed by movieId):
+- num_ratings, num_ratings_log1p
+- avg_rating, rating_var (population variance)
+- first_year, last_year (UTC year of the first / last rating)
+- genre_<name> multi-hot columns, "(no genres listed)" has none
+
+The result is saved under `local_data/features/` with the version of the feature definitions and the
+fingerprint of the source data, and reused as long as both match, so a GridSearchCV run starts from the cached
+features instead of recomputing them.
+"""
+import json
+import hashlib
+import logging
+
+from functools import partial
+from pathlib import Path
+from typing import Iterable, Optional
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from movielens_eda_exercise.models.support import to_snake_case
+
+logger = logging.getLogger()
+
+# Bump whenever the definition of a feature changes, so cached features are rebuilt
+FEATURE_VERSION = 1
+DEFAULT_FEATURES_DIR = Path(__file__).parent / "local_data" / "features"
+DEFAULT_CHUNK_SIZE = 1_000_000
+NO_GENRES = "(no genres listed)"
+NUMERIC_COLUMNS = ['num_ratings', 'num_ratings_log1p', 'avg_rating', 'rating_var', 'first_year', 'last_year']
+
+
+class MovieFeatures:
+    """Numeric per-movie features plus the sparse genre matrix, row-aligned on `movie_ids`."""
+
+    def __init__(self, movie_ids: np.ndarray, numeric: pd.DataFrame, genres: sp.csr_matrix, genre_names: list):
+        self.movie_ids = movie_ids
+        self.numeric = numeric
+        self.genres = genres
+        self.genre_names = genre_names
+
+    @property
+    def genre_columns(self) -> list:
+        return [f"genre_{name}" for name in self.genre_names]
+
+    def to_frame(self, rated_only: bool = True) -> pd.DataFrame:
+        """Numeric features and genre columns (pandas sparse) as one DataFrame indexed by movieId."""
+        genres = pd.DataFrame.sparse.from_spmatrix(self.genres, index=self.numeric.index,
+                                                   columns=self.genre_columns)
+        frame = self.numeric.join(genres)
+        return frame[frame['num_ratings'] > 0] if rated_only else frame
+
+    def design_matrix(self, numeric_columns=('num_ratings_log1p', 'first_year'), target: str = 'avg_rating'):
+        """Sparse X (numeric columns followed by genres), y and the column names, for rated movies only."""
+        rated = self.numeric['num_ratings'].to_numpy() > 0
+        numeric = sp.csr_matrix(self.numeric.loc[rated, list(numeric_columns)].to_numpy(dtype=np.float64))
+        X = sp.hstack([numeric, self.genres[rated]], format='csr')
+        y = self.numeric.loc[rated, target].to_numpy(dtype=np.float64)
+        return X, y, list(numeric_columns) + self.genre_columns
+
+    def save(self, features_dir: Path, meta: dict):
+        features_dir.mkdir(parents=True, exist_ok=True)
+        np.save(features_dir / "movie_ids.npy", self.movie_ids)
+        self.numeric.to_parquet(features_dir / "numeric.parquet")
+        sp.save_npz(features_dir / "genres.npz", self.genres)
+        # meta.json goes last: its presence marks a complete feature set
+        (features_dir / "meta.json").write_text(json.dumps(dict(meta, genre_names=self.genre_names), indent=2))
+
+    @classmethod
+    def load(cls, features_dir: Path) -> "MovieFeatures":
+        meta = json.loads((features_dir / "meta.json").read_text())
+        return cls(np.load(features_dir / "movie_ids.npy"), pd.read_parquet(features_dir / "numeric.parquet"),
+                   sp.load_npz(features_dir / "genres.npz").tocsr(), meta['genre_names'])
+
+
+def genre_matrix(genres: pd.Series):
+    """Multi-hot CSR matrix of pipe-separated genre strings and the sorted genre names."""
+    tokens = genres.reset_index(drop=True).astype('string').fillna(NO_GENRES).str.split('|', regex=False).explode()
+    tokens = tokens[tokens != NO_GENRES]
+    names, columns = np.unique(tokens.to_numpy(dtype=str), return_inverse=True)
+    rows = tokens.index.to_numpy(dtype=np.int64)
+    matrix = sp.csr_matrix((np.ones(len(columns), dtype=np.uint8), (rows, columns)),
+                           shape=(len(genres), len(names)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, names.tolist()
+
+
+def _years(timestamps: np.ndarray) -> np.ndarray:
+    years = pd.to_datetime(pd.Series(timestamps), unit='s', errors='coerce').dt.year
+    return years.astype('Float64').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def build_movie_features(movies: pd.DataFrame, rating_chunks: Iterable[pd.DataFrame]) -> MovieFeatures:
+    """Computes the per-movie features from the movies table and chunks of ratings."""
+    movies = movies.rename(columns=to_snake_case).sort_values('movie_id', ignore_index=True)
+    movie_ids = movies['movie_id'].to_numpy(dtype=np.int32)
+    n = len(movie_ids)
+
+    count = np.zeros(n, dtype=np.int64)
+    total = np.zeros(n, dtype=np.float64)
+    squares = np.zeros(n, dtype=np.float64)
+    first_ts = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    last_ts = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+    unknown = 0
+    for chunk in rating_chunks:
+        chunk = chunk.rename(columns=to_snake_case)
+        ids = chunk['movie_id'].to_numpy(dtype=np.int32)
+        rows = np.minimum(np.searchsorted(movie_ids, ids), max(n - 1, 0))
+        known = movie_ids[rows] == ids if n else np.zeros(len(ids), dtype=bool)
+        unknown += int(len(ids) - known.sum())
+        rows = rows[known]
+        ratings = chunk['rating'].to_numpy(dtype=np.float64)[known]
+        timestamps = chunk['timestamp'].to_numpy(dtype=np.int64)[known]
+
+        count += np.bincount(rows, minlength=n)
+        total += np.bincount(rows, weights=ratings, minlength=n)
+        squares += np.bincount(rows, weights=ratings * ratings, minlength=n)
+        np.minimum.at(first_ts, rows, timestamps)
+        np.maximum.at(last_ts, rows, timestamps)
+    if unknown:
+        logger.warning("%d ratings refer to movies missing from the movies table and were ignored", unknown)
+
+    rated = count > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(rated, total / count, np.nan)
+        variance = np.where(rated, np.maximum(squares / count - mean * mean, 0.0), np.nan)
+    numeric = pd.DataFrame({
+        'num_ratings': count,
+        'num_ratings_log1p': np.log1p(count),
+        'avg_rating': mean,
+        'rating_var': variance,
+        'first_year': _years(np.where(rated, first_ts, 0)),
+        'last_year': _years(np.where(rated, last_ts, 0)),
+    }, index=pd.Index(movie_ids, name='movieId'))
+    numeric.loc[~rated, ['first_year', 'last_year']] = np.nan
+
+    genres, genre_names = genre_matrix(movies['genres'])
+    logger.info("built features for %d movies (%d rated, %d genres)", n, int(rated.sum()), len(genre_names))
+    return MovieFeatures(movie_ids, numeric[NUMERIC_COLUMNS], genres, genre_names)
+
+
+def _cache_key(fingerprint: dict) -> str:
+    payload = json.dumps({"version": FEATURE_VERSION, "source": fingerprint}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def _cached(features_dir: Path, fingerprint: dict, refresh: bool, build) -> MovieFeatures:
+    key = _cache_key(fingerprint)
+    target = features_dir / f"v{FEATURE_VERSION}-{key}"
+    if not refresh and (target / "meta.json").exists():
+        logger.debug("feature cache hit: %s", target)
+        return MovieFeatures.load(target)
+
+    features = build()
+    features.save(target, {"version": FEATURE_VERSION, "key": key, "source": fingerprint})
+    logger.info("saved movie features to %s", target)
+    return features
+
+
+def _in_window(chunks: Iterable[pd.DataFrame], start: Optional[int], end: Optional[int]):
+    for chunk in chunks:
+        timestamps = chunk['timestamp']
+        keep = np.ones(len(chunk), dtype=bool)
+        if start is not None:
+            keep &= (timestamps >= start).to_numpy()
+        if end is not None:
+            keep &= (timestamps < end).to_numpy()
+        yield chunk[keep]
+
+
+def _windowed(fingerprint: dict, window: tuple, chunk_size: int, sources: list, rating_chunks):
+    """Restricts the features to the ratings in `window` = (start, end). Returns the fingerprint and the
+    rating chunks.
+
+    The ratings are read from the time-partitioned ratings store (only the matching partitions are scanned) when
+    it was exported from the same ratings, i.e. its source is one of `sources`; otherwise `rating_chunks` are
+    read in full and filtered, so the features never mix in the ratings of another archive or database."""
+    from movielens_eda_exercise.ratings_store import epoch_seconds, export_description, has_pyarrow, iter_ratings
+
+    start, end = window
+    fingerprint = dict(fingerprint, window=[str(start), str(end)])
+    description = export_description()
+    # the description went through JSON, so compare with the sources as they are stored
+    if has_pyarrow and description is not None and description['source'] in json.loads(json.dumps(sources)):
+        return fingerprint, partial(iter_ratings, start=start, end=end, batch_rows=chunk_size)
+    logger.info("the partitioned ratings store is %s, filtering the ratings by time instead",
+                "missing" if description is None else f"from another source ({description['source']})")
+    return fingerprint, lambda: _in_window(rating_chunks(), epoch_seconds(start), epoch_seconds(end))
+
+
+def movie_features_from_zip(zip_path: Path, features_dir: Optional[Path] = None, refresh: bool = False,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE, window: Optional[tuple] = None) -> MovieFeatures:
+    """Movie features of a MovieLens zip archive, cached until the archive's members change.
+
+    With `window` = (start, end) only the ratings with start <= timestamp < end are used."""
+    from movielens_eda_exercise.load_manifest import member_checksum
+    from movielens_eda_exercise.models.movie import MovieConfiguration
+    from movielens_eda_exercise.models.rating import RatingsConfiguration
+    from movielens_eda_exercise.streaming_profiler import iter_zip_chunks
+
+    with ZipFile(zip_path) as z:
+        fingerprint = {"movies": member_checksum(z, MovieConfiguration.inner_path),
+                       "ratings": member_checksum(z, RatingsConfiguration.inner_path)}
+    rating_chunks = partial(iter_zip_chunks, zip_path, RatingsConfiguration, chunk_size)
+    if window is not None:
+        fingerprint, rating_chunks = _windowed(fingerprint, window, chunk_size, [{"zip": fingerprint["ratings"]}],
+                                               rating_chunks)
+
+    def build():
+        with ZipFile(zip_path) as z:
+            movies = pd.read_csv(z.open(MovieConfiguration.inner_path), header=MovieConfiguration.header,
+                                 names=MovieConfiguration.columns, dtype=MovieConfiguration.dtypes)
+        return build_movie_features(movies, rating_chunks())
+
+    return _cached(features_dir or DEFAULT_FEATURES_DIR, fingerprint, refresh, build)
+
+
+def movie_features_from_database(features_dir: Optional[Path] = None, refresh: bool = False,
+                                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                 window: Optional[tuple] = None) -> MovieFeatures:
+    """Movie features of the `movies` / `ratings` tables, cached until either table changes.
+
+    With `window` = (start, end) only the ratings with start <= timestamp < end are used."""
+    from movielens_eda_exercise.data_access import read_table, table_fingerprint
+    from movielens_eda_exercise.database import get_engine
+    from movielens_eda_exercise.load_manifest import STATUS_COMPLETE, read_manifest
+    from movielens_eda_exercise.streaming_profiler import iter_database_chunks
+
+    fingerprint = {"movies": table_fingerprint('movies'), "ratings": table_fingerprint('ratings')}
+    rating_chunks = partial(iter_database_chunks, 'ratings', chunk_size)
+    if window is not None:
+        sources = [{"database": fingerprint["ratings"]}]
+        with get_engine().connect() as conn:
+            entry = read_manifest(conn, 'ratings')
+        if entry is not None and entry.status == STATUS_COMPLETE:
+            # exported by load_all from the archive member the table was loaded from
+            sources.append({"zip": entry.zip_checksum})
+        fingerprint, rating_chunks = _windowed(fingerprint, window, chunk_size, sources, rating_chunks)
+
+    def build():
+        movies = read_table('movies', columns=['movie_id', 'genres'], refresh=refresh)
+        return build_movie_features(movies, rating_chunks())
+
+    return _cached(features_dir or DEFAULT_FEATURES_DIR, fingerprint, refresh, build)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build the per-movie feature store for the regression exercise")
+    parser.add_argument("--zip-path", type=Path, default=None,
+                        help="Read movies and ratings from this MovieLens zip instead of the database")
+    parser.add_argument("--features-dir", type=Path, default=None, help="Feature store directory")
+    parser.add_argument("--refresh", action="store_true", help="Rebuild the features even if they are cached")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Ratings read per chunk")
+    parser.add_argument("--since", default=None,
+                        help="Only use ratings from this date on (read from the partitioned ratings store when it "
+                             "holds the same ratings)")
+    parser.add_argument("--until", default=None, help="Only use ratings before this date")
+    args = parser.parse_args()
+
+    time_window = None if args.since is None and args.until is None else (args.since, args.until)
+    if args.zip_path is None:
+        result = movie_features_from_database(args.features_dir, refresh=args.refresh, chunk_size=args.chunk_size,
+                                              window=time_window)
+    else:
+        result = movie_features_from_zip(args.zip_path, args.features_dir, refresh=args.refresh,
+                                         chunk_size=args.chunk_size, window=time_window)
+    print(result.to_frame().head())
@@ -0,0 +1,58 @@
+from io import StringIO
+
+import pandas as pd
+import pytest
+
+from movielens_eda_exercise.bulk_loader import write_load_data_csv
+
+ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+def _read_load_data(text: str) -> list:
+    """Parses `text` as MySQL's LOAD DATA does with FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+    ESCAPED BY '\\' LINES TERMINATED BY '\\n'; \\N is NULL (None)."""
+    rows, row, field, i = [], [], [], 0
+    quoted, at_start = False, True
+    while i < len(text):
+        c = text[i]
+        if c == '\\':
+            if at_start and text[i + 1] == 'N' and text[i + 2:i + 3] in (',', '\n', ''):
+                field = None
+            else:
+                field.append(ESCAPES.get(text[i + 1], text[i + 1]))
+            i += 2
+        elif at_start and c == '"':
+            quoted = True
+            i += 1
+        elif quoted and c == '"':
+            if text[i + 1:i + 2] == '"':
+                field.append('"')
+                i += 2
+            else:
+                quoted = False
+                i += 1
+        elif not quoted and c in ',\n':
+            row.append(field if field is None else ''.join(field))
+            field = []
+            if c == '\n':
+                rows.append(row)
+                row = []
+            i += 1
+        else:
+            field.append(c)
+            i += 1
+        at_start = c in ',\n' and not quoted
+    return rows
+
+
+@pytest.mark.parametrize("dtype", ["object", "string", "category"])
+def test_backslashes_survive_load_data(dtype):
+    values = ['trailing\\', 'C:\\movies\\new', '\\N', 'comma\\,after', 'quote "\\"', 'plain', None]
+    df = pd.DataFrame({"movie_id": range(len(values)), "tag": pd.Series(values, dtype=dtype)})
+    buffer = StringIO()
+
+    write_load_data_csv(df, buffer)
+
+    rows = _read_load_data(buffer.getvalue())
+    assert [row[1] for row in rows] == values
+    assert [int(row[0]) for row in rows] == list(range(len(values)))
@@ -0,0 +1,91 @@
+import pytest
+
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from model_search.hyperparameter_search import HyperparameterSearch
+
+
+def _search(**options) -> HyperparameterSearch:
+    return HyperparameterSearch(None, {"forest": RandomForestClassifier(random_state=0)},
+                                {"forest": {"max_depth": [2, 3, 4, 5, 6, 7, 8, 9, 10]}}, **options)
+
+
+@pytest.mark.parametrize("n_candidates, factor, max_resources, expected", [
+    (9, 3, 90, [10, 30, 90]),
+    (10, 3, 270, [10, 30, 90, 270]),
+    (27, 3, 1000, [37, 111, 333, 1000]),
+    (4, 2, 64, [16, 32, 64]),
+    (1, 3, 90, [90]),
+])
+def test_halving_budgets_grow_by_factor_to_the_maximum(n_candidates, factor, max_resources, expected):
+    search = _search(halving=True, factor=factor, resource="n_estimators", max_resources=max_resources)
+
+    assert search._budgets("n_estimators", n_candidates, 500) == expected
+
+
+def test_halving_budgets_respect_min_resources():
+    search = _search(halving=True, resource="n_estimators", min_resources=20, max_resources=90)
+
+    assert search._budgets("n_estimators", 9, 500) == [20, 60, 90]
+
+
+def test_budgets_without_halving_or_without_the_resource():
+    assert _search(resource="n_estimators", max_resources=90)._budgets("n_estimators", 9, 500) == [90]
+    assert _search(halving=True)._budgets("n_samples", 9, 500) == [55, 165, 500]
+    # an estimator without the resource parameter is fitted on all training rows
+    assert _search(halving=True, resource="n_estimators", max_resources=90)._budgets("n_samples", 9, 500) == [500]
+    with pytest.raises(ValueError):
+        _search(halving=True, resource="n_estimators")._budgets("n_estimators", 9, 500)
+
+
+@pytest.fixture
+def data():
+    return make_classification(n_samples=300, n_features=8, n_informative=4, random_state=0)
+
+
+def test_best_params_include_the_final_budget(tmp_path, data):
+    X, y = data
+    search = HyperparameterSearch(
+        StandardScaler(),
+        {"forest": RandomForestClassifier(random_state=0), "logreg": LogisticRegression()},
+        {"forest": {"model__max_depth": [2, 4, None]}, "logreg": {"C": [0.1, 1.0]}},
+        scoring="roc_auc", cv=3, halving=True, factor=3, resource="n_estimators", max_resources=27, workers=2,
+        cache_dir=tmp_path)
+
+    result = search.fit(X, y)
+
+    assert sorted(result.records["budget"][result.records["estimator"] == "forest"].unique()) == [9, 27]
+    name, params = result.best_params("forest")
+    assert params["n_estimators"] == 27
+    assert result.best_pipeline("forest").get_params()["model__n_estimators"] == 27
+    forest = result.cv_results[result.cv_results["estimator"] == "forest"]
+    assert all(params["n_estimators"] == budget for params, budget in zip(forest["params"], forest["budget"]))
+    # logreg has no n_estimators and is searched on all training rows without halving
+    assert "n_estimators" not in result.best_params("logreg")[1]
+    summary = result.summary()
+    assert sorted(summary["estimator"]) == ["forest", "logreg"]
+    assert summary["mean_score"].is_monotonic_decreasing
+
+
+def test_resumed_search_reuses_the_evaluations(tmp_path, data):
+    X, y = data
+    options = dict(scoring="accuracy", cv=3, halving=True, resource="n_estimators", max_resources=27, workers=1,
+                   cache_dir=tmp_path)
+    first = _search(**options).fit(X, y)
+    second = _search(**options).fit(X, y)
+
+    assert len(second.records) == len(first.records)
+    assert second.best_params() == first.best_params()
+
+
+def test_resource_in_the_grid_is_rejected(tmp_path, data):
+    X, y = data
+    search = HyperparameterSearch(None, {"forest": RandomForestClassifier()},
+                                  {"forest": {"n_estimators": [10, 50]}}, halving=True, resource="n_estimators",
+                                  max_resources=50, workers=1, cache_dir=tmp_path)
+
+    with pytest.raises(ValueError, match="n_estimators"):
+        search.fit(X, y)
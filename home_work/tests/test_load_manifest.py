@@ -0,0 +1,118 @@
+import pytest
+
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, func, select
+
+from movielens_eda_exercise.database import Base
+from movielens_eda_exercise.load_manifest import (STATUS_COMPLETE, STATUS_LOADING, LoadPlan, chunks_table,
+                                                  complete_load, fail_load, manifest_table, plan_load,
+                                                  read_manifest, record_chunk)
+
+CHECKSUM = "crc32:0000abcd:1000"
+CHUNK_SIZE = 100
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'manifest.db'}")
+    Base.metadata.create_all(engine, tables=[manifest_table, chunks_table])
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def table(engine):
+    table = Table("ratings", MetaData(), Column("id", Integer, primary_key=True))
+    table.create(engine)
+    return table
+
+
+def _load_chunks(engine, table, chunks):
+    """Inserts one row per chunk and records the chunk, as the loaders do in the chunk's transaction."""
+    for index in chunks:
+        with engine.begin() as conn:
+            conn.execute(table.insert().values(id=index))
+            record_chunk(conn, table, index, 1)
+
+
+def _rows(engine, table) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+def _manifest(engine, table):
+    with engine.connect() as conn:
+        return read_manifest(conn, table.name)
+
+
+def test_first_load_starts_fresh(engine, table):
+    plan = plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+
+    assert plan == LoadPlan(False, 0, frozenset())
+    entry = _manifest(engine, table)
+    assert entry.status == STATUS_LOADING
+    assert (entry.zip_checksum, entry.chunk_size, entry.last_chunk) == (CHECKSUM, CHUNK_SIZE, -1)
+
+
+def test_unchanged_complete_load_is_skipped(engine, table):
+    plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+    _load_chunks(engine, table, range(3))
+    assert complete_load(engine, table) == 3
+
+    plan = plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+
+    assert plan.skip
+    assert _rows(engine, table) == 3
+    assert _manifest(engine, table).status == STATUS_COMPLETE
+
+
+def test_interrupted_load_resumes_after_the_committed_prefix(engine, table):
+    plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+    # chunk 2 never committed, chunk 3 did (the chunks are loaded in parallel)
+    _load_chunks(engine, table, [0, 1, 3])
+
+    plan = plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+
+    assert plan == LoadPlan(False, 2, frozenset({3}))
+    assert _rows(engine, table) == 3
+    assert _manifest(engine, table).last_chunk == 1
+
+
+@pytest.mark.parametrize("checksum, chunk_size, force", [
+    ("crc32:ffff0000:2000", CHUNK_SIZE, False),
+    (CHECKSUM, CHUNK_SIZE * 2, False),
+    (CHECKSUM, CHUNK_SIZE, True),
+])
+def test_changed_member_chunk_size_or_force_truncates(engine, table, checksum, chunk_size, force):
+    plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+    _load_chunks(engine, table, [0, 1])
+
+    plan = plan_load(engine, table, "ml/ratings.csv", checksum, chunk_size, force=force)
+
+    assert plan == LoadPlan(False, 0, frozenset())
+    assert _rows(engine, table) == 0
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(chunks_table)).scalar() == 0
+    entry = _manifest(engine, table)
+    assert (entry.zip_checksum, entry.chunk_size, entry.status) == (checksum, chunk_size, STATUS_LOADING)
+
+
+def test_complete_load_with_another_member_truncates(engine, table):
+    plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+    _load_chunks(engine, table, range(2))
+    complete_load(engine, table)
+
+    plan = plan_load(engine, table, "ml/ratings.csv", "crc32:ffff0000:2000", CHUNK_SIZE)
+
+    assert not plan.skip
+    assert _rows(engine, table) == 0
+
+
+def test_failed_load_is_not_resumed(engine, table):
+    plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+    _load_chunks(engine, table, [0, 1])
+    fail_load(engine, table)
+
+    plan = plan_load(engine, table, "ml/ratings.csv", CHECKSUM, CHUNK_SIZE)
+
+    assert plan == LoadPlan(False, 0, frozenset())
+    assert _rows(engine, table) == 0
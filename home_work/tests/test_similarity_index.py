@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+from movielens_eda_exercise.similarity_index import (SimilarityIndex, build_rating_matrix, build_similarity_index,
+                                                     normalized_item_vectors)
+
+K = 5
+
+
+@pytest.fixture
+def ratings():
+    rng = np.random.default_rng(3)
+    users, movies = np.nonzero(rng.random((60, 40)) < 0.5)
+    return pd.DataFrame({"userId": users + 1, "movieId": (movies + 1) * 10,
+                         "rating": rng.integers(1, 11, len(users)) / 2,
+                         "timestamp": rng.integers(0, 10 ** 9, len(users))})
+
+
+def _brute_force(matrix: sp.csr_matrix, adjusted: bool) -> np.ndarray:
+    """Dense item x item similarities, the item itself excluded."""
+    dense = matrix.toarray().astype(np.float64)
+    rated = dense != 0
+    if adjusted:
+        means = dense.sum(axis=1) / np.maximum(rated.sum(axis=1), 1)
+        dense = np.where(rated, dense - means[:, None], 0.0)
+    items = dense.T
+    norms = np.linalg.norm(items, axis=1)
+    items = items / np.where(norms > 0, norms, 1)[:, None]
+    similarities = items @ items.T
+    np.fill_diagonal(similarities, -np.inf)
+    return similarities
+
+
+@pytest.mark.parametrize("adjusted", [True, False])
+def test_top_k_matches_brute_force(tmp_path, ratings, adjusted):
+    matrix = build_rating_matrix([ratings[i:i + 400] for i in range(0, len(ratings), 400)], index_dir=tmp_path)
+    # blocks that do not divide the item count
+    build_similarity_index(matrix, index_dir=tmp_path, k=K, adjusted=adjusted, block_size=7, workers=2)
+    neighbors = np.load(tmp_path / "neighbors.npy")
+    scores = np.load(tmp_path / "scores.npy")
+
+    expected = _brute_force(matrix, adjusted)
+    for item in range(matrix.shape[1]):
+        best = np.sort(expected[item])[::-1][:K]
+        np.testing.assert_allclose(scores[item], best, atol=1e-5)
+        # ties may pick other neighbours, but always ones with the same similarity
+        np.testing.assert_allclose(expected[item, neighbors[item]], scores[item], atol=1e-5)
+        assert item not in neighbors[item]
+
+
+def test_lookup_returns_movie_ids_best_first(tmp_path, ratings):
+    matrix = build_rating_matrix([ratings], index_dir=tmp_path)
+    build_similarity_index(matrix, index_dir=tmp_path, k=K, workers=1)
+    index = SimilarityIndex(tmp_path)
+
+    movie_ids, scores = index.similar_movies(10, n=3)
+
+    # movie 10 is column 0, movie m column m / 10 - 1
+    items = normalized_item_vectors(matrix).toarray()
+    similarities = items @ items[0]
+    np.testing.assert_allclose(scores, np.sort(similarities[1:])[::-1][:3], atol=1e-5)
+    np.testing.assert_allclose(similarities[movie_ids // 10 - 1], scores, atol=1e-5)
+    with pytest.raises(KeyError):
+        index.similar_movies(15)
+
+
+def test_duplicate_ratings_keep_the_latest(tmp_path):
+    chunks = [pd.DataFrame({"userId": [1, 1, 2], "movieId": [10, 20, 10], "rating": [1.0, 2.0, 3.0],
+                            "timestamp": [300, 100, 100]}),
+              pd.DataFrame({"userId": [1, 1], "movieId": [10, 20], "rating": [5.0, 4.0], "timestamp": [200, 200]})]
+
+    matrix = build_rating_matrix(chunks, index_dir=tmp_path)
+
+    assert matrix.nnz == 3
+    assert matrix.toarray().tolist() == [[1.0, 4.0], [3.0, 0.0]]
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from movielens_eda_exercise.sketches import CountMinSketch, HyperLogLog, TDigest
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(7)
+
+
+@pytest.mark.parametrize("distinct", [500, 20_000, 300_000])
+def test_hyperloglog_error_is_within_a_few_standard_errors(rng, distinct):
+    values = rng.permutation(distinct).repeat(2)
+    hll = HyperLogLog(precision=14)
+    for chunk in np.array_split(values, 7):
+        hll.add(chunk)
+
+    # the standard error of precision 14 is 1.04 / sqrt(2**14), about 0.8%
+    assert abs(hll.count() - distinct) / distinct < 0.03
+
+
+def test_hyperloglog_merge_counts_the_union(rng):
+    left, right = HyperLogLog(), HyperLogLog()
+    left.add(np.arange(0, 60_000))
+    right.add(np.arange(40_000, 100_000))
+
+    assert abs(left.merge(right).count() - 100_000) / 100_000 < 0.03
+
+
+def _within_rank(sorted_values: np.ndarray, estimate: float, q: float, error: float = 0.01) -> bool:
+    """Whether `estimate` lies between the exact (q - error) and (q + error) quantiles."""
+    n = len(sorted_values)
+    lo = sorted_values[max(0, int(np.floor((q - error) * n)))]
+    hi = sorted_values[min(n - 1, int(np.ceil((q + error) * n)))]
+    return lo <= estimate <= hi
+
+
+@pytest.mark.parametrize("distribution", ["normal", "exponential", "ratings"])
+def test_tdigest_quantiles_are_within_rank_bounds(rng, distribution):
+    values = {"normal": lambda: rng.normal(3.5, 1.0, 200_000),
+              "exponential": lambda: rng.exponential(1.0, 200_000),
+              "ratings": lambda: rng.integers(1, 11, 200_000) / 2}[distribution]()
+    digest = TDigest(compression=200)
+    for chunk in np.array_split(values, 10):
+        digest.add(chunk)
+    exact = np.sort(values)
+
+    assert digest.total == len(values)
+    for q in (0.001, 0.01, 0.25, 0.5, 0.75, 0.99, 0.999):
+        assert _within_rank(exact, digest.quantile(q), q)
+    assert digest.quantile(0) == exact[0]
+    assert digest.quantile(1) == exact[-1]
+
+
+def test_tdigest_merge_matches_a_single_digest(rng):
+    values = rng.normal(0, 1, 100_000)
+    parts = [TDigest() for _ in range(4)]
+    for part, chunk in zip(parts, np.array_split(values, 4)):
+        part.add(chunk)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    exact = np.sort(values)
+
+    assert merged.total == len(values)
+    for q in (0.01, 0.5, 0.99):
+        assert _within_rank(exact, merged.quantile(q), q)
+
+
+def test_count_min_never_underestimates_and_stays_within_its_bound(rng):
+    values = rng.zipf(1.3, 200_000)
+    values = values[values < 100_000]
+    sketch = CountMinSketch(width=1 << 12, depth=4)
+    for chunk in np.array_split(values, 8):
+        sketch.add(chunk)
+    keys, counts = np.unique(values, return_counts=True)
+    estimates = sketch.estimate(keys)
+
+    assert sketch.total == len(values)
+    assert (estimates >= counts).all()
+    # overestimate <= e / width * total with probability 1 - exp(-depth) per key
+    bound = np.e / sketch.width * sketch.total
+    assert np.mean(estimates - counts > bound) < 0.05
+
+
+def test_count_min_top_values_are_the_heavy_hitters(rng):
+    values = rng.zipf(1.5, 100_000)
+    sketch = CountMinSketch(top_k=5)
+    for chunk in np.array_split(values, 10):
+        sketch.add(chunk)
+    other = CountMinSketch(top_k=5)
+    more = rng.zipf(1.5, 10_000)
+    other.add(more)
+    sketch.merge(other)
+
+    keys, counts = np.unique(np.concatenate([values, more]), return_counts=True)
+    top = keys[np.argsort(-counts)[:5]]
+    assert [key for key, _ in sketch.most_common()] == top.tolist()